@@ -0,0 +1,40 @@
+# answers.py
+# Questionnaire answers, one FSM data field per answer ("answer:<key>").
+# A step writes only its own field; the whole record is read once, in finish_and_send.
+from typing import Any, Dict
+
+from aiogram.fsm.context import FSMContext
+
+from fsm_storage import CachedStorage
+
+ANSWER_PREFIX = "answer:"
+
+
+async def _set_fields(state: FSMContext, fields: Dict[str, Any]):
+    if isinstance(state.storage, CachedStorage):
+        await state.storage.set_fields(state.key, fields)  # no copy of the whole data dict
+    else:
+        await state.update_data(fields)
+
+
+async def set_field(state: FSMContext, field: str, value: Any):
+    await _set_fields(state, {field: value})
+
+
+async def get_field(state: FSMContext, field: str, default: Any = None) -> Any:
+    if isinstance(state.storage, CachedStorage):
+        return await state.storage.get_field(state.key, field, default)
+    return (await state.get_data()).get(field, default)
+
+
+async def set_answer(state: FSMContext, key: str, value: Any):
+    await _set_fields(state, {ANSWER_PREFIX + key: value})
+
+
+async def get_answer(state: FSMContext, key: str, default: Any = None) -> Any:
+    return await get_field(state, ANSWER_PREFIX + key, default)
+
+
+async def get_answers(state: FSMContext) -> Dict[str, Any]:
+    n = len(ANSWER_PREFIX)
+    return {k[n:]: v for k, v in (await state.get_data()).items() if k.startswith(ANSWER_PREFIX)}
@@ -0,0 +1,392 @@
+# archive.py
+# Local archive of completed applications (SQLite) with duplicate-applicant lookup.
+#
+# Every finished form is one row; the answers are kept as JSON next to indexed columns
+# (user id, E.164 phone, job type, date). The duplicate check at submit time is two
+# index lookups, so it costs the same with 100 or 500k stored applications.
+import asyncio
+import json
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS applications (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    phone TEXT,
+    job TEXT,
+    created_at INTEGER NOT NULL,
+    full_name TEXT,
+    username TEXT,
+    answers TEXT NOT NULL,
+    update_id INTEGER            -- the update that finished the form: a replay adds nothing
+);
+CREATE INDEX IF NOT EXISTS applications_user ON applications (user_id, created_at);
+CREATE INDEX IF NOT EXISTS applications_phone ON applications (phone, created_at);
+CREATE INDEX IF NOT EXISTS applications_job ON applications (job, created_at);
+CREATE INDEX IF NOT EXISTS applications_created ON applications (created_at);
+-- admin reports not delivered yet, written with the application: a crash does not lose them
+CREATE TABLE IF NOT EXISTS reports (
+    application_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    admins TEXT NOT NULL,        -- JSON list: admins still waiting for it
+    report TEXT NOT NULL,        -- JSON: notify.Report fields
+    created_at INTEGER NOT NULL
+);
+-- everyone who ever submitted a form: the /broadcast audience
+CREATE TABLE IF NOT EXISTS recipients (
+    user_id INTEGER PRIMARY KEY,
+    last_at INTEGER NOT NULL,
+    blocked_at INTEGER,          -- the bot got 403 from this chat
+    broadcast_id INTEGER         -- last broadcast handled for this chat (sent, blocked or failed)
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY,
+    admin_id INTEGER NOT NULL,
+    from_chat INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    job TEXT,
+    state TEXT NOT NULL,         -- running / done / cancelled
+    created_at INTEGER NOT NULL,
+    finished_at INTEGER,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    admins_done INTEGER NOT NULL DEFAULT 0,
+    status_msg_id INTEGER
+);
+-- local copies of candidates' voice / video answers, one row per Telegram file
+CREATE TABLE IF NOT EXISTS media (
+    file_unique_id TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,         -- pending / done / failed / skipped
+    size INTEGER,
+    path TEXT,
+    error TEXT,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_user ON media (user_id);
+CREATE INDEX IF NOT EXISTS media_state ON media (state);
+"""
+
+BROADCAST_FIELDS = (
+    "id", "admin_id", "from_chat", "message_id", "job", "state", "created_at", "finished_at",
+    "total", "sent", "blocked", "failed", "admins_done", "status_msg_id",
+)
+OUTCOMES = ("sent", "blocked", "failed")
+
+
+def normalize_phone(text: str, country_code: str = "998") -> Optional[str]:
+    # "+998 90 999-88-77", "998909998877", "90 999 88 77", "00998..." -> "+998909998877"
+    if not text:
+        return None
+    raw = text.strip()
+    digits = re.sub(r"\D", "", raw)
+    if raw.startswith("00"):
+        digits = digits[2:]
+    elif not raw.startswith("+") and len(digits) == 9:
+        digits = country_code + digits  # local number without the country code
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+@dataclass
+class Previous:
+    count: int
+    last_at: int
+    last_job: str
+
+
+class Archive:
+    def __init__(self, path: str = "applications.sqlite3"):
+        self.path = path
+        # same pattern as SQLiteStorage: one thread owns the connection
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-sqlite")
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        fresh = not self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'recipients'").fetchone()
+        self._db.executescript(SCHEMA)
+        if "update_id" not in {r[1] for r in self._db.execute("PRAGMA table_info(applications)")}:
+            self._db.execute("ALTER TABLE applications ADD COLUMN update_id INTEGER")  # archives before it
+        # per user: update ids restart at random after a quiet week
+        self._db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS applications_update ON applications (user_id, update_id) "
+            "WHERE update_id IS NOT NULL"
+        )
+        if fresh:
+            # archives from before the registry: everyone who applied so far
+            self._db.execute(
+                "INSERT OR IGNORE INTO recipients (user_id, last_at) "
+                "SELECT user_id, MAX(created_at) FROM applications GROUP BY user_id"
+            )
+
+    async def _run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _previous_sync(self, user_id: int, phone: Optional[str]) -> Optional[Previous]:
+        # one index range per column; UNION drops rows matched by both
+        sql = "SELECT id, created_at, job FROM applications WHERE user_id = ?"
+        args: List[Any] = [user_id]
+        if phone:
+            sql += " UNION SELECT id, created_at, job FROM applications WHERE phone = ?"
+            args.append(phone)
+        rows = self._db.execute(sql, args).fetchall()
+        if not rows:
+            return None
+        _, last_at, last_job = max(rows, key=lambda r: r[1])
+        return Previous(len(rows), last_at, last_job or "")
+
+    def _add_sync(self, user_id: int, phone: Optional[str], job: str, full_name: str, username: str,
+                  answers: Dict[str, Any], update_id: Optional[int], admins: List[int],
+                  report: Optional[Callable[[int, Optional[Previous]], Dict[str, Any]]]):
+        with self._db:
+            # IMMEDIATE: the write lock up front. A deferred BEGIN that reads first cannot
+            # upgrade while another worker process writes ("database is locked" at once,
+            # the busy timeout does not apply to the upgrade)
+            self._db.execute("BEGIN IMMEDIATE")
+            if update_id is not None and self._db.execute(
+                    "SELECT 1 FROM applications WHERE user_id = ? AND update_id = ?", (user_id, update_id)).fetchone():
+                return None  # replayed after a crash: archived (and its report queued) already
+            previous = self._previous_sync(user_id, phone)
+            cur = self._db.execute(
+                "INSERT INTO applications (user_id, phone, job, created_at, full_name, username, answers, update_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, phone, job, int(time.time()), full_name, username, json.dumps(answers, ensure_ascii=False),
+                 update_id),
+            )
+            if report and admins:
+                self._db.execute(
+                    "INSERT INTO reports (application_id, user_id, admins, report, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (cur.lastrowid, user_id, json.dumps(admins),
+                     json.dumps(report(cur.lastrowid, previous), ensure_ascii=False), int(time.time())),
+                )
+            # a new form also means the chat is open again
+            self._db.execute(
+                "INSERT INTO recipients (user_id, last_at) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET last_at = excluded.last_at, blocked_at = NULL",
+                (user_id, int(time.time())),
+            )
+        return cur.lastrowid, previous
+
+    async def add(self, user_id: int, phone: Optional[str], job: str, full_name: str = "", username: str = "",
+                  answers: Optional[Dict[str, Any]] = None, update_id: Optional[int] = None,
+                  admins: Iterable[int] = (), report: Optional[Callable[[int, Optional[Previous]], Dict]] = None):
+        # -> (application id, Previous or None); check and insert in one transaction.
+        # report(application id, previous) -> the admin report, queued in the same
+        # transaction (see pending_reports). None if update_id was archived before.
+        return await self._run(self._add_sync, user_id, phone, job, full_name, username, answers or {},
+                               update_id, list(admins), report)
+
+    def _find_sync(self, user_id: Optional[int], phone: Optional[str], limit: int):
+        column, value = ("phone", phone) if phone else ("user_id", user_id)
+        return self._db.execute(
+            f"SELECT id, user_id, phone, job, created_at, full_name FROM applications "
+            f"WHERE {column} = ? ORDER BY created_at DESC LIMIT ?",
+            (value, limit),
+        ).fetchall()
+
+    async def find(self, user_id: Optional[int] = None, phone: Optional[str] = None, limit: int = 10):
+        return await self._run(self._find_sync, user_id, phone, limit)
+
+    # ---- admin report outbox ----
+
+    def _pending_reports_sync(self) -> List[Tuple[int, int, List[int], Dict[str, Any]]]:
+        return [(app_id, user_id, json.loads(admins), json.loads(report)) for app_id, user_id, admins, report in
+                self._db.execute("SELECT application_id, user_id, admins, report FROM reports ORDER BY application_id")]
+
+    async def pending_reports(self) -> List[Tuple[int, int, List[int], Dict[str, Any]]]:
+        # (application id, user id, admins still waiting, report) queued by add()
+        return await self._run(self._pending_reports_sync)
+
+    def _report_delivered_sync(self, application_id: int, admin_id: int):
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute("SELECT admins FROM reports WHERE application_id = ?", (application_id,)).fetchone()
+            if not row:
+                return
+            left = [a for a in json.loads(row[0]) if a != admin_id]
+            if left:
+                self._db.execute("UPDATE reports SET admins = ? WHERE application_id = ?",
+                                 (json.dumps(left), application_id))
+            else:
+                self._db.execute("DELETE FROM reports WHERE application_id = ?", (application_id,))
+
+    async def report_delivered(self, application_id: int, admin_id: int):
+        # this admin got the report (or the notifier gave up on them)
+        await self._run(self._report_delivered_sync, application_id, admin_id)
+
+    # ---- broadcasts ----
+    # A chat is done for broadcast N once recipients.broadcast_id = N, written together
+    # with the counter in one transaction right after the send: a restarted job skips it.
+
+    @staticmethod
+    def _audience(job: Optional[str]) -> Tuple[str, List[Any]]:
+        sql = "blocked_at IS NULL"
+        args: List[Any] = []
+        if job:
+            # per chat one range of applications_user
+            sql += " AND EXISTS (SELECT 1 FROM applications a WHERE a.user_id = r.user_id AND a.job = ?)"
+            args.append(job)
+        return sql, args
+
+    def _start_broadcast_sync(self, admin_id: int, from_chat: int, message_id: int, job: Optional[str]):
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            if self._db.execute("SELECT 1 FROM broadcasts WHERE state = 'running'").fetchone():
+                return None  # one at a time, also across worker processes
+            where, args = self._audience(job)
+            total = self._db.execute(f"SELECT COUNT(*) FROM recipients r WHERE {where}", args).fetchone()[0]
+            cur = self._db.execute(
+                "INSERT INTO broadcasts (admin_id, from_chat, message_id, job, state, created_at, total) "
+                "VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (admin_id, from_chat, message_id, job, int(time.time()), total),
+            )
+        return self._get_broadcast_sync(cur.lastrowid)
+
+    async def start_broadcast(self, admin_id: int, from_chat: int, message_id: int,
+                              job: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        # -> the new broadcast row, or None while another one is running
+        return await self._run(self._start_broadcast_sync, admin_id, from_chat, message_id, job)
+
+    def _get_broadcast_sync(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        row = self._db.execute(
+            f"SELECT {', '.join(BROADCAST_FIELDS)} FROM broadcasts WHERE id = ?", (broadcast_id,)
+        ).fetchone()
+        return dict(zip(BROADCAST_FIELDS, row)) if row else None
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        return await self._run(self._get_broadcast_sync, broadcast_id)
+
+    def _running_broadcasts_sync(self) -> List[Dict[str, Any]]:
+        rows = self._db.execute(
+            f"SELECT {', '.join(BROADCAST_FIELDS)} FROM broadcasts WHERE state = 'running' ORDER BY id"
+        ).fetchall()
+        return [dict(zip(BROADCAST_FIELDS, r)) for r in rows]
+
+    async def running_broadcasts(self) -> List[Dict[str, Any]]:
+        return await self._run(self._running_broadcasts_sync)
+
+    def _broadcast_page_sync(self, broadcast_id: int, job: Optional[str], after: int, limit: int) -> List[int]:
+        where, args = self._audience(job)
+        return [r[0] for r in self._db.execute(
+            f"SELECT user_id FROM recipients r WHERE user_id > ? AND {where} "
+            f"AND (broadcast_id IS NULL OR broadcast_id < ?) ORDER BY user_id LIMIT ?",
+            [after, *args, broadcast_id, limit],
+        )]
+
+    async def broadcast_page(self, broadcast_id: int, job: Optional[str], after: int = 0, limit: int = 200) -> List[int]:
+        # next chats (by user id) that have not got this broadcast yet
+        return await self._run(self._broadcast_page_sync, broadcast_id, job, after, limit)
+
+    def _broadcast_done_sync(self, broadcast_id: int, user_id: int, outcome: str):
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "UPDATE recipients SET broadcast_id = ?, blocked_at = CASE WHEN ? THEN ? ELSE blocked_at END "
+                "WHERE user_id = ?",
+                (broadcast_id, outcome == "blocked", int(time.time()), user_id),
+            )
+            self._db.execute(f"UPDATE broadcasts SET {outcome} = {outcome} + 1 WHERE id = ?", (broadcast_id,))
+
+    async def broadcast_done(self, broadcast_id: int, user_id: int, outcome: str):
+        if outcome not in OUTCOMES:
+            raise ValueError(outcome)
+        await self._run(self._broadcast_done_sync, broadcast_id, user_id, outcome)
+
+    def _update_broadcast_sync(self, broadcast_id: int, fields: Dict[str, Any]):
+        if "state" in fields and fields["state"] != "running":
+            fields["finished_at"] = int(time.time())
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        self._db.execute(f"UPDATE broadcasts SET {cols} WHERE id = ?", [*fields.values(), broadcast_id])
+
+    async def update_broadcast(self, broadcast_id: int, **fields):
+        bad = set(fields) - set(BROADCAST_FIELDS)
+        if bad:
+            raise ValueError(f"unknown broadcast fields: {bad}")
+        await self._run(self._update_broadcast_sync, broadcast_id, fields)
+
+    # ---- media copies ----
+
+    def _claim_media_sync(self, file_unique_id: str, file_id: str, user_id: int, kind: str) -> bool:
+        cur = self._db.execute(
+            "INSERT OR IGNORE INTO media (file_unique_id, file_id, user_id, kind, state, created_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?)",
+            (file_unique_id, file_id, user_id, kind, int(time.time())),
+        )
+        return cur.rowcount == 1
+
+    async def claim_media(self, file_unique_id: str, file_id: str, user_id: int, kind: str) -> bool:
+        # True for the first claim of this file: the caller downloads it; the same file sent
+        # again (or taken by another worker process) is False
+        return await self._run(self._claim_media_sync, file_unique_id, file_id, user_id, kind)
+
+    def _media_finished_sync(self, file_unique_id: str, state: str, size: Optional[int], path: Optional[str],
+                             error: Optional[str]):
+        self._db.execute(
+            "UPDATE media SET state = ?, size = ?, path = ?, error = ? WHERE file_unique_id = ?",
+            (state, size, path, error, file_unique_id),
+        )
+
+    async def media_finished(self, file_unique_id: str, state: str, size: Optional[int] = None,
+                             path: Optional[str] = None, error: Optional[str] = None):
+        await self._run(self._media_finished_sync, file_unique_id, state, size, path, error)
+
+    def _pending_media_sync(self) -> List[Tuple[str, str, int, str]]:
+        return self._db.execute(
+            "SELECT file_unique_id, file_id, user_id, kind FROM media WHERE state = 'pending' ORDER BY created_at"
+        ).fetchall()
+
+    async def pending_media(self) -> List[Tuple[str, str, int, str]]:
+        # (file_unique_id, file_id, user_id, kind) claimed but not finished, e.g. cut by a restart
+        return await self._run(self._pending_media_sync)
+
+    async def media_bytes(self) -> int:
+        # disk used by the stored copies
+        return await self._run(lambda: self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM media WHERE state = 'done'"
+        ).fetchone()[0])
+
+    async def close(self):
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+
+
+def iter_applications(path: str, job: Optional[str] = None, start: Optional[int] = None,
+                      end: Optional[int] = None, chunk: int = 1000) -> Iterator[Tuple]:
+    # (id, created_at, user_id, username, job, answers dict), oldest first, `chunk` rows
+    # in memory at a time. Own read-only connection: with WAL it does not block writers,
+    # so a long export runs in any thread next to the archive's own one.
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    where, args = [], []
+    if job:
+        where.append("job = ?")
+        args.append(job)
+    if start is not None:
+        where.append("created_at >= ?")
+        args.append(start)
+    if end is not None:
+        where.append("created_at < ?")
+        args.append(end)
+    sql = "SELECT id, created_at, user_id, username, job, answers FROM applications"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    try:
+        # (job, created_at) or (created_at) index: rows come in index order, no sort step
+        cur = db.execute(sql + " ORDER BY created_at, id", args)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            for app_id, created_at, user_id, username, job_, answers in rows:
+                yield app_id, created_at, user_id, username, job_, json.loads(answers)
+    finally:
+        db.close()
@@ -0,0 +1,88 @@
+# bench/answers_step_cost.py
+# Per-step cost of storing one questionnaire answer, for the 22 steps of one form:
+#   dict  - old pattern: get_data()["answers"], change one key, update_data(answers=...)
+#   field - answers.set_answer(): one data field per answer
+#
+#   python -m bench.answers_step_cost --forms 200
+#
+# Every step runs inside CoalescingMiddleware together with set_state(), like a real update.
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from answers import set_answer
+from fsm_storage import CachedStorage, CoalescingMiddleware, SQLiteStorage
+
+STEPS = 22
+ANSWER = "x" * 120  # typical free-text answer
+
+
+async def step_dict(state: FSMContext, i: int):
+    answers = (await state.get_data()).get("answers", {})
+    answers[f"q{i}"] = ANSWER
+    await state.update_data(answers=answers)
+    await state.set_state(f"FormState:q{i + 1}")
+
+
+async def step_field(state: FSMContext, i: int):
+    await set_answer(state, f"q{i}", ANSWER)
+    await state.set_state(f"FormState:q{i + 1}")
+
+
+async def run(storage, step, forms: int) -> dict:
+    written = [0] * STEPS
+    if isinstance(storage, CachedStorage):
+        store = storage._store
+
+        async def counting_store(ops):
+            written[current[0]] += sum(len(v) for _, _, fields, _ in ops for v in fields.values())
+            await store(ops)
+        storage._store = counting_store
+    mw = CoalescingMiddleware(storage)
+    per_step = [0.0] * STEPS
+    current = [0]
+    for f in range(forms):
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=f, user_id=f))
+        for i in range(STEPS):
+            current[0] = i
+
+            async def handler(event, data, i=i):
+                await step(state, i)
+            t0 = time.perf_counter()
+            await mw(handler, None, {})
+            per_step[i] += time.perf_counter() - t0
+        await state.clear()
+    return {
+        "step_us": [round(t / forms * 1e6, 1) for t in per_step],
+        "form_us": round(sum(per_step) / forms * 1e6, 1),
+        "bytes_written_per_step": [w // forms for w in written] if isinstance(storage, CachedStorage) else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="per-step answer storage cost")
+    parser.add_argument("--forms", type=int, default=200)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, make in (
+            ("memory", MemoryStorage),
+            ("sqlite", lambda: SQLiteStorage(os.path.join(tmp, "bench.sqlite3"))),
+        ):
+            for pattern, step in (("dict", step_dict), ("field", step_field)):
+                storage = make()
+                results[f"{name}/{pattern}"] = await run(storage, step, args.forms)
+                await storage.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+# bench/archive_dup_check.py
+# Duplicate-applicant check and insert cost as the archive grows.
+#
+#   python -m bench.archive_dup_check --rows 300000
+#
+# Fills a fresh archive with --rows applications, then times Archive.add (check +
+# insert) for new and repeat applicants, and prints the query plan of the check.
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from archive import Archive
+from bench.webhook_vs_polling import percentile
+
+JOBS = ["Sotuvchi", "Marketolog", "HR", "Omborchi", "Boshqa"]
+
+
+def fill(archive: Archive, rows: int):
+    now = int(time.time())
+    db = archive._db
+    with db:
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT INTO applications (user_id, phone, job, created_at, full_name, username, answers) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (1_000_000 + i, f"+99890{i:07d}", JOBS[i % len(JOBS)], now - i * 60, f"User {i}", "", "{}")
+                for i in range(rows)
+            ),
+        )
+
+
+async def timed(n: int, make_args) -> list:
+    result = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        await make_args(i)
+        result.append((time.perf_counter() - t0) * 1000)
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="archive duplicate check at scale")
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--checks", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = Archive(os.path.join(tmp, "applications.sqlite3"))
+        t0 = time.perf_counter()
+        fill(archive, args.rows)
+        fill_s = time.perf_counter() - t0
+
+        new = await timed(args.checks, lambda i: archive.add(5_000_000 + i, f"+99891{i:07d}", "HR"))
+        repeat = await timed(args.checks, lambda i: archive.add(
+            1_000_000 + random.randrange(args.rows), f"+99890{random.randrange(args.rows):07d}", "HR",
+        ))
+        plan = archive._db.execute(
+            "EXPLAIN QUERY PLAN SELECT id, created_at, job FROM applications WHERE user_id = ? "
+            "UNION SELECT id, created_at, job FROM applications WHERE phone = ?",
+            (1, "+1"),
+        ).fetchall()
+        await archive.close()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "fill_s": round(fill_s, 2),
+        "add_new_ms": {"p50": round(percentile(new, 50), 3), "p99": round(percentile(new, 99), 3)},
+        "add_repeat_ms": {"p50": round(percentile(repeat, 50), 3), "p99": round(percentile(repeat, 99), 3)},
+        "plan": [row[-1] for row in plan],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
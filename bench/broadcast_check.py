@@ -0,0 +1,161 @@
+# bench/broadcast_check.py
+# /broadcast end to end against the fake Bot API, in-process, with the real outbound limits.
+#
+#   python -m bench.broadcast_check [--recipients 300] [--blocked 30] [--live 5]
+#
+# The archive gets `--recipients` past candidates, `--blocked` of whom blocked the bot.
+# The admin starts a broadcast; half-way the job is cancelled like a crash would stop it,
+# and a fresh start resumes it. Meanwhile `--live` candidates fill in their forms, and
+# their reply latency is compared with the same traffic before the broadcast. Checks:
+# every open chat got the message once (a crash may repeat the few sends in flight),
+# blocked chats are marked, the send rate stays within OUT_GLOBAL_RATE.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from bench.replay_flow import setup_env, step_input
+
+FIRST_CHAT = 800_000
+LIVE_CHAT = 900_000
+
+
+async def live_forms(fake, fake_mod, B, kinds, chats, job, ids, pause: float) -> list:
+    # every chat answers its form step by step; -> reply latency of each update, ms
+    form = B.questionnaire_for(job)
+    latencies = []
+
+    async def one(chat):
+        updates = [fake_mod.make_message_update(next(ids), chat, "/start"),
+                   fake_mod.make_callback_update(next(ids), chat, f"job|{job}")]
+        updates += [step_input(fake_mod, next(ids), chat, i, s, kinds) for i, s in enumerate(form.steps)]
+        for update in updates:
+            reply = fake.wait_reply(chat)
+            t0 = time.perf_counter()
+            await B.dp.feed_raw_update(B.bot, update)
+            _, at = await asyncio.wait_for(reply, 30)
+            latencies.append((at - t0) * 1000)
+            await asyncio.sleep(pause)
+
+    await asyncio.gather(*(one(c) for c in chats))
+    return latencies
+
+
+def pct(values, q):
+    return round(statistics.quantiles(values, n=100)[q - 1], 1) if len(values) > 1 else None
+
+
+async def run(args) -> list:
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    import bot as B
+
+    B.throttle.limits = {}
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=args.api_port)
+    admin_id = B.config.ADMINS[0]
+    failures = []
+    ids = iter(range(1, 10_000_000))
+    workflow = {}
+    recipients = [FIRST_CHAT + i for i in range(args.recipients)]
+    fake.blocked.update(recipients[::max(args.recipients // max(args.blocked, 1), 1)][:args.blocked])
+    try:
+        for chat in recipients:
+            await B.archive.add(chat, None, args.job if chat % 2 else "Sotuvchi")
+        workflow = {"dispatcher": B.dp, "bots": [B.bot], **B.dp.workflow_data}
+        await B.dp.emit_startup(bot=B.bot, **workflow)
+
+        live = [LIVE_CHAT + i for i in range(args.live)]
+        before = await live_forms(fake, fake_mod, B, kinds, live, args.job, ids, args.pause)
+
+        # the admin replies /broadcast to a message of their own
+        src = fake_mod.make_message_update(next(ids), admin_id, "Suhbat kuni: 1-iyun")["message"]
+        await B.dp.feed_raw_update(B.bot, fake_mod.make_message_update(
+            next(ids), admin_id, "/broadcast", reply_to_message=src,
+        ))
+        started = time.perf_counter()
+        live = [LIVE_CHAT + args.live + i for i in range(args.live)]
+        during_task = asyncio.create_task(live_forms(fake, fake_mod, B, kinds, live, args.job, ids, args.pause))
+
+        def copies():
+            return Counter(chat for chat, m, _ in fake.sent_log if m == "copyMessage")
+
+        while sum(copies().values()) < (args.recipients - args.blocked) // 2:
+            await asyncio.sleep(0.05)
+        await B.broadcaster.close()  # "crash": the row stays running, in-flight sends are lost
+        crashed_at = sum(copies().values())
+        await B.broadcaster.resume()
+        while B.broadcaster.stats()["running"]:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        during = await during_task
+        await B.scheduler.wait_closed(60)
+
+        got = copies()
+        b = (await B.archive.running_broadcasts() or [None])[0]
+        if b is not None:
+            failures.append(f"broadcast still running: {b}")
+        # the live candidates applied too: they are recipients as well
+        open_chats = [r[0] for r in B.archive._db.execute("SELECT user_id FROM recipients WHERE blocked_at IS NULL")]
+        missing = [c for c in open_chats if not got[c]]
+        repeated = sum(got[c] - 1 for c in open_chats if got[c] > 1)
+        if missing:
+            failures.append(f"{len(missing)} recipients did not get the broadcast")
+        if repeated > B.config.BROADCAST_CONCURRENCY:
+            failures.append(f"{repeated} repeated sends after the restart (max {B.config.BROADCAST_CONCURRENCY} in flight)")
+        admins = [a for a in B.config.ADMINS if a != admin_id]
+        if any(got[a] != 1 for a in admins):
+            failures.append("other admins did not get the broadcast once")
+        blocked = B.archive._db.execute("SELECT COUNT(*) FROM recipients WHERE blocked_at IS NOT NULL").fetchone()[0]
+        if blocked != len(fake.blocked):
+            failures.append(f"{blocked} chats marked blocked, expected {len(fake.blocked)}")
+        row = B.archive._db.execute("SELECT sent, blocked, failed, state FROM broadcasts").fetchone()
+        if row[3] != "done" or row[0] != len(open_chats) or row[1] != len(fake.blocked):
+            failures.append(f"broadcast counters: sent/blocked/failed/state = {row}")
+        sends = sorted(t for _, _, t in fake.sent_log)
+        window = max((sum(1 for t in sends[i:i + 200] if t - sends[i] < 1) for i in range(len(sends))), default=0)
+        if window > B.config.OUT_GLOBAL_RATE + B.config.OUT_GLOBAL_BURST:
+            failures.append(f"{window} sends within one second")
+        status = [m for chat, m, _ in fake.sent_log if chat == admin_id and m == "sendMessage"]
+        print(
+            f"broadcast: {sum(got.values())} copies in {elapsed:.1f}s "
+            f"({sum(got.values()) / elapsed:.1f}/s), crash after {crashed_at}, repeated {repeated}, "
+            f"blocked {blocked}, progress edits {fake.calls['editMessageText']}, status messages {len(status)}"
+        )
+        print(f"live replies before: p50 {pct(before, 50)} ms, p95 {pct(before, 95)} ms, n={len(before)}")
+        print(f"live replies during: p50 {pct(during, 50)} ms, p95 {pct(during, 95)} ms, n={len(during)}")
+        if pct(during, 95) > pct(before, 95) + 1000 / B.config.OUT_GLOBAL_RATE * 3:
+            failures.append("live replies were delayed by the broadcast")
+    finally:
+        if workflow:
+            await B.dp.emit_shutdown(bot=B.bot, **workflow)
+        await B.bot.session.close()
+        await fake.stop()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/broadcast: resume, blocked chats, live latency")
+    parser.add_argument("--recipients", type=int, default=300)
+    parser.add_argument("--blocked", type=int, default=30)
+    parser.add_argument("--live", type=int, default=5, help="candidates filling forms at the same time")
+    parser.add_argument("--pause", type=float, default=0.3, help="seconds between a candidate's answers")
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--api-port", type=int, default=8102)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({"METRICS_PORT": "0", "BROADCAST_REPORT_SEC": "2"})
+        failures = asyncio.run(run(args))
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# bench/dispatcher_flow.py
+# Throughput of the real Dispatcher from bot.py on the full questionnaire, no network.
+#
+#   python -m bench.dispatcher_flow --candidates 200 --storage sqlite --label baseline
+#
+# bot.py's Bot gets a FakeSession (answers every API call in-process, through the same
+# response parsing as a real one). N candidates run concurrently: /start, job choice,
+# then every step of the form (text, phone, date, choices, voice, video) up to
+# finish_and_send; each sends its next update only when the previous one is handled,
+# like a person waiting for the bot. Prints one JSON object (use --out to append it to a
+# JSON-lines file) to compare storage / scheduler / routing changes between runs.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict
+
+from bench.replay_flow import setup_env, step_input
+from bench.webhook_vs_polling import percentile
+
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+def make_fake_session():
+    # defined after bot.py's imports are available (setup_env first)
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import File, Message, User
+
+    class FakeSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self._ids = itertools.count(1)
+            self.calls: Dict[str, int] = {}
+
+        def _result(self, method) -> Any:
+            returning = method.__returning__
+            name = method.__api_method__
+            if returning is Message:
+                msg = {
+                    "message_id": next(self._ids),
+                    "date": int(time.time()),
+                    "chat": {"id": getattr(method, "chat_id", 0), "type": "private"},
+                    "from": FAKE_BOT_USER,
+                }
+                if name == "sendVoice":
+                    msg["voice"] = {"file_id": f"v{msg['message_id']}", "file_unique_id": "u", "duration": 1}
+                elif name == "sendVideo":
+                    msg["video"] = {"file_id": f"m{msg['message_id']}", "file_unique_id": "u",
+                                    "duration": 1, "width": 1, "height": 1}
+                return msg
+            if returning is User:
+                return FAKE_BOT_USER
+            if returning is File:
+                return {"file_id": "f", "file_unique_id": "u"}
+            return True
+
+        async def make_request(self, bot, method, timeout=None):
+            name = method.__api_method__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            body = json.dumps({"ok": True, "result": self._result(method)})
+            return self.check_response(bot=bot, method=method, status_code=200, content=body).result
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+class Done:
+    # innermost outer middleware: handler time and a future per update_id
+    def __init__(self):
+        self.waiters: Dict[int, asyncio.Future] = {}
+        self.handler_ms = []
+        self.total_ms = []
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event, data: Dict[str, Any]):
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = (time.perf_counter() - t0) * 1000
+            self.handler_ms.append(elapsed)
+            self.total_ms.append(elapsed + data.get("queue_wait", 0) * 1000)
+            fut = self.waiters.pop(event.update_id, None)
+            if fut and not fut.done():
+                fut.set_result(None)
+
+
+async def run(args) -> dict:
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    import bot as B
+
+    if not args.real_limits:
+        B.throttle.limits = {}  # synthetic candidates answer instantly
+    session = make_fake_session()
+    session.middleware = B.bot.session.middleware  # keep the outbound scheduler
+    B.bot.session = session
+    done = Done()
+    B.dp.update.outer_middleware(done)
+    form = B.questionnaire_for(args.job)
+    ids = itertools.count(1)
+
+    async def feed(update: dict):
+        fut = asyncio.get_running_loop().create_future()
+        done.waiters[update["update_id"]] = fut
+        await B.dp.feed_raw_update(B.bot, update)
+        await fut
+
+    async def candidate(chat_id: int):
+        await feed(fake_mod.make_message_update(next(ids), chat_id, "/start"))
+        await feed(fake_mod.make_callback_update(next(ids), chat_id, f"job|{args.job}"))
+        for idx, step in enumerate(form.steps):
+            await feed(step_input(fake_mod, next(ids), chat_id, idx, step, kinds))
+
+    if args.trace_alloc:
+        tracemalloc.start()
+    blocks0 = sys.getallocatedblocks()
+    started = time.perf_counter()
+    await asyncio.gather(*(candidate(500_000 + i) for i in range(args.candidates)))
+    elapsed = time.perf_counter() - started
+    await B.notifier.wait_closed(120)
+    blocks = sys.getallocatedblocks() - blocks0
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_alloc else None
+    if args.trace_alloc:
+        tracemalloc.stop()
+
+    updates = len(done.handler_ms)
+    result = {
+        "label": args.label,
+        "storage": os.environ["FSM_STORAGE"],
+        "candidates": args.candidates,
+        "steps": len(form.steps),
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(updates / elapsed, 1),
+        "handler_ms": {"p50": round(percentile(done.handler_ms, 50), 3), "p99": round(percentile(done.handler_ms, 99), 3)},
+        "total_ms": {"p50": round(percentile(done.total_ms, 50), 3), "p99": round(percentile(done.total_ms, 99), 3)},
+        "api_calls": dict(sorted(session.calls.items())),
+        "allocated_blocks_delta": blocks,
+        "traced_peak_mb": round(traced_peak / 1024 ** 2, 1) if traced_peak is not None else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "scheduler": B.scheduler.stats(),
+        "failed": B.scheduler.failed,
+    }
+    await B.dp.storage.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dispatcher throughput on the full questionnaire")
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--storage", choices=["memory", "sqlite", "redis"], default="sqlite")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="SCHED_MAX_CONCURRENT")
+    parser.add_argument("--real-limits", action="store_true", help="keep anti-flood and outbound chat limits")
+    parser.add_argument("--trace-alloc", action="store_true", help="tracemalloc peak (slows the run down)")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="append the JSON result to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, api_port=0)
+        os.environ["FSM_STORAGE"] = args.storage
+        os.environ["METRICS_PORT"] = "0"
+        os.environ["SLOW_UPDATE_MS"] = "0"
+        if args.real_limits:
+            os.environ.pop("OUT_CHAT_RATE")
+            os.environ.pop("OUT_CHAT_BURST")
+        else:  # measure the dispatcher, not the 30 msg/s Bot API budget
+            os.environ.update({"OUT_GLOBAL_RATE": "1e9", "OUT_GLOBAL_BURST": "1e9"})
+        if args.max_concurrent:
+            os.environ["SCHED_MAX_CONCURRENT"] = str(args.max_concurrent)
+        import logging
+        logging.disable(logging.INFO)  # per-update log lines would dominate the profile
+        result = asyncio.run(run(args))
+    line = json.dumps(result)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# bench/export_rss.py
+# /export time and peak memory versus the number of archived applications.
+#
+#   python -m bench.export_rss --rows 1000 10000 100000
+#
+# Every (rows, format) pair runs in a fresh interpreter, so ru_maxrss is the peak of
+# that export alone. Flat peak RSS across row counts = the export streams.
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from archive import Archive
+from bench.archive_dup_check import JOBS
+
+FIELDS = ["Ish turi", "Ism-familya", "Telefon", "Manzil (propiska)", "Ish tajribasi", "Oldingi maosh", "Kurslar"]
+
+
+def fill(path: str, rows: int):
+    archive = Archive(path)
+    now = int(time.time())
+    answers = {f: f"{f} javobi, biroz uzunroq matn " * 3 for f in FIELDS}
+    db = archive._db
+    with db:
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT INTO applications (user_id, phone, job, created_at, full_name, username, answers) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (i, f"+99890{i:07d}", JOBS[i % len(JOBS)], now - i, f"User {i}", f"user{i}",
+                 json.dumps(dict(answers, Telefon=f"+99890{i:07d}"), ensure_ascii=False))
+                for i in range(rows)
+            ),
+        )
+    archive._db.close()
+    archive._executor.shutdown()
+
+
+def one(path: str, fmt: str):
+    # child process: export once, print time / size / peak RSS
+    import export
+    out = os.path.join(os.path.dirname(path), "out." + fmt)
+    t0 = time.perf_counter()
+    count = export.export(out, fmt, path, FIELDS)
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({
+        "count": count,
+        "export_s": round(elapsed, 2),
+        "file_mb": round(os.path.getsize(out) / 1024 ** 2, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export time and peak RSS vs rows")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--formats", nargs="+", default=["csv", "xlsx"])
+    parser.add_argument("--one", nargs=2, metavar=("DB", "FORMAT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.one:
+        return one(*args.one)
+
+    results = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "applications.sqlite3")
+            fill(path, rows)
+            for fmt in args.formats:
+                out = subprocess.run(
+                    [sys.executable, "-m", "bench.export_rss", "--one", path, fmt],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                results.append({"rows": rows, "format": fmt, **json.loads(out)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
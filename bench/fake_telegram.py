@@ -0,0 +1,275 @@
+# bench/fake_telegram.py
+# Local fake Bot API server: answers the methods bot.py uses, serves getUpdates
+# (long polling) or POSTs updates to the webhook registered via setWebhook,
+# and lets the load generator wait for the bot's reply to a given chat.
+import asyncio
+import itertools
+import json
+import time
+import weakref
+from collections import defaultdict, deque
+
+import aiohttp
+from aiohttp import web
+
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+# methods whose result is a Message
+MESSAGE_METHODS = {
+    "sendMessage", "sendVideo", "sendVoice", "sendDocument", "sendPhoto",
+    "sendVideoNote", "copyMessage", "forwardMessage",
+}
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def make_message_update(update_id: int, chat_id: int, text: str = None, **extra) -> dict:
+    msg = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": make_user(chat_id),
+    }
+    if text is not None:
+        msg["text"] = text
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    msg.update(extra)
+    return {"update_id": update_id, "message": msg}
+
+
+def make_callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": FAKE_BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
+
+
+class FakeTelegram:
+    # chat_limit / global_limit: sends per second before the fake answers 429 (None = unlimited)
+    def __init__(self, chat_limit: int = None, global_limit: int = None, retry_after: int = 1):
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self._sends = defaultdict(deque)  # chat_id (0 = all chats) -> send times within the last second
+        self.sent_log = []                # (chat_id, method, time) of accepted sends
+        self.sent_texts = []              # (chat_id, text or caption) of accepted sends
+        self.blocked = set()              # chats that blocked the bot: sends get 403
+        self.files = {}                   # file_id -> bytes for getFile / downloads
+        self.file_size = 64 * 1024        # body of a file_id not in `files`
+        self.bad_files = set()            # file_ids getFile rejects
+        self.file_chunk_delay = 0.0       # seconds per 64 KB of a download (slow link)
+        self.downloads = 0
+        # network emulation: every call waits api_delay; the first call on a new connection
+        # waits connect_delay more (TCP + TLS handshake to the real API)
+        self.api_delay = 0.0
+        self.connect_delay = 0.0
+        self.connections = 0
+        self._transports = weakref.WeakSet()
+        self.app = web.Application(client_max_size=64 * 1024 ** 2)
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        self.runner = None
+        self.updates = deque()
+        self.updates_event = asyncio.Event()
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self.webhook_set = asyncio.Event()
+        self.polling_started = asyncio.Event()
+        self.calls = defaultdict(int)
+        self.waiters = defaultdict(deque)  # chat_id -> futures waiting for next outgoing message
+        self._message_ids = itertools.count(1)
+        self._client = None
+
+    # ---- server lifecycle ----
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self._client = aiohttp.ClientSession()
+
+    async def stop(self):
+        if self._client:
+            await self._client.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    # ---- update delivery ----
+    def push_update(self, update: dict):
+        # polling: update is returned by the next getUpdates
+        self.updates.append(update)
+        self.updates_event.set()
+
+    async def post_webhook(self, update: dict):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret} if self.webhook_secret else {}
+        async with self._client.post(self.webhook_url, json=update, headers=headers) as resp:
+            resp.raise_for_status()
+
+    def wait_reply(self, chat_id: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id].append(fut)
+        return fut
+
+    # ---- Bot API ----
+    async def _network(self, request: web.Request):
+        delay = self.api_delay
+        if request.transport not in self._transports:
+            self._transports.add(request.transport)
+            self.connections += 1
+            delay += self.connect_delay
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method != "getUpdates":
+            await self._network(request)
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        self.calls[method] += 1
+        if method in MESSAGE_METHODS and self._flooded(int(params.get("chat_id", 0))):
+            self.calls["429"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if method in MESSAGE_METHODS and int(params.get("chat_id", 0)) in self.blocked:
+            self.calls["403"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+            }, status=403)
+        handler = getattr(self, "api_" + method, None)
+        if handler is not None:
+            result = await handler(params)
+        elif method in MESSAGE_METHODS:
+            result = self.sent_message(method, params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def _flooded(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        checks = [(chat_id, self.chat_limit), (0, self.global_limit)]
+        for key, limit in checks:
+            if limit is None:
+                continue
+            times = self._sends[key]
+            while times and now - times[0] > 1:
+                times.popleft()
+            if len(times) >= limit:
+                return True
+        for key, limit in checks:
+            if limit is not None:
+                self._sends[key].append(now)
+        return False
+
+    def sent_message(self, method: str, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        self.sent_log.append((chat_id, method, time.perf_counter()))
+        if "text" in params or "caption" in params:
+            self.sent_texts.append((chat_id, params.get("text") or params.get("caption")))
+        waiters = self.waiters.get(chat_id)
+        while waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result((method, time.perf_counter()))
+                break
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": FAKE_BOT_USER,
+        }
+        if "text" in params:
+            msg["text"] = params["text"]
+        if "caption" in params:
+            msg["caption"] = params["caption"]
+        return msg
+
+    def file_body(self, file_id: str) -> bytes:
+        body = self.files.get(file_id)
+        if body is None:
+            body = self.files[file_id] = (file_id.encode() * (self.file_size // max(len(file_id), 1) + 1))[:self.file_size]
+        return body
+
+    async def api_getFile(self, params: dict):
+        file_id = params["file_id"]
+        if file_id in self.bad_files:
+            raise web.HTTPBadRequest(
+                text=json.dumps({"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}),
+                content_type="application/json",
+            )
+        return {"file_id": file_id, "file_unique_id": "U" + file_id, "file_size": len(self.file_body(file_id)),
+                "file_path": f"files/{file_id}.bin"}
+
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        # file download: streamed in chunks like the real file server
+        file_id = request.match_info["path"].rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        if file_id not in self.files:
+            raise web.HTTPNotFound()
+        body = self.files[file_id]
+        self.downloads += 1
+        await self._network(request)
+        resp = web.StreamResponse(headers={"Content-Length": str(len(body))})
+        await resp.prepare(request)
+        try:
+            for i in range(0, len(body), 64 * 1024):
+                await resp.write(body[i:i + 64 * 1024])
+                if self.file_chunk_delay:
+                    await asyncio.sleep(self.file_chunk_delay)
+            await resp.write_eof()
+        except ConnectionResetError:
+            pass  # the client gave up mid-file
+        return resp
+
+    async def api_getMe(self, params: dict):
+        return FAKE_BOT_USER
+
+    async def api_setWebhook(self, params: dict):
+        self.webhook_url = params["url"]
+        self.webhook_secret = params.get("secret_token", "")
+        self.webhook_set.set()
+        return True
+
+    async def api_deleteWebhook(self, params: dict):
+        self.webhook_url = ""
+        if params.get("drop_pending_updates") in ("true", "True", "1"):
+            self.updates.clear()
+        return True
+
+    async def api_getWebhookInfo(self, params: dict):
+        return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": len(self.updates)}
+
+    async def api_getUpdates(self, params: dict):
+        self.polling_started.set()
+        offset = int(params.get("offset", 0) or 0)
+        timeout = float(params.get("timeout", 0) or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self.updates_event.clear()
+            try:
+                await asyncio.wait_for(self.updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit", 100) or 100)
+        return list(itertools.islice(self.updates, limit))
+
+
+def dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, indent=2)
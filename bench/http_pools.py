@@ -0,0 +1,156 @@
+# bench/http_pools.py
+# Reply latency with aiogram's default HTTP session vs the per-class pools (http_pool.py).
+#
+#   python -m bench.http_pools [--candidates 300] [--bursts 3] [--gap 20]
+#
+# In-process against the fake Bot API with network emulation: every call takes
+# --api-delay, the first call on a new connection --connect-delay more (the TCP + TLS
+# setup a real api.telegram.org connection costs). Candidates answer in bursts (all of
+# them send their next answer at once) with --gap seconds of silence in between, which
+# is how a recruiting post plays out: the default session's 15s keep-alive closes its
+# connections in the gaps, the pooled one keeps them. The measured bursts start at the
+# voice question, so answers are copied in the background meanwhile (media pool). Prints
+# one JSON line per session type with reply latency per burst and connection counters.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from bench.replay_flow import setup_env, step_input
+
+FIRST_CHAT = 500_000
+
+
+def media_input(fake_mod, update_id, chat, idx, step, kinds):
+    # own file per candidate, so every answer is a real download
+    if step.kind == kinds.VOICE:
+        return fake_mod.make_message_update(
+            update_id, chat, voice={"file_id": f"v{chat}", "file_unique_id": f"uv{chat}", "duration": 3})
+    if step.kind == kinds.VIDEO:
+        return fake_mod.make_message_update(
+            update_id, chat,
+            video={"file_id": f"m{chat}", "file_unique_id": f"um{chat}", "duration": 3, "width": 1, "height": 1})
+    return None
+
+
+async def run_mode(args, fake, fake_mod, B, kinds, mode: str, first_chat: int, ids) -> dict:
+    from metrics import InstrumentedSession
+
+    old = B.bot.session
+    session = B.make_session() if mode == "pooled" else InstrumentedSession(api=old.api)
+    session.middleware = old.middleware  # keep the outbound scheduler
+    B.bot.session = session
+    await old.close()
+
+    form = B.questionnaire_for(args.job)
+    chats = [first_chat + i for i in range(args.candidates)]
+    steps = [("/start", None), ("job", None)] + [(i, s) for i, s in enumerate(form.steps)]
+    # unmeasured warm-up up to the voice question; the measured bursts include the media answers
+    warmup = 2 + next(i for i, s in enumerate(form.steps) if s.kind == kinds.VOICE)
+    bursts = []
+    for n, (what, step) in enumerate(steps[:warmup + args.bursts]):
+        latencies = []
+
+        async def one(chat):
+            uid = next(ids)
+            if what == "/start":
+                update = fake_mod.make_message_update(uid, chat, "/start")
+            elif what == "job":
+                update = fake_mod.make_callback_update(uid, chat, f"job|{args.job}")
+            else:
+                update = (media_input(fake_mod, uid, chat, what, step, kinds)
+                          or step_input(fake_mod, uid, chat, what, step, kinds))
+            reply = fake.wait_reply(chat)
+            t0 = time.perf_counter()
+            await B.dp.feed_raw_update(B.bot, update)
+            _, at = await asyncio.wait_for(reply, 60)
+            latencies.append((at - t0) * 1000)
+
+        if n == warmup:
+            connections_before = fake.connections
+        if n > warmup:
+            await asyncio.sleep(args.gap)
+        await asyncio.gather(*(one(c) for c in chats))
+        if n >= warmup:
+            bursts.append(latencies)
+    await B.scheduler.wait_closed(60)
+    if B.media_archiver:
+        await asyncio.wait_for(B.media_archiver.queue.join(), 120)
+    every = [x for b in bursts for x in b]
+    result = {
+        "label": args.label,
+        "session": mode,
+        "candidates": args.candidates,
+        "api_delay_ms": args.api_delay * 1000,
+        "connect_delay_ms": args.connect_delay * 1000,
+        "gap_s": args.gap,
+        "p50_ms": round(statistics.median(every), 1),
+        "p95_ms": round(statistics.quantiles(every, n=100)[94], 1),
+        "burst_p50_ms": [round(statistics.median(b), 1) for b in bursts],
+        "burst_p95_ms": [round(statistics.quantiles(b, n=100)[94], 1) for b in bursts],
+        "connections_opened": fake.connections - connections_before,
+    }
+    if hasattr(session, "stats"):
+        result["pools"] = {k: v for k, v in session.stats().items() if v}
+    return result
+
+
+async def run(args):
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    import bot as B
+
+    B.throttle.limits = {}
+    fake = fake_mod.FakeTelegram()
+    fake.api_delay = args.api_delay
+    fake.connect_delay = args.connect_delay
+    fake.file_size = args.file_kb * 1024
+    fake.file_chunk_delay = args.chunk_delay
+    await fake.start(port=args.api_port)
+    workflow = {"dispatcher": B.dp, "bots": [B.bot], **B.dp.workflow_data}
+    ids = iter(range(1, 10_000_000))
+    results = []
+    try:
+        await B.dp.emit_startup(bot=B.bot, **workflow)
+        for n, mode in enumerate(args.sessions):
+            result = await run_mode(args, fake, fake_mod, B, kinds, mode, FIRST_CHAT + n * 100_000, ids)
+            print(json.dumps(result))
+            results.append(result)
+    finally:
+        await B.dp.emit_shutdown(bot=B.bot, **workflow)
+        await B.bot.session.close()
+        await fake.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="default aiohttp session vs per-class pools")
+    parser.add_argument("--sessions", nargs="+", choices=["default", "pooled"], default=["default", "pooled"])
+    parser.add_argument("--candidates", type=int, default=300)
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--gap", type=float, default=20, help="seconds of silence between bursts")
+    parser.add_argument("--api-delay", type=float, default=0.02)
+    parser.add_argument("--connect-delay", type=float, default=0.1)
+    parser.add_argument("--file-kb", type=int, default=512)
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="fake file server: seconds per 64 KB")
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--api-port", type=int, default=8104)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="append the JSON results to this file")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({"METRICS_PORT": "0", "OUT_GLOBAL_RATE": "1e9", "OUT_GLOBAL_BURST": "1e9",
+                           "SLOW_UPDATE_MS": "0"})
+        results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# bench/log_pipeline.py
+# Reply latency during an error storm: logging.basicConfig vs the queue pipeline (logs.py).
+#
+#   python -m bench.log_pipeline [--candidates 200] [--write-ms 2] [--modes basic queue]
+#
+# In-process against the fake Bot API. Candidates fill in the form at once while the
+# archive is broken: every finished form logs "Can't archive application" with its
+# traceback. The log stream is slow (--write-ms per write, like a stderr pipe whose
+# reader - journald, docker - falls behind). With basicConfig every write blocks the
+# event loop; with the pipeline only the listener thread waits. Also measures the loop
+# lag (how late a 10 ms ticker wakes up). In queue mode checks that the lines are JSON,
+# the error records carry update_id / user_id / FSM state / elapsed_ms, and that the
+# repeats past LOG_SAMPLE_BURST are suppressed and counted.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench.replay_flow import setup_env, step_input
+
+FIRST_CHAT = 700_000
+
+
+class SlowStream:
+    # stands in for stderr: every write takes write_s, lines are kept for the checks
+    def __init__(self, write_s: float):
+        self.write_s = write_s
+        self.lines = []
+        self._lock = threading.Lock()
+
+    def write(self, text: str):
+        time.sleep(self.write_s)
+        with self._lock:
+            self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+async def run(args, mode: str, stream: SlowStream) -> dict:
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    import bot as B
+    import logs
+
+    if mode == "basic":
+        logs.stop_logging()
+        logging.basicConfig(stream=stream, level=logging.INFO, force=True)
+    B.throttle.limits = {}
+
+    async def broken(*a, **kw):
+        raise RuntimeError("database is locked")
+    B.archive.add = broken
+
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=args.api_port)
+    workflow = {"dispatcher": B.dp, "bots": [B.bot], **B.dp.workflow_data}
+    ids = iter(range(1, 10_000_000))
+    form = B.questionnaire_for(args.job)
+    latencies, lags = [], []
+    running = True
+
+    async def ticker():
+        while running:
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - t0 - 0.01) * 1000)
+
+    async def candidate(chat):
+        updates = [fake_mod.make_message_update(next(ids), chat, "/start"),
+                   fake_mod.make_callback_update(next(ids), chat, f"job|{args.job}")]
+        updates += [step_input(fake_mod, next(ids), chat, i, s, kinds) for i, s in enumerate(form.steps)]
+        for update in updates:
+            reply = fake.wait_reply(chat)
+            t0 = time.perf_counter()
+            await B.dp.feed_raw_update(B.bot, update)
+            _, at = await asyncio.wait_for(reply, 60)
+            latencies.append((at - t0) * 1000)
+
+    try:
+        await B.dp.emit_startup(bot=B.bot, **workflow)
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(candidate(FIRST_CHAT + i) for i in range(args.candidates)))
+        elapsed = time.perf_counter() - started
+        running = False
+        await tick
+        await B.scheduler.wait_closed(60)
+    finally:
+        await B.dp.emit_shutdown(bot=B.bot, **workflow)
+        await B.bot.session.close()
+        await fake.stop()
+        logs.stop_logging()  # flush what the listener still has
+    return {
+        "mode": mode,
+        "candidates": args.candidates,
+        "write_ms": args.write_ms,
+        "forms_s": round(elapsed, 2),
+        "reply_p50_ms": round(statistics.median(latencies), 1),
+        "reply_p95_ms": round(statistics.quantiles(latencies, n=100)[94], 1),
+        "loop_lag_max_ms": round(max(lags), 1),
+        "log_writes": len(stream.lines),
+        **{f"log_{k}": v for k, v in logs.logging_stats().items()},
+    }
+
+
+def check(args, stream: SlowStream, result: dict) -> list:
+    failures = []
+    records = []
+    for text in stream.lines:
+        for line in text.splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                failures.append(f"not a JSON line: {line[:80]}")
+                break
+    errors = [r for r in records if r["msg"].startswith("Can't archive application")]
+    if len(errors) != min(args.candidates, args.burst):
+        failures.append(f"{len(errors)} archive errors logged, expected {min(args.candidates, args.burst)}")
+    for r in errors:
+        missing = [k for k in ("update_id", "user_id", "state", "elapsed_ms", "exc") if k not in r]
+        if missing:
+            failures.append(f"error record without {missing}")
+            break
+        if str(r["user_id"]) not in r["msg"] or "RuntimeError" not in r["exc"]:
+            failures.append(f"error record mixed up: {r}")
+            break
+    if result.get("log_suppressed", 0) < args.candidates - args.burst:
+        failures.append(f"{result.get('log_suppressed')} suppressed, expected {args.candidates - args.burst}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="blocking vs queued logging under an error storm")
+    parser.add_argument("--modes", nargs="+", choices=["basic", "queue"], default=["basic", "queue"])
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--write-ms", type=float, default=2, help="time one write to the log stream takes")
+    parser.add_argument("--burst", type=int, default=5, help="LOG_SAMPLE_BURST")
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--api-port", type=int, default=8105)
+    args = parser.parse_args()
+    failures = []
+    for mode in args.modes:
+        # one process per mode: bot.py configures logging (and everything else) on import
+        if len(args.modes) > 1:
+            cmd = [sys.executable, "-m", "bench.log_pipeline", "--modes", mode, "--candidates", str(args.candidates),
+                   "--write-ms", str(args.write_ms), "--burst", str(args.burst), "--job", args.job,
+                   "--api-port", str(args.api_port)]
+            code = subprocess.call(cmd, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            if code:
+                failures.append(f"{mode} mode failed")
+            continue
+        stream = SlowStream(args.write_ms / 1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            setup_env(tmp, args.api_port)
+            os.environ.update({"METRICS_PORT": "0", "OUT_GLOBAL_RATE": "1e9", "OUT_GLOBAL_BURST": "1e9",
+                               "LOG_FORMAT": "json", "LOG_SAMPLE_BURST": str(args.burst),
+                               "LOG_SAMPLE_WINDOW": "3600"})
+            sys.stderr = stream  # the pipeline's StreamHandler is created on import
+            try:
+                result = asyncio.run(run(args, mode, stream))
+            finally:
+                sys.stderr = sys.__stderr__
+        print(json.dumps(result))
+        if mode == "queue":
+            failures += check(args, stream, result)
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# bench/media_archive_check.py
+# Background voice / video copies against the fake Bot API and its file endpoint, in-process.
+#
+#   python -m bench.media_archive_check [--candidates 20] [--file-kb 2048]
+#
+# Every candidate fills in the form with their own voice and video; a few send the same
+# video (one download), one file_id is rejected by getFile, one file is over the size
+# limit. The file endpoint streams slowly; half-way through the downloads the archiver is
+# stopped like a restart would stop it (downloads cut mid-file), and a new start finishes
+# the claimed ones. Checks the files on disk byte for byte and the archive rows, and
+# compares the candidates' reply latency with --no-archive (same traffic, no copies).
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.replay_flow import setup_env, step_input
+
+FIRST_CHAT = 600_000
+
+
+def media_update(fake_mod, update_id, chat_id, step, kinds, file_id):
+    if step.kind == kinds.VOICE:
+        return fake_mod.make_message_update(
+            update_id, chat_id, voice={"file_id": file_id, "file_unique_id": "U" + file_id, "duration": 3},
+        )
+    return fake_mod.make_message_update(
+        update_id, chat_id,
+        video={"file_id": file_id, "file_unique_id": "U" + file_id, "duration": 3, "width": 1, "height": 1},
+    )
+
+
+def print_latency(latencies):
+    print(f"candidate replies: p50 {statistics.median(latencies):.1f} ms, "
+          f"p95 {statistics.quantiles(latencies, n=100)[94]:.1f} ms, n={len(latencies)}")
+
+
+async def run(args) -> list:
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    import bot as B
+
+    B.throttle.limits = {}
+    fake = fake_mod.FakeTelegram()
+    fake.file_size = args.file_kb * 1024
+    fake.file_chunk_delay = args.chunk_delay
+    await fake.start(port=args.api_port)
+    failures = []
+    ids = iter(range(1, 10_000_000))
+    chats = [FIRST_CHAT + i for i in range(args.candidates)]
+    form = B.questionnaire_for(args.job)
+    # file_id per (chat, step); the last three chats share one video
+    files = {}
+    for chat in chats:
+        for i, s in enumerate(form.steps):
+            if s.kind in (kinds.VOICE, kinds.VIDEO):
+                files[chat, i] = f"{s.kind}{chat}"
+    shared = chats[-3:]
+    video_idx = next(i for i, s in enumerate(form.steps) if s.kind == kinds.VIDEO)
+    for chat in shared:
+        files[chat, video_idx] = "video-shared"
+    bad = files[chats[0], video_idx]
+    fake.bad_files.add(bad)
+    big = files[chats[1], video_idx]
+    fake.files[big] = b"x" * (int(B.config.MEDIA_MAX_FILE_MB * 1024 ** 2) + 1)
+    workflow = {"dispatcher": B.dp, "bots": [B.bot], **B.dp.workflow_data}
+    latencies = []
+
+    async def candidate(chat):
+        updates = [fake_mod.make_message_update(next(ids), chat, "/start"),
+                   fake_mod.make_callback_update(next(ids), chat, f"job|{args.job}")]
+        for i, s in enumerate(form.steps):
+            if (chat, i) in files:
+                updates.append(media_update(fake_mod, next(ids), chat, s, kinds, files[chat, i]))
+            else:
+                updates.append(step_input(fake_mod, next(ids), chat, i, s, kinds))
+        for update in updates:
+            reply = fake.wait_reply(chat)
+            t0 = time.perf_counter()
+            await B.dp.feed_raw_update(B.bot, update)
+            _, at = await asyncio.wait_for(reply, 30)
+            latencies.append((at - t0) * 1000)
+
+    async def restart_midway():
+        # "restart" with downloads queued and in flight
+        while B.media_archiver.saved < len(set(files.values())) // 2:
+            await asyncio.sleep(0.01)
+        await B.media_archiver.close()
+        saved = B.media_archiver.saved
+        await B.media_archiver.start()
+        return saved
+
+    try:
+        await B.dp.emit_startup(bot=B.bot, **workflow)
+        started = time.perf_counter()
+        if B.media_archiver is None:
+            await asyncio.gather(*(candidate(c) for c in chats))
+            print(f"{args.candidates} forms in {time.perf_counter() - started:.1f}s, no copies")
+            print_latency(latencies)
+            return failures
+        restart = asyncio.create_task(restart_midway())
+        await asyncio.gather(*(candidate(c) for c in chats))
+        forms_done = time.perf_counter() - started
+        interrupted = await asyncio.wait_for(restart, args.timeout)
+        await asyncio.wait_for(B.media_archiver.queue.join(), args.timeout)
+        all_done = time.perf_counter() - started
+        await B.scheduler.wait_closed(60)
+
+        rows = {r[0]: r[1:] for r in B.archive._db.execute(
+            "SELECT file_unique_id, state, size, path, error FROM media")}
+        expected = set(files.values())
+        for file_id in expected:
+            row = rows.get("U" + file_id)
+            if row is None:
+                failures.append(f"{file_id}: no archive row")
+                continue
+            state, size, path, error = row
+            if file_id == bad:
+                if state != "failed":
+                    failures.append(f"{file_id}: rejected by getFile but state {state}")
+            elif file_id == big:
+                if state != "skipped":
+                    failures.append(f"{file_id}: over the size limit but state {state}")
+            elif state != "done":
+                failures.append(f"{file_id}: state {state} ({error})")
+            elif Path(path).read_bytes() != fake.files[file_id]:
+                failures.append(f"{file_id}: stored copy differs")
+        if len(rows) != len(expected):
+            failures.append(f"{len(rows)} media rows for {len(expected)} files")
+        leftovers = list(Path(B.config.MEDIA_ARCHIVE_DIR).rglob("*.part"))
+        if leftovers:
+            failures.append(f"{len(leftovers)} .part files left")
+        downloads_expected = len(expected) - 2  # minus the rejected and the oversized one
+        if fake.downloads > downloads_expected + B.config.MEDIA_WORKERS:
+            failures.append(f"{fake.downloads} downloads for {downloads_expected} files")
+        stored = sum(r[1] or 0 for r in rows.values() if r[0] == "done")
+        print(
+            f"{args.candidates} forms in {forms_done:.1f}s, all copies in {all_done:.1f}s: "
+            f"{stored / 1024 ** 2:.1f} MB, {fake.downloads} downloads ({interrupted} saved before the restart), "
+            f"stats {B.media_archiver.stats()}"
+        )
+        print_latency(latencies)
+    finally:
+        await B.dp.emit_shutdown(bot=B.bot, **workflow)
+        await B.bot.session.close()
+        await fake.stop()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="candidate voice / video copies: dedupe, quotas, restart")
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--file-kb", type=int, default=2048, help="size of every voice / video file")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="fake file server: seconds per 64 KB")
+    parser.add_argument("--no-archive", action="store_true", help="baseline: MEDIA_ARCHIVE_DIR empty")
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--api-port", type=int, default=8103)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({
+            "METRICS_PORT": "0", "OUT_GLOBAL_RATE": "1e9", "OUT_GLOBAL_BURST": "1e9",
+            "MEDIA_MAX_FILE_MB": str(max(args.file_kb * 2 / 1024, 1)),
+            "MEDIA_ARCHIVE_DIR": "" if args.no_archive else "candidate_media",
+        })
+        failures = asyncio.run(run(args))
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
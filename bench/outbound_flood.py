@@ -0,0 +1,87 @@
+# bench/outbound_flood.py
+# Outbound scheduler against a fake Bot API that answers 429 like Telegram does.
+#
+#   python -m bench.outbound_flood --candidates 60 --replies 3 --admin-reports 60
+#
+# Candidate replies (one chat per candidate) and admin notifications (few admin chats,
+# PRIORITY_ADMIN) are sent at the same time. Reports lost sends, 429s seen by the fake
+# and the latency of each class, with and without OutboundScheduler.
+import argparse
+import asyncio
+import json
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import config
+from bench.fake_telegram import FakeTelegram
+from bench.webhook_vs_polling import percentile
+from outbound import PRIORITY_ADMIN, OutboundScheduler, priority
+
+ADMIN_CHATS = [900_001, 900_002, 900_003]
+
+
+async def run(with_scheduler: bool, args) -> dict:
+    fake = FakeTelegram(chat_limit=args.chat_limit, global_limit=args.global_limit, retry_after=1)
+    await fake.start(port=args.api_port)
+    bot = Bot(config.BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.api_port}")))
+    if with_scheduler:
+        # 10% below the fake's limits: client and server clocks never line up exactly
+        sched = OutboundScheduler(global_rate=args.global_limit * 0.9, chat_rate=args.chat_limit * 0.9, chat_burst=1)
+        bot.session.middleware(sched)
+    latencies = {"candidate": [], "admin": []}
+    lost = {"candidate": 0, "admin": 0}
+
+    async def send(kind: str, chat_id: int, text: str):
+        t0 = time.perf_counter()
+        try:
+            await bot.send_message(chat_id, text)
+            latencies[kind].append((time.perf_counter() - t0) * 1000)
+        except Exception:
+            lost[kind] += 1
+
+    async def candidate(i: int):
+        for r in range(args.replies):
+            await send("candidate", 100_000 + i, f"reply {r}")
+
+    async def admin(i: int):
+        with priority(PRIORITY_ADMIN):
+            await send("admin", ADMIN_CHATS[i % len(ADMIN_CHATS)], f"report {i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(candidate(i) for i in range(args.candidates)),
+        *(admin(i) for i in range(args.admin_reports)),
+    )
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    await fake.stop()
+    return {
+        "scheduler": with_scheduler,
+        "elapsed_s": round(elapsed, 2),
+        "fake_429": fake.calls["429"],
+        "lost": lost,
+        "latency_ms": {
+            kind: {"p50": round(percentile(v, 50)), "p99": round(percentile(v, 99))}
+            for kind, v in latencies.items()
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="outbound scheduler vs fake 429s")
+    parser.add_argument("--candidates", type=int, default=60)
+    parser.add_argument("--replies", type=int, default=3)
+    parser.add_argument("--admin-reports", type=int, default=60)
+    parser.add_argument("--chat-limit", type=int, default=1)
+    parser.add_argument("--global-limit", type=int, default=30)
+    parser.add_argument("--api-port", type=int, default=8083)
+    args = parser.parse_args()
+    results = [await run(False, args), await run(True, args)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
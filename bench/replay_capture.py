@@ -0,0 +1,105 @@
+# bench/replay_capture.py
+# Replays a traffic capture (capture.py, CAPTURE_DIR) through bot.py's Dispatcher
+# against the local fake Bot API: production bursts and regressions, offline.
+#
+#   python -m bench.replay_capture captures/ --speed 1     # real timing
+#   python -m bench.replay_capture captures/ --speed 10    # 10x faster
+#   python -m bench.replay_capture updates-*.jsonl.gz --speed 0   # as fast as possible
+#
+# Updates are fed in capture order, the way polling feeds them (the scheduler's
+# backpressure applies). Prints a JSON summary: how far the feed fell behind the
+# capture's timing, update latency, scheduler / anti-flood counters and API calls.
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from bench.dispatcher_flow import Done
+from bench.replay_flow import setup_env
+from bench.webhook_vs_polling import percentile
+
+
+async def run(args) -> dict:
+    import bench.fake_telegram as fake_mod
+    import bot as B
+    from capture import iter_capture
+
+    if args.no_throttle:
+        B.throttle.limits = {}
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=args.api_port)
+    done = Done()
+    B.dp.update.outer_middleware(done)
+    loop = asyncio.get_running_loop()
+    fed = 0
+    max_lag = 0.0
+    t0 = started = None
+    try:
+        for t, update in iter_capture(args.paths):
+            if t0 is None:
+                t0, started = t, loop.time()
+            if args.speed:
+                delay = (t - t0) / args.speed - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            await B.dp.feed_raw_update(B.bot, update)
+            fed += 1
+            if args.limit and fed >= args.limit:
+                break
+        await B.scheduler.wait_closed(300)
+        await B.notifier.wait_closed(120)
+        elapsed = loop.time() - started if started is not None else 0.0
+    finally:
+        await B.bot.session.close()
+        await fake.stop()
+        await B.dp.storage.close()
+
+    return {
+        "label": args.label,
+        "speed": args.speed or "max",
+        "updates": fed,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(fed / elapsed, 1) if elapsed else None,
+        "max_lag_s": round(max_lag, 3),  # behind the capture's schedule (speed > 0)
+        "handler_ms": {"p50": round(percentile(done.handler_ms, 50), 3), "p99": round(percentile(done.handler_ms, 99), 3)},
+        "total_ms": {"p50": round(percentile(done.total_ms, 50), 3), "p99": round(percentile(done.total_ms, 99), 3)},
+        "scheduler": B.scheduler.stats(),
+        "throttle": B.throttle.stats(),
+        "api_calls": dict(sorted(fake.calls.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay captured updates against the fake Bot API")
+    parser.add_argument("paths", nargs="+", help="capture files or directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time, N = N times faster, 0 = max")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many updates")
+    parser.add_argument("--storage", choices=["memory", "sqlite", "redis"], default="sqlite")
+    parser.add_argument("--no-throttle", action="store_true", help="disable the anti-flood (for --speed 0)")
+    parser.add_argument("--api-port", type=int, default=8098)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="append the JSON result to this file")
+    args = parser.parse_args()
+    args.paths = [os.path.abspath(p) for p in args.paths]  # setup_env changes the directory
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({"FSM_STORAGE": args.storage, "METRICS_PORT": "0"})
+        os.environ.pop("CAPTURE_DIR", None)  # do not capture the replay itself
+        import logging
+        logging.disable(logging.INFO)
+        started = time.perf_counter()
+        result = asyncio.run(run(args))
+        result["wall_s"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# bench/replay_flow.py
+# Helpers shared by the benches and tests/test_candidate_flow.py (the end-to-end flow
+# check that used to live here): the environment for an in-process bot against the fake
+# Bot API, and the update that answers one questionnaire step.
+import os
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+VOICE_ID, VIDEO_ID = "VOICE-replay", "VIDEO-replay"
+
+
+def setup_env(tmp: str, api_port: int):
+    # before bot.py is imported: config reads the environment at import time
+    sys.path.insert(0, str(REPO))
+    os.chdir(tmp)  # media_store.json / bot_state.json / sqlite files land in tmp
+    os.environ.update({
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "FSM_STORAGE": "sqlite",
+        "FSM_SQLITE_PATH": os.path.join(tmp, "fsm.sqlite3"),
+        "ARCHIVE_PATH": os.path.join(tmp, "applications.sqlite3"),
+        "OUT_CHAT_RATE": "1000",
+        "OUT_CHAT_BURST": "1000",
+    })
+
+
+def step_input(fake_mod, update_id: int, chat_id: int, idx: int, step, kinds):
+    # one update that answers step `idx`
+    if step.kind == kinds.CHOICE and not step.free_text:
+        return fake_mod.make_callback_update(update_id, chat_id, f"ans|{idx}|0")
+    if step.kind == kinds.VOICE:
+        return fake_mod.make_message_update(
+            update_id, chat_id, voice={"file_id": VOICE_ID, "file_unique_id": "uv", "duration": 3},
+        )
+    if step.kind == kinds.VIDEO:
+        return fake_mod.make_message_update(
+            update_id, chat_id,
+            video={"file_id": VIDEO_ID, "file_unique_id": "uvid", "duration": 3, "width": 1, "height": 1},
+        )
+    if step.kind == kinds.PHONE:
+        return fake_mod.make_message_update(update_id, chat_id, "+998901234567")
+    if step.kind == kinds.DATE:
+        return fake_mod.make_message_update(update_id, chat_id, "01.01.2000")
+    return fake_mod.make_message_update(update_id, chat_id, f"javob {idx + 1}")
+
@@ -0,0 +1,124 @@
+# bench/resp_server.py
+# Tiny in-memory Redis stand-in (RESP protocol) for running FSM_STORAGE=redis locally.
+#
+#   python -m bench.resp_server --port 6379
+#
+# Supports the commands fsm_storage.RedisStorage uses: PING, GET, SET, DEL, HSET, HGETALL,
+# ZADD, ZREM, ZRANGE (0 -1 [WITHSCORES]), MULTI, EXEC, SELECT (plus MGET).
+import argparse
+import asyncio
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class RespServer:
+    def __init__(self):
+        self.data = {}
+        self.server = None
+
+    def command(self, args):
+        name = args[0].upper()
+        if name == b"PING":
+            return "PONG"
+        if name == b"SELECT":
+            return "OK"
+        if name == b"GET":
+            return self.data.get(args[1])
+        if name == b"MGET":
+            return [self.data.get(k) for k in args[1:]]
+        if name == b"SET":
+            self.data[args[1]] = args[2]
+            return "OK"
+        if name == b"HSET":
+            h = self.data.setdefault(args[1], {})
+            added = sum(1 for f in args[2::2] if f not in h)
+            h.update(zip(args[2::2], args[3::2]))
+            return added
+        if name == b"HGETALL":
+            return [x for fv in self.data.get(args[1], {}).items() for x in fv]
+        if name == b"ZADD":
+            z = self.data.setdefault(args[1], {})
+            added = sum(1 for m in args[3::2] if m not in z)
+            z.update((m, float(sc)) for sc, m in zip(args[2::2], args[3::2]))
+            return added
+        if name == b"ZREM":
+            z = self.data.get(args[1], {})
+            return sum(1 for m in args[2:] if z.pop(m, None) is not None)
+        if name == b"ZRANGE":
+            items = sorted(self.data.get(args[1], {}).items(), key=lambda kv: kv[1])
+            if len(args) > 4 and args[4].upper() == b"WITHSCORES":
+                return [x for m, sc in items for x in (m, repr(sc).encode())]
+            return [m for m, _ in items]
+        if name == b"DEL":
+            return sum(1 for k in args[1:] if self.data.pop(k, None) is not None)
+        return Exception(f"unknown command '{name.decode()}'")
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        n = int(line[1:-2])
+        args = []
+        for _ in range(n):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        queued = None
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                name = args[0].upper()
+                if name == b"MULTI":
+                    queued = []
+                    reply = "OK"
+                elif name == b"EXEC":
+                    reply = [self.command(a) for a in (queued or [])]
+                    queued = None
+                elif queued is not None:
+                    queued.append(args)
+                    reply = "QUEUED"
+                else:
+                    reply = self.command(args)
+                writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 6379):
+        self.server = await asyncio.start_server(self.handle, host, port)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="in-memory RESP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    srv = RespServer()
+    await srv.start(args.host, args.port)
+    await srv.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+# bench/restart_backlog.py
+# Crash / restart check for the update ledger, with real processes and the fake Bot API.
+#
+#   python -m bench.restart_backlog [--candidates 20] [--kill-after 5] [--mode drain|skip]
+#
+# All candidates' updates (full forms, interleaved) wait in the fake API's queue. A bot
+# process polls them at BACKLOG_RATE and is killed with SIGKILL mid-way; a second one
+# starts on the same files and finishes the backlog. Then every candidate must have
+# exactly one archived application with the answers in the right fields (a repeated
+# update would shift them), and exactly one admin report.
+# --mode skip shows the old behaviour: the restart throws the backlog away.
+# --crash-after-archive N: the first process kills itself right after its N-th archived
+# application, before the form state is cleared and before the report went out: the
+# replayed final update must not archive or report it again, the report must still come.
+# --crash-before-archive N: the first process kills itself when its N-th final answer
+# is journaled but not archived yet: the restart replays it from the journal while the
+# undelivered reports of earlier ones are resumed, and each must reach the admin once.
+import argparse
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from bench.replay_flow import REPO, setup_env, step_input
+
+FIRST_CHAT = 700_000
+
+
+def push_forms(fake, chats, form, job: str) -> int:
+    # every chat's full form into the fake API's update queue, interleaved like real traffic
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    uid = 0
+    for n in range(len(form.steps) + 2):
+        for chat in chats:
+            uid += 1
+            if n == 0:
+                fake.push_update(fake_mod.make_message_update(uid, chat, "/start"))
+            elif n == 1:
+                fake.push_update(fake_mod.make_callback_update(uid, chat, f"job|{job}"))
+            else:
+                fake.push_update(step_input(fake_mod, uid, chat, n - 2, form.steps[n - 2], kinds))
+    return uid
+
+
+def child(tmp: str, port: int):
+    # one bot process: bot.main() with polling against the fake API
+    setup_env(tmp, port)
+    import bot as B
+    B.throttle.limits = {}
+    crash_after = int(os.environ.get("CRASH_AFTER_ARCHIVE", "0"))
+    crash_before = int(os.environ.get("CRASH_BEFORE_ARCHIVE", "0"))
+    if crash_before:
+        add, calls = B.archive.add, []
+
+        async def crash_then_add(*a, **kw):
+            calls.append(1)
+            if len(calls) >= crash_before:
+                await B.ledger.sync()  # the final update is in the journal, its application is not archived
+                os.kill(os.getpid(), signal.SIGKILL)
+            return await add(*a, **kw)
+        B.archive.add = crash_then_add
+    if crash_after:
+        add, added = B.archive.add, []
+
+        async def add_then_crash(*a, **kw):
+            result = await add(*a, **kw)
+            added.append(result)
+            if len(added) >= crash_after:
+                os.kill(os.getpid(), signal.SIGKILL)
+            return result
+        B.archive.add = add_then_crash
+    asyncio.run(B.main())
+
+
+def spawn(tmp: str, port: int, env: dict, name: str) -> subprocess.Popen:
+    # stderr to a file: a pipe read only at the end fills up with the log lines and
+    # blocks the child's log writer (and with it the shutdown)
+    with open(os.path.join(tmp, f"{name}.log"), "wb") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "bench.restart_backlog", "--child", tmp, "--api-port", str(port)],
+            cwd=str(REPO), env={**os.environ, **env},
+            stdout=subprocess.DEVNULL, stderr=log,
+        )
+
+
+async def run(args, tmp: str) -> list:
+    import bench.fake_telegram as fake_mod
+    import config
+    import questionnaire as kinds
+    from archive import iter_applications
+    from bot import questionnaire_for  # parent only builds inputs; it never polls
+
+    form = questionnaire_for(args.job)
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=args.api_port)
+    chats = [FIRST_CHAT + i for i in range(args.candidates)]
+    total = push_forms(fake, chats, form, args.job)
+    admin_id = config.ADMINS[0]
+    failures = []
+    first = spawn(tmp, args.api_port, {"BACKLOG_RATE": str(args.rate), "BACKLOG_MODE": "drain",
+                                       "CRASH_AFTER_ARCHIVE": str(args.crash_after_archive),
+                                       "CRASH_BEFORE_ARCHIVE": str(args.crash_before_archive)}, "first")
+    try:
+        if args.crash_after_archive or args.crash_before_archive:
+            while first.poll() is None:
+                await asyncio.sleep(0.05)
+        else:
+            await asyncio.sleep(args.kill_after)
+            first.send_signal(signal.SIGKILL)
+            first.wait()
+        left = len(fake.updates)
+        print(f"killed the first process with {total - left}/{total} updates confirmed")
+
+        started = time.perf_counter()
+        second = spawn(tmp, args.api_port, {"BACKLOG_RATE": "0", "BACKLOG_MODE": args.mode}, "second")
+        reports = 0
+        while time.perf_counter() - started < args.timeout:
+            await asyncio.sleep(0.5)
+            reports = sum(1 for chat, m, _ in fake.sent_log if chat == admin_id and m == "sendVoice")
+            if reports >= args.candidates or second.poll() is not None:
+                break
+        await asyncio.sleep(1)  # late duplicates would show up here
+        second.send_signal(signal.SIGTERM)
+        try:
+            second.wait(30)
+        except subprocess.TimeoutExpired:
+            second.kill()
+            failures.append("second process did not stop on SIGTERM")
+        if second.returncode not in (0, -signal.SIGTERM):
+            failures.append(f"second process exited with {second.returncode}: "
+                            f"{Path(tmp, 'second.log').read_text('utf-8', 'replace')[-2000:]}")
+        print(f"restart finished the backlog in {time.perf_counter() - started:.1f}s")
+    finally:
+        for p in (first,):
+            if p.poll() is None:
+                p.kill()
+        await fake.stop()
+
+    apps = Counter()
+    text_steps = [s for s in form.steps if s.kind == kinds.TEXT or (s.kind == kinds.CHOICE and s.free_text)]
+    for _, _, user_id, _, _, answers in iter_applications(os.path.join(tmp, "applications.sqlite3")):
+        apps[user_id] += 1
+        wrong = [s.key for s in text_steps if answers.get(s.key) != f"javob {form.steps.index(s) + 1}"]
+        if wrong:
+            failures.append(f"chat {user_id}: answers in wrong fields: {wrong[:3]}")
+    missing = [c for c in chats if apps[c] == 0]
+    twice = [c for c in chats if apps[c] > 1]
+    if missing:
+        failures.append(f"{len(missing)} candidates without an archived application")
+    if twice:
+        failures.append(f"{len(twice)} candidates archived more than once")
+    reports = Counter()
+    for chat, text in fake.sent_texts:
+        found = re.search(r"ID: `(\d+)`", text) if chat == admin_id and "Yangi anketa" in text else None
+        if found:
+            reports[int(found.group(1))] += 1
+    if args.mode == "drain":
+        unreported = [c for c in chats if reports[c] == 0]
+        if unreported:
+            failures.append(f"{len(unreported)} candidates never reported to the admin")
+    twice = [c for c in chats if reports[c] > 1]
+    if twice:
+        failures.append(f"{len(twice)} candidates reported to the admin more than once")
+    print(f"archived: {sum(apps.values())}/{args.candidates}, admin reports: {sum(reports.values())}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="kill -9 / restart with a pending backlog")
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--rate", type=float, default=100, help="BACKLOG_RATE of the first process")
+    parser.add_argument("--kill-after", type=float, default=5.0)
+    parser.add_argument("--crash-after-archive", type=int, default=0,
+                        help="first process: kill itself right after this many archived applications")
+    parser.add_argument("--crash-before-archive", type=int, default=0,
+                        help="first process: kill itself when this final answer is journaled, before archiving it")
+    parser.add_argument("--mode", choices=["drain", "skip"], default="drain", help="BACKLOG_MODE of the restart")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--api-port", type=int, default=8099)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.api_port)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({"METRICS_PORT": "0", "OUT_GLOBAL_RATE": "1e9", "OUT_GLOBAL_BURST": "1e9"})
+        failures = asyncio.run(run(args, tmp))
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# bench/shard_scaling.py
+# Throughput of `python -m shard` with 1..N workers on the same backlog, fake Bot API.
+#
+#   python -m bench.shard_scaling --workers 1 2 4 --candidates 200
+#
+# For each worker count: a fresh data directory, all candidates' full forms waiting in
+# the fake API's update queue, the ingress and its workers started as real processes.
+# The clock runs from the first getUpdates (all workers connected) until every
+# application reached the admin. Prints one JSON line per run. The fake API lives in
+# this process: on a small machine it competes with the workers for CPU, so compare
+# runs on the same host and look at the trend, not the absolute numbers.
+#
+# Every run also checks that each candidate has exactly one archived application, and
+# before the runs --writer-procs processes call Archive.add on one database at the same
+# time (what the workers do when forms finish together): no add may fail.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.replay_flow import REPO, setup_env
+from bench.restart_backlog import FIRST_CHAT, push_forms
+
+
+async def run_once(args, workers: int, form) -> dict:
+    import bench.fake_telegram as fake_mod
+    import config
+
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=args.api_port)
+    chats = [FIRST_CHAT + i for i in range(args.candidates)]
+    total = push_forms(fake, chats, form, args.job)
+    admin_id = config.ADMINS[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(REPO),
+            "FSM_SQLITE_PATH": os.path.join(tmp, "fsm.sqlite3"),
+            "ARCHIVE_PATH": os.path.join(tmp, "applications.sqlite3"),
+            "FSM_STORAGE": args.storage,
+            "SHARD_SOCKET": os.path.join(tmp, "shard.sock"),
+            "BACKLOG_RATE": "0",
+            "THROTTLE_ENABLED": "0",
+        }
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "shard", "--workers", str(workers)],
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            await asyncio.wait_for(fake.polling_started.wait(), 60)
+            started = time.perf_counter()
+            reports = 0
+            while time.perf_counter() - started < args.timeout:
+                await asyncio.sleep(0.05)
+                reports = sum(1 for chat, m, _ in fake.sent_log if chat == admin_id and m == "sendVoice")
+                if reports >= args.candidates:
+                    break
+            elapsed = time.perf_counter() - started
+            archived = dict(sqlite3.connect(env["ARCHIVE_PATH"]).execute(
+                "SELECT user_id, COUNT(*) FROM applications GROUP BY user_id"))
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            await fake.stop()
+    return {
+        "label": args.label,
+        "workers": workers,
+        "cpus": os.cpu_count(),
+        "candidates": args.candidates,
+        "updates": total,
+        "completed": reports,
+        "archived": len(archived),
+        "archived_twice": sum(1 for n in archived.values() if n > 1),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(total / elapsed, 1),
+        "api_calls": sum(v for k, v in fake.calls.items() if k != "getUpdates"),
+    }
+
+
+def _writer(path: str, proc: int, adds: int, start, errors):
+    from archive import Archive
+
+    archive = Archive(path)
+    start.wait()
+
+    async def go():
+        failed = 0
+        for i in range(adds):
+            try:
+                await archive.add(proc * 1_000_000 + i, f"+99890{proc:03d}{i:04d}", "HR", answers={"i": i})
+            except sqlite3.OperationalError:
+                failed += 1
+        return failed
+
+    errors[proc] = asyncio.run(go())
+
+
+def check_archive_writers(procs: int, adds: int) -> dict:
+    # several processes adding applications to one archive at once
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "applications.sqlite3")
+        from archive import Archive
+        Archive(path)  # schema in place before the writers race
+        ctx = multiprocessing.get_context("spawn")
+        start, errors = ctx.Event(), ctx.Manager().dict()
+        workers = [ctx.Process(target=_writer, args=(path, p, adds, start, errors)) for p in range(procs)]
+        for w in workers:
+            w.start()
+        time.sleep(1)  # all connected
+        started = time.perf_counter()
+        start.set()
+        for w in workers:
+            w.join()
+        rows = sqlite3.connect(path).execute("SELECT COUNT(*) FROM applications").fetchone()[0]
+    return {
+        "writer_procs": procs,
+        "adds": procs * adds,
+        "rows": rows,
+        "errors": sum(errors.values()),
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+
+
+async def run(args):
+    from bot import questionnaire_for  # only for the step table; this process never polls
+    form = questionnaire_for(args.job)
+    results = []
+    for workers in args.workers:
+        result = await run_once(args, workers, form)
+        print(json.dumps(result))
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ingress + N workers: throughput vs worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--job", default="HR")
+    parser.add_argument("--storage", choices=["sqlite", "redis", "memory"], default="sqlite")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--api-port", type=int, default=8100)
+    parser.add_argument("--writer-procs", type=int, default=3, help="processes racing Archive.add; 0 = skip")
+    parser.add_argument("--writer-adds", type=int, default=300, help="Archive.add calls per process")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="append the JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({"METRICS_PORT": "0", "OUT_GLOBAL_RATE": "1e9", "OUT_GLOBAL_BURST": "1e9"})
+        failures = []
+        if args.writer_procs:
+            writers = check_archive_writers(args.writer_procs, args.writer_adds)
+            print(json.dumps(writers))
+            if writers["errors"] or writers["rows"] != writers["adds"]:
+                failures.append(f"concurrent archive writers: {writers['errors']} failed adds, "
+                                f"{writers['rows']} rows for {writers['adds']}")
+        results = asyncio.run(run(args))
+    for r in results:
+        if r["completed"] < r["candidates"] or r["archived"] != r["candidates"] or r["archived_twice"]:
+            failures.append(f"{r['workers']} workers: {r['completed']} reports, {r['archived']} archived "
+                            f"({r['archived_twice']} twice) for {r['candidates']} candidates")
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r) + "\n")
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
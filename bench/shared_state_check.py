@@ -0,0 +1,137 @@
+# bench/shared_state_check.py
+# Admin state shared by the shard.py workers: concurrent changes on different workers.
+#
+#   python -m bench.shared_state_check [--rounds 5]
+#
+# `python -m shard --workers 2` against the fake Bot API. Two extra admins, one routed
+# to each worker. Every round, at the same moment, admin A starts /setmedia on worker 0
+# and admin B runs /add_admin (and /remove_admin of the previous round's admin) on
+# worker 1; once both got their reply and the debounced writes landed, bot_state.json
+# must hold both changes. Then A sends the file and media_store.json must hold it with
+# the pending key gone. At the end every change of every round must be in the files.
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from bench.replay_flow import REPO, setup_env
+
+WORKERS = 2
+
+
+def pick(first: int, shard: int) -> int:
+    # a chat id the ingress routes to `shard`
+    from shard import shard_of
+    return next(c for c in range(first, first + WORKERS) if shard_of(c, WORKERS) == shard)
+
+
+async def run(args) -> list:
+    import bench.fake_telegram as fake_mod
+    import config
+
+    main_admin = config.ADMINS[0]
+    admin_a, admin_b = pick(910_000, 0), pick(920_000, 1)
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=args.api_port)
+    failures = []
+    ids = iter(range(1, 10_000_000))
+    with tempfile.TemporaryDirectory() as tmp:
+        state_file, media_file = Path(tmp, "bot_state.json"), Path(tmp, "media_store.json")
+        state_file.write_text(json.dumps({"admins": [main_admin, admin_a, admin_b], "pending_set_media": {}}))
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(REPO),
+            "FSM_SQLITE_PATH": os.path.join(tmp, "fsm.sqlite3"),
+            "ARCHIVE_PATH": os.path.join(tmp, "applications.sqlite3"),
+            "SHARD_SOCKET": os.path.join(tmp, "shard.sock"),
+            "THROTTLE_ENABLED": "0",
+        }
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "shard", "--workers", str(WORKERS)],
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+        async def say(chat, update):
+            reply = fake.wait_reply(chat)
+            fake.push_update(update)
+            await asyncio.wait_for(reply, 30)
+
+        def read(path: Path) -> dict:
+            return json.loads(path.read_text("utf-8")) if path.exists() else {}
+
+        try:
+            await asyncio.wait_for(fake.polling_started.wait(), 60)
+            await asyncio.sleep(1)  # both workers connected
+            added = []
+            for r in range(args.rounds):
+                new_admin = 930_000 + r
+                b_cmds = [f"/add_admin {new_admin}"] + ([f"/remove_admin {added[-1]}"] if added else [])
+
+                async def admin_b_turn():
+                    for text in b_cmds:
+                        await say(admin_b, fake_mod.make_message_update(next(ids), admin_b, text))
+
+                await asyncio.gather(
+                    say(admin_a, fake_mod.make_message_update(next(ids), admin_a, "/setmedia start_video")),
+                    admin_b_turn(),
+                )
+                added.append(new_admin)
+                await asyncio.sleep(args.settle)
+                state = read(state_file)
+                if state.get("pending_set_media", {}).get(str(admin_a)) != "start_video":
+                    failures.append(f"round {r}: pending /setmedia of admin A lost: {state.get('pending_set_media')}")
+                admins = state.get("admins", [])
+                if new_admin not in admins:
+                    failures.append(f"round {r}: /add_admin {new_admin} lost: {admins}")
+                if len(added) > 1 and added[-2] in admins:
+                    failures.append(f"round {r}: /remove_admin {added[-2]} lost: {admins}")
+
+                file_id = f"START-{r}"
+                await say(admin_a, fake_mod.make_message_update(
+                    next(ids), admin_a, video={"file_id": file_id, "file_unique_id": f"u{r}",
+                                               "duration": 1, "width": 1, "height": 1}))
+                await asyncio.sleep(args.settle)
+                if read(media_file).get("start_video") != file_id:
+                    failures.append(f"round {r}: start_video is {read(media_file).get('start_video')}, "
+                                    f"expected {file_id}")
+                if str(admin_a) in read(state_file).get("pending_set_media", {}):
+                    failures.append(f"round {r}: pending /setmedia not cleared")
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            await fake.stop()
+        final = read(state_file)
+        expected = [main_admin, admin_a, admin_b, added[-1]] if added else [main_admin, admin_a, admin_b]
+        if sorted(final.get("admins", [])) != sorted(expected):
+            failures.append(f"final admins {final.get('admins')}, expected {expected}")
+        print(f"{args.rounds} rounds; admins {final.get('admins')}, "
+              f"start_video {read(media_file).get('start_video')}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="concurrent admin changes on two shard workers")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--settle", type=float, default=1.5, help="seconds for the debounced writes")
+    parser.add_argument("--api-port", type=int, default=8106)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_env(tmp, args.api_port)
+        os.environ.update({"METRICS_PORT": "0"})
+        failures = asyncio.run(run(args))
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bench/webhook_vs_polling.py
+# End-to-end latency and updates/sec of bot.py in polling vs webhook mode, on one machine.
+#
+#   python -m bench.webhook_vs_polling --updates 2000 --concurrency 50
+#
+# Starts bench.fake_telegram, runs bot.py as a subprocess pointed at it
+# (TELEGRAM_API_URL), then delivers "/id" updates from distinct chats and measures
+# the time until the bot's sendMessage for that chat reaches the fake API.
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.fake_telegram import FakeTelegram, make_message_update
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def run_mode(mode: str, updates: int, concurrency: int, api_port: int, webhook_port: int) -> dict:
+    fake = FakeTelegram()
+    await fake.start(port=api_port)
+    env = dict(
+        os.environ,
+        BOT_MODE=mode,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+        WEBHOOK_HOST="127.0.0.1",
+        WEBHOOK_PORT=str(webhook_port),
+        WEBHOOK_URL=f"http://127.0.0.1:{webhook_port}",
+    )
+    # fresh state files per run: the update ledger would drop the reused update ids
+    tmp = tempfile.TemporaryDirectory()
+    proc = subprocess.Popen(
+        [sys.executable, str(ROOT / "bot.py")], cwd=tmp.name, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        ready = fake.webhook_set if mode == "webhook" else fake.polling_started
+        await asyncio.wait_for(ready.wait(), 30)
+
+        sem = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(i: int):
+            chat_id = 100_000 + i
+            update = make_message_update(i + 1, chat_id, "/id")
+            async with sem:
+                reply = fake.wait_reply(chat_id)
+                t0 = time.perf_counter()
+                if mode == "webhook":
+                    await fake.post_webhook(update)
+                else:
+                    fake.push_update(update)
+                _, t1 = await asyncio.wait_for(reply, 30)
+                latencies.append((t1 - t0) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(updates)))
+        elapsed = time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        await fake.stop()
+        tmp.cleanup()
+
+    return {
+        "mode": mode,
+        "updates": updates,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(updates / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p90": round(percentile(latencies, 90), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="polling vs webhook latency benchmark")
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8082)
+    args = parser.parse_args()
+
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        results.append(await run_mode(mode, args.updates, args.concurrency, args.api_port, args.webhook_port))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
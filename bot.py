@@ -1,82 +1,237 @@
 # bot.py
 import asyncio
-import json
 import logging
-import os
 import re
+import stat
+import tempfile
+import time
+from dataclasses import asdict
 from datetime import datetime
 from pathlib import Path
 
-from aiogram import Bot, Dispatcher, F, types
+import aiofiles.os
+from aiogram import Bot, F, Router, types
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
-    Message, CallbackQuery,
+    Message, CallbackQuery, FSInputFile,
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 )
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 
 import config
+import export
+from answers import get_answer, get_answers, get_field, set_answer, set_field
+from archive import Archive, normalize_phone
+from broadcast import Broadcaster
+from capture import UpdateCapture
+from fsm_storage import CachedStorage, CoalescingMiddleware, build_storage, parse_key
+from funnel import ALL_JOBS, Funnel, read_data
+from http_pool import Pool, PooledSession
+from ledger import JournaledDispatcher, UpdateLedger, current_update_id
+from logs import LogContextMiddleware, logging_stats, setup_logging
+from media_archive import MediaArchiver
+from metrics import (
+    HandlerMetricsMiddleware, InstrumentedSession, MetricsServer, UpdateMetricsMiddleware,
+    instrument_storage, per_key, registry,
+)
+from notify import AdminNotifier, Report
+from outbound import PRIORITY_BACKGROUND, OutboundScheduler, priority
+from persist import JsonStore
+from roles import ADMIN_COMMANDS, IsAdmin
+from scheduler import UpdateScheduler
+from shard import shard_of, shard_path
+from throttle import ThrottlingMiddleware
+from questionnaire import (
+    CHOICE, DATE, PHONE, QUESTIONNAIRES, VIDEO, VOICE,
+    InForm, Questionnaire, Step, choice_kb, extract_answer, parse_choice, parse_state, register,
+)
+
+STARTED_AT = time.monotonic()
+# one of SHARD_COUNT worker processes (python -m shard); 0 / 1 for a single process
+SHARD, SHARDS = config.SHARD_INDEX, max(config.SHARD_COUNT, 1)
 
 # ---- LOGGER ----
-logging.basicConfig(level=logging.INFO)
+# no-op when shard.py set it up already
+setup_logging(config.LOG_LEVEL, config.LOG_FORMAT, config.LOG_FILE, config.LOG_FILE_MB, config.LOG_FILE_KEEP,
+              config.LOG_QUEUE, config.LOG_SAMPLE_BURST, config.LOG_SAMPLE_WINDOW,
+              static={"shard": SHARD} if SHARDS > 1 else None)
 logger = logging.getLogger(__name__)
 
-# ---- BOT / DISPATCHER (fast mode) ----
-bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage(), fast_mode=True)
+# ---- BOT / DISPATCHER ----
+def make_session():
+    # custom Bot API address (local fake Telegram for benchmarks); default — api.telegram.org.
+    # InstrumentedSession: every API call is timed for /metrics; PooledSession adds a
+    # connection pool per traffic class (long poll / small JSON / files)
+    kwargs = {"api": TelegramAPIServer.from_base(config.TELEGRAM_API_URL)} if config.TELEGRAM_API_URL else {}
+    if not config.HTTP_POOLED:
+        return InstrumentedSession(**kwargs)
+    return PooledSession(
+        pools={
+            "poll": Pool(limit=1, keepalive=config.HTTP_KEEPALIVE, timeout=config.HTTP_API_TIMEOUT),
+            "api": Pool(limit=config.HTTP_API_CONNECTIONS, keepalive=config.HTTP_KEEPALIVE, timeout=config.HTTP_API_TIMEOUT),
+            "media": Pool(limit=config.HTTP_MEDIA_CONNECTIONS, keepalive=config.HTTP_KEEPALIVE, timeout=config.HTTP_MEDIA_TIMEOUT),
+        },
+        method_timeouts=config.HTTP_METHOD_TIMEOUTS,
+        dns_ttl=config.HTTP_DNS_TTL,
+        **kwargs,
+    )
+
+bot = Bot(token=config.BOT_TOKEN, session=make_session())
+# every API call goes through the outbound scheduler (rate limits, 429 retry, priorities)
+outbound = OutboundScheduler(
+    global_rate=config.OUT_GLOBAL_RATE / SHARDS,  # the per-bot limit is shared by the workers
+    global_burst=config.OUT_GLOBAL_BURST,
+    chat_rate=config.OUT_CHAT_RATE,
+    chat_burst=config.OUT_CHAT_BURST,
+    max_retries=config.OUT_MAX_RETRIES,
+)
+bot.session.middleware(outbound)
+notifier = AdminNotifier(bot, concurrency=config.NOTIFY_CONCURRENCY, retries=config.NOTIFY_RETRIES)
+storage = build_storage()
+dp = JournaledDispatcher(storage=storage)  # polling goes through the update ledger
+ADMIN_IDS = set(config.ADMINS)  # O(1) checks; config.ADMINS keeps the order (main admin first)
+# admin handlers first: candidates fail one set lookup and skip the whole router
+admin = Router(name="admin")
+admin.message.filter(IsAdmin(ADMIN_IDS))
+candidate = Router(name="candidate")
+dp.include_routers(admin, candidate)
+archive = Archive(config.ARCHIVE_PATH)  # completed applications
+notifier.on_delivered = archive.report_delivered  # admin reports stay in the archive's outbox until sent
+
+@dp.startup()
+async def resume_reports():
+    # admin reports the last run archived but did not deliver (the candidate's worker sends).
+    # Registered before ledger.install: a replayed final update may archive and submit a
+    # report while later startup handlers wait on the network; read after that, the outbox
+    # would hand the same report to the notifier a second time.
+    for app_id, user_id, admins, report in await archive.pending_reports():
+        if shard_of(user_id, SHARDS) == SHARD:
+            notifier.submit(admins, Report(**report), report_id=app_id)
+
+# processed update_ids and a journal of unfinished ones: restarts neither lose nor repeat updates
+ledger = UpdateLedger(
+    shard_path(config.UPDATE_LEDGER_PATH, SHARD, SHARDS),
+    window=config.UPDATE_DEDUPE_WINDOW,
+    drain_rate=config.BACKLOG_RATE,
+)
+ledger.load()
+ledger.install(dp)
+# traffic capture for offline replay: before the anti-flood and the queue, so it records what Telegram sent
+capture = None
+if config.CAPTURE_DIR:
+    capture = UpdateCapture(
+        config.CAPTURE_DIR,
+        max_bytes=int(config.CAPTURE_MAX_MB * 1024 ** 2),
+        keep=config.CAPTURE_KEEP,
+        anonymize=config.CAPTURE_ANONYMIZE,
+        salt=config.CAPTURE_SALT,
+    )
+    capture.install(dp)
+# per-user anti-flood: excess updates are dropped before the queue and the storage
+throttle = ThrottlingMiddleware(config.THROTTLE_LIMITS if config.THROTTLE_ENABLED else {}, max_users=config.THROTTLE_MAX_USERS, exempt=ADMIN_IDS)
+throttle.install(dp)
+# bounded, per-chat-ordered execution instead of one unbounded task per update
+scheduler = UpdateScheduler(
+    max_concurrent=config.SCHED_MAX_CONCURRENT,
+    max_queue=config.SCHED_MAX_QUEUE,
+    overflow=config.SCHED_OVERFLOW,
+)
+scheduler.install(dp)
+dp.shutdown.register(notifier.wait_closed)
+# /broadcast jobs: state in the archive, sends at background priority
+broadcaster = Broadcaster(
+    bot, archive, lambda: list(config.ADMINS),
+    rate=config.BROADCAST_RATE,
+    concurrency=config.BROADCAST_CONCURRENCY,
+    report_every=config.BROADCAST_REPORT_SEC,
+)
+dp.shutdown.register(broadcaster.close)  # before archive.close: the jobs write to it
+# local copies of the candidates' voice / video answers, downloaded in the background
+media_archiver = None
+if config.MEDIA_ARCHIVE_DIR:
+    media_archiver = MediaArchiver(
+        bot, archive, config.MEDIA_ARCHIVE_DIR,
+        workers=config.MEDIA_WORKERS,
+        queue_size=config.MEDIA_QUEUE,
+        max_file_bytes=int(config.MEDIA_MAX_FILE_MB * 1024 ** 2),
+        max_total_bytes=int(config.MEDIA_QUOTA_MB * 1024 ** 2),
+        min_free_bytes=int(config.MEDIA_MIN_FREE_MB * 1024 ** 2),
+        timeout=config.MEDIA_DOWNLOAD_TIMEOUT,
+    )
+    dp.shutdown.register(media_archiver.close)
+dp.shutdown.register(archive.close)
+funnel = Funnel(shard_path(config.FUNNEL_PATH, SHARD, SHARDS), flush_every=config.FUNNEL_FLUSH_SEC)  # per-step drop-off and timing
+funnel.load()
+dp.shutdown.register(funnel.close)
+# latency metrics: whole update (after the queue), per handler / FSM state, storage, API
+update_metrics = UpdateMetricsMiddleware(slow_ms=config.SLOW_UPDATE_MS)
+update_metrics.install(dp)
+for router in (admin, candidate):
+    router.message.middleware(HandlerMetricsMiddleware())
+    router.callback_query.middleware(HandlerMetricsMiddleware())
+if isinstance(storage, CachedStorage):
+    if SHARDS > 1:
+        # shared backend: track (expire, remind) only the chats routed to this worker
+        storage.owns = lambda k: shard_of(parse_key(k).chat_id, SHARDS) == SHARD
+    # set_state + update_data of one update -> one storage write
+    dp.update.outer_middleware(CoalescingMiddleware(storage))
+    instrument_storage(storage)
+# update_id / user / FSM state on every log record of the update
+LogContextMiddleware().install(dp)
+# last: inside the FSM middleware and the write coalescing
+dp.update.outer_middleware(ledger.done)
+
+# ---- persistent runtime state: media file_ids, admins, /setmedia waits ----
+MEDIA = {}  # in-memory media mapping
+# pending map for /setmedia command: admin_id -> key (waiting for admin to send file)
+PENDING_SET_MEDIA = {}
 
-# ---- persistent media storage (file_ids) ----
-MEDIA_STORE_PATH = Path("media_store.json")
+# shared by the worker processes (shard.py): every change names its key, writes merge per key
+media_store = JsonStore("media_store.json", lambda: MEDIA, shared=True)
+state_store = JsonStore("bot_state.json", lambda: {
+    "admins": config.ADMINS,
+    "pending_set_media": {str(k): v for k, v in PENDING_SET_MEDIA.items()},
+}, shared=True)
 
 def load_media_store():
-    # load saved file_ids (if exist), merge with config.MEDIA defaults
+    # load saved file_ids (if exist) and our unsaved changes, merge with config.MEDIA defaults
     ms = dict(config.MEDIA or {})
-    if MEDIA_STORE_PATH.exists():
-        try:
-            j = json.loads(MEDIA_STORE_PATH.read_text("utf-8"))
-            ms.update(j)
-        except Exception:
-            logger.exception("Can't read media_store.json")
+    ms.update(media_store.merged({}))
     return ms
 
-def save_media_store(media_dict):
-    try:
-        MEDIA_STORE_PATH.write_text(json.dumps(media_dict, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        logger.exception("Can't write media_store.json")
-
-MEDIA = load_media_store()  # in-memory media mapping
-# pending map for /setmedia command: admin_id -> key (waiting for admin to send file)
-PENDING_SET_MEDIA = {}
-
-# ---- Questions (1..22) ----
-QUESTIONS = [
-    "1/22. Ism-familyangizni yozing:",
-    "2/22. Telefon raqamingizni yozing:\n\nMisol: +998909998877",
-    "3/22. Doimiy yashash manzilingizni yozing (propiska):",
-    "4/22. O'z tug'ilgan kuningizni 01.01.2000 formatda yozing:",
-    "5/22. Ma'lumotingiz (tugmani tanlang yoki yozing):",
-    "6/22. Oldin qaysi korxonalarda va qaysi lavozimda ishlagansiz?\n\nMisol:\n1. Perfect Consulting Group - Sotuv menejeri\n2. Alora - sotuvchi\n3. Ishlamaganman",
-    "7/22. Oila qurganmisiz?",
-    "8/22. (служебный шаг — бот отправит голос, а затем ждёт voice от пользователя)",
-    "9/22. Iltimos, ovozli xabar yuboring (mikrofonga yozib).",
-    "10/22. Rus tilini qay darajada bilasiz?",
-    "11/22. Iltimos, qisqa video yuboring (selfie video).",
-    "12/22. Oxirgi ish joyingizdan siz haqingizda surishtirishimizga rozimisiz? (ha/yo'q)",
-    "13/22. Oxirgi ish joyingizdan kim sizga tavsiya xati bera oladi, nomi, ishlash joyi, lavozimi, telefon raqami:\n\nMisol: Direktor - Malika Akramovna - Nona collection - +998909998877",
-    "14/22. Bizning korxonada qancha muddat ishlamoqchisiz?",
-    "15/22. Korxonada ishdan keyin ham qolib ishlash kerak bo‘lib qolsa ishlaysizmi?",
-    "16/22. Sog‘ligingizda muammo yo‘qmi?",
-    "17/22. Nima uchun ayrim odamlar ishga kech kelishadi?",
-    "18/22. Nima uchun ayrim insonlar o'g'rilik qilishadi?",
-    "19/22. Nima uchun ayrim ishchilar yaxshi ishlashadi, ayrimlari yomon? Bunga sabab nima?",
-    "20/22. Oldingi ishxonangizda qancha maoshga ishlgansiz?",
-    "21/22. Bizning ishxonamizda qancha maoshga ishlamoqchisiz?",
-    "22/22. Qanday kurslarda o’qigansiz?"
-]
+def save_media_store(*paths):
+    # debounced atomic write of the changed MEDIA keys: ("q9_voice_prompt",), (UPLOADS_KEY, cache key)
+    media_store.mark_dirty(*paths)
+
+def load_state_store():
+    apply_state(state_store.merged({}))
+
+def apply_state(saved):
+    if saved.get("admins"):
+        main = config.ADMINS[:1]  # the main admin from config always stays first
+        config.ADMINS[:] = main + [a for a in saved["admins"] if a not in main]
+        ADMIN_IDS.clear()
+        ADMIN_IDS.update(config.ADMINS)
+    PENDING_SET_MEDIA.update({int(k): v for k, v in saved.get("pending_set_media", {}).items()})
+
+def reload_shared_state():
+    # another worker (shard.py) wrote media_store.json / bot_state.json: its keys from the
+    # files, ours still waiting for the write on top (merged() before anything is cleared)
+    media = load_media_store()
+    MEDIA.clear()
+    MEDIA.update(media)
+    saved = state_store.merged({})
+    PENDING_SET_MEDIA.clear()
+    apply_state(saved)
+
+MEDIA.update(load_media_store())
+load_state_store()
+dp.shutdown.register(media_store.close)
+dp.shutdown.register(state_store.close)
 
 # ---- Keyboards ----
 def job_types_kb() -> InlineKeyboardMarkup:
@@ -92,24 +247,6 @@ def job_types_kb() -> InlineKeyboardMarkup:
         kb.inline_keyboard.append(row)
     return kb
 
-def education_kb() -> InlineKeyboardMarkup:
-    opts = ["o'rta", "o'rta maxsus", "oliy"]
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=o, callback_data=f"edu|{o}")] for o in opts])
-
-def marital_kb() -> InlineKeyboardMarkup:
-    opts = ["turmush qurganman", "turmush qurmaganman", "ajrashganman"]
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=o, callback_data=f"marital|{o}")] for o in opts])
-
-def rus_level_kb() -> InlineKeyboardMarkup:
-    opts = ["a'lo", "yaxshi", "past", "bilmayman"]
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=o, callback_data=f"rus|{o}")] for o in opts])
-
-def yesno_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="ha", callback_data="consent|ha"),
-         InlineKeyboardButton(text="yo'q", callback_data="consent|yoq")]
-    ])
-
 def contact_kb() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="📱 Telefon raqamini yuborish", request_contact=True)]],
@@ -119,33 +256,9 @@ def contact_kb() -> ReplyKeyboardMarkup:
 # ---- FSM states ----
 class FormState(StatesGroup):
     waiting_job = State()
-    q1 = State()
-    q2 = State()
-    q3 = State()
-    q4 = State()
-    q5 = State()
-    q6 = State()
-    q7 = State()
-    q8 = State()   # service (bot sends voice prompt)
-    q9 = State()   # strict voice expected
-    q10 = State()  # rus level
-    q11 = State()  # strict video expected
-    q12 = State()
-    q13 = State()
-    q14 = State()
-    q15 = State()
-    q16 = State()
-    q17 = State()
-    q18 = State()
-    q19 = State()
-    q20 = State()
-    q21 = State()
-    q22 = State()
+    # questionnaire steps: dynamic states "form:<name>:<index>" (see questionnaire.py)
 
 # ---- Utilities ----
-def file_exists(path: str) -> bool:
-    return bool(path) and os.path.isfile(path)
-
 def validate_date(text: str) -> bool:
     try:
         datetime.strptime(text.strip(), "%d.%m.%Y")
@@ -156,13 +269,316 @@ def validate_date(text: str) -> bool:
 def validate_phone(text: str) -> bool:
     return bool(re.fullmatch(r"\+?\d[\d\s\-]{7,20}", text.strip()))
 
+# ---- Questionnaires (step tables) ----
+# Adding a question = adding a row. Question 8/22 is a service step (the bot sends the
+# voice prompt), so it has no row of its own.
+DEFAULT_STEPS = [
+    Step("Ism-familya", "1/22. Ism-familyangizni yozing:"),
+    Step("Telefon", "2/22. Telefon raqamingizni yozing:\n\nMisol: +998909998877", kind=PHONE,
+         validator=validate_phone, keyboard=contact_kb,
+         error="📞 Telefon raqamini to‘g‘ri formatda yozing. Misol: +998909998877"),
+    Step("Manzil (propiska)", "3/22. Doimiy yashash manzilingizni yozing (propiska):"),
+    Step("Tug'ilgan sana", "4/22. O'z tug'ilgan kuningizni 01.01.2000 formatda yozing:", kind=DATE,
+         validator=validate_date, error="Tug'ilgan kuningizni 01.01.2000 formatda yozing."),
+    Step("Ma'lumoti", "5/22. Ma'lumotingiz (tugmani tanlang yoki yozing):", kind=CHOICE,
+         options=("o'rta", "o'rta maxsus", "oliy")),
+    Step("Ish tajribasi", "6/22. Oldin qaysi korxonalarda va qaysi lavozimda ishlagansiz?\n\nMisol:\n1. Perfect Consulting Group - Sotuv menejeri\n2. Alora - sotuvchi\n3. Ishlamaganman"),
+    Step("Oilaviy holat", "7/22. Oila qurganmisiz?", kind=CHOICE,
+         options=("turmush qurganman", "turmush qurmaganman", "ajrashganman")),
+    Step("Voice file_id", "9/22. Iltimos, ovozli xabar yuboring (mikrofonga yozib).", kind=VOICE,
+         media="q9_voice_prompt", media_type="voice", error="📢 Iltimos, ovozli xabar yuboring (voice)."),
+    Step("Rus tili", "10/22. Rus tilini qay darajada bilasiz?", kind=CHOICE,
+         options=("a'lo", "yaxshi", "past", "bilmayman")),
+    Step("Video file_id", "11/22. Iltimos, qisqa video yuboring (selfie video).", kind=VIDEO,
+         media="q11_video_prompt", media_type="video", error="🎥 Iltimos, qisqa video yuboring (kamera orqali)."),
+    Step("Rozilik (surishtirish)", "12/22. Oxirgi ish joyingizdan siz haqingizda surishtirishimizga rozimisiz? (ha/yo'q)",
+         kind=CHOICE, options=("ha", "yo'q"), columns=2, free_text=False, error="👇 Tugmani tanlang."),
+    Step("Tavsiya beruvchi", "13/22. Oxirgi ish joyingizdan kim sizga tavsiya xati bera oladi, nomi, ishlash joyi, lavozimi, telefon raqami:\n\nMisol: Direktor - Malika Akramovna - Nona collection - +998909998877"),
+    Step("Bizda qancha muddat ishlamoqchi", "14/22. Bizning korxonada qancha muddat ishlamoqchisiz?"),
+    Step("Ishdan keyin qolish rozilik", "15/22. Korxonada ishdan keyin ham qolib ishlash kerak bo‘lib qolsa ishlaysizmi?"),
+    Step("Sog'liq holati", "16/22. Sog‘ligingizda muammo yo‘qmi?"),
+    Step("Nega kech kelishadi", "17/22. Nima uchun ayrim odamlar ishga kech kelishadi?"),
+    Step("Nega o'g'rilik qilishadi", "18/22. Nima uchun ayrim insonlar o'g'rilik qilishadi?"),
+    Step("Ish sifati sababi", "19/22. Nima uchun ayrim ishchilar yaxshi ishlashadi, ayrimlari yomon? Bunga sabab nima?"),
+    Step("Oldingi maosh", "20/22. Oldingi ishxonangizda qancha maoshga ishlgansiz?"),
+    Step("Istalgan maosh", "21/22. Bizning ishxonamizda qancha maoshga ishlamoqchisiz?"),
+    Step("Kurslar", "22/22. Qanday kurslarda o’qigansiz?"),
+]
+
+register(Questionnaire("default", DEFAULT_STEPS))
+
+def questionnaire_for(job: str) -> Questionnaire:
+    # config.JOB_QUESTIONNAIRES: job type -> questionnaire name; others use "default"
+    name = getattr(config, "JOB_QUESTIONNAIRES", {}).get(job, "default")
+    return QUESTIONNAIRES.get(name) or QUESTIONNAIRES["default"]
+
+# ---- Sending prompts ----
+# Local media files are uploaded once: the file_id Telegram returns is kept in
+# MEDIA[UPLOADS_KEY] under "<path>|<size>|<mtime_ns>" (a changed file gets a new key)
+# and persisted in media_store.json; later sends reuse it.
+UPLOADS_KEY = "_uploaded"
+_uploading = {}  # cache key -> future of the upload in progress
+
+async def local_media_key(path: str):
+    # None if path is not a local file (then it is a file_id)
+    try:
+        st = await aiofiles.os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return f"{path}|{st.st_size}|{st.st_mtime_ns}"
+
+def uploaded_file_id(msg: Message):
+    media = msg.voice or msg.video or msg.video_note or msg.document
+    return media.file_id if media else None
+
+def remember_upload(path: str, cache_key: str, msg: Message):
+    file_id = uploaded_file_id(msg)
+    if not file_id:
+        return
+    uploads = MEDIA.setdefault(UPLOADS_KEY, {})
+    old = [k for k in uploads if k.split("|", 1)[0] == path]
+    for k in old:
+        del uploads[k]  # ids of older versions of this file
+    uploads[cache_key] = file_id
+    save_media_store(*((UPLOADS_KEY, k) for k in old + [cache_key]))
+
+async def send_media_prompt(message: Message, media_key: str, media_type: str, caption: str, reply_markup=None) -> bool:
+    # prepared voice/video (file_id or local file) with the question as caption
+    mfile = MEDIA.get(media_key, "")
+    if not mfile or media_key in BAD_MEDIA:
+        return False
+    send = message.answer_voice if media_type == "voice" else message.answer_video
+    try:
+        cache_key = await local_media_key(mfile)
+        if cache_key is None:
+            await send(mfile, caption=caption, reply_markup=reply_markup)
+            return True
+
+        uploads = MEDIA.setdefault(UPLOADS_KEY, {})
+        if cache_key in _uploading:  # someone is uploading this file right now
+            await asyncio.shield(_uploading[cache_key])
+        file_id = uploads.get(cache_key)
+        if file_id:
+            try:
+                await send(file_id, caption=caption, reply_markup=reply_markup)
+                return True
+            except TelegramBadRequest:
+                uploads.pop(cache_key, None)  # stale id: upload again
+
+        fut = _uploading[cache_key] = asyncio.get_running_loop().create_future()
+        try:
+            msg = await send(FSInputFile(mfile), caption=caption, reply_markup=reply_markup)
+            remember_upload(mfile, cache_key, msg)
+        finally:
+            if _uploading.get(cache_key) is fut:
+                del _uploading[cache_key]
+            fut.set_result(None)
+        return True
+    except Exception:
+        return False
+
+# ---- Funnel: step entered / answered ----
+STEP_AT = "_step_at"  # FSM data field: when the current step was asked
+
+async def step_entered(state: FSMContext, form: Questionnaire, idx: int):
+    if await state.get_state() == form.state(idx):
+        return  # asked again (wrong input, resume): same visit
+    funnel.enter(await get_answer(state, "Ish turi", "-"), form.steps[idx].key)
+    await set_field(state, STEP_AT, time.time())
+
+async def step_answered(state: FSMContext, step: Step):
+    started = await get_field(state, STEP_AT)
+    funnel.complete(await get_answer(state, "Ish turi", "-"), step.key, time.time() - started if started else None)
+
+async def ask_step(message: Message, state: FSMContext, form: Questionnaire, idx: int):
+    step = form.steps[idx]
+    await step_entered(state, form, idx)
+    if step.kind == CHOICE:
+        markup = choice_kb(idx, step)
+    elif step.keyboard:
+        markup = step.keyboard()
+    elif idx and form.steps[idx - 1].keyboard:
+        markup = ReplyKeyboardRemove()  # hide the previous step's reply keyboard (contact)
+    else:
+        markup = None
+    sent = False
+    if step.media:
+        sent = await send_media_prompt(message, step.media, step.media_type, step.prompt, markup)
+    if not sent:
+        await message.answer(step.prompt, reply_markup=markup)
+    await state.set_state(form.state(idx))
+
+async def next_step(message: Message, state: FSMContext, form: Questionnaire, idx: int, user: types.User):
+    if idx + 1 < len(form.steps):
+        await ask_step(message, state, form, idx + 1)
+    else:
+        await finish_and_send(message, state, user)
+
+# ---- Abandoned forms: reminder before expiry, sweeper ----
+# The storage drops forms idle for FSM_SESSION_TTL and the oldest ones past
+# FSM_MAX_SESSIONS; the sweeper reminds once after FSM_REMIND_AFTER and tells the
+# candidates whose form the limit closed.
+def resume_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="▶️ Davom etish", callback_data="resume")]])
+
+async def remind_abandoned(key, raw_state: str):
+    parsed = parse_state(raw_state)
+    if parsed is None:
+        return  # not inside a questionnaire (e.g. still choosing the job)
+    form, idx = parsed
+    with priority(PRIORITY_BACKGROUND):
+        await bot.send_message(
+            key.chat_id,
+            f"⏳ Siz anketani {idx + 1}/{len(form.steps)}-savolda to'xtatib qo'ydingiz. Davom ettirasizmi?",
+            reply_markup=resume_kb(),
+        )
+
+async def notify_evicted(key, raw_state: str):
+    parsed = parse_state(raw_state)
+    if parsed is None:
+        return
+    form, idx = parsed
+    with priority(PRIORITY_BACKGROUND):
+        await bot.send_message(
+            key.chat_id,
+            f"⌛ Anketangiz {idx + 1}/{len(form.steps)}-savolda yopildi. Qaytadan boshlash uchun /start bosing.",
+        )
+
+_sweeper = None
+
+@dp.startup()
+async def start_sweeper():
+    global _sweeper
+    if isinstance(storage, CachedStorage) and (storage.ttl or storage.max_sessions):
+        _sweeper = asyncio.create_task(storage.run_sweeper(
+            interval=config.FSM_SWEEP_INTERVAL,
+            remind_after=config.FSM_REMIND_AFTER or None,
+            on_remind=remind_abandoned,
+            on_evict=notify_evicted,
+        ))
+
+@dp.shutdown()
+async def stop_sweeper():
+    if _sweeper:
+        _sweeper.cancel()
+
+@dp.startup()
+async def start_media_archiver():
+    # claimed downloads a restart cut off (this worker's candidates) go first
+    if media_archiver:
+        await media_archiver.start(lambda user_id: shard_of(user_id, SHARDS) == SHARD)
+
+# ---- Metrics endpoint ----
+registry.gauge("bot_scheduler", "Update scheduler counters", per_key(scheduler.stats), "counter")
+registry.gauge("bot_outbound", "Outbound scheduler counters", per_key(outbound.stats), "counter")
+if isinstance(bot.session, PooledSession):
+    registry.gauge("bot_http_pool", "Bot API connections per pool: new / reused / waits / DNS cache", bot.session.stats, "counter")
+registry.gauge("bot_throttle", "Anti-flood counters", per_key(throttle.stats), "counter")
+registry.gauge("bot_notifier", "Admin report deliveries", lambda: {"delivered": notifier.delivered, "failed": notifier.failed}, "result")
+registry.gauge("bot_slow_updates", "Updates slower than SLOW_UPDATE_MS", lambda: update_metrics.slow)
+if isinstance(storage, CachedStorage):
+    registry.gauge("bot_fsm_sessions", "Questionnaire sessions", storage.session_stats, "kind")
+registry.gauge("bot_update_ledger", "Duplicate / replayed / backlog updates", ledger.stats, "counter")
+if media_archiver:
+    registry.gauge("bot_media_archive", "Candidate voice / video copies", media_archiver.stats, "counter")
+registry.gauge("bot_logging", "Log records queued / dropped (queue full) / suppressed (repeats)", logging_stats, "counter")
+registry.gauge("bot_broadcasts", "Broadcast jobs in this process", broadcaster.stats, "kind")
+if capture:
+    registry.gauge("bot_capture", "Captured updates", capture.stats, "counter")
+metrics_server = MetricsServer(config.METRICS_HOST, config.METRICS_PORT + SHARD)
+
+@dp.startup()
+async def start_metrics():
+    if config.METRICS_PORT:
+        await metrics_server.start()
+
+@dp.shutdown()
+async def stop_metrics():
+    await metrics_server.stop()
+
+# ---- Startup: media pre-warm and validation ----
+# Every MEDIA key is checked at the same time: file_ids are probed with getFile, local
+# files are uploaded once (to the main admin, then deleted) so that the first candidate
+# already gets a cached file_id. Broken keys go to BAD_MEDIA and handlers send the
+# text fallback straight away instead of paying for a failed API call.
+BAD_MEDIA = set()
+
+def media_types() -> dict:
+    kinds = {"start_video": "video"}
+    for q in QUESTIONNAIRES.values():
+        for s in q.steps:
+            if s.media:
+                kinds[s.media] = s.media_type
+    return kinds
+
+async def probe_file_id(file_id: str) -> str:
+    # "" if Telegram knows the file_id, otherwise the error
+    try:
+        await bot.get_file(file_id)
+    except TelegramBadRequest as e:
+        if "too big" in e.message:  # valid id, only too large for getFile
+            return ""
+        return e.message
+    except Exception as e:
+        return str(e)
+    return ""
+
+async def check_media(key: str, media_type: str) -> str:
+    value = MEDIA.get(key) or ""
+    if not value:
+        return "o'rnatilmagan"
+    cache_key = await local_media_key(value)
+    if cache_key is None:
+        if "/" in value or "." in value:  # file_ids have neither: a missing local file
+            return "fayl topilmadi"
+        return await probe_file_id(value)
+
+    cached = MEDIA.get(UPLOADS_KEY, {}).get(cache_key)
+    if cached and not await probe_file_id(cached):
+        return ""
+    admins = getattr(config, "ADMINS", [])
+    if not admins:
+        return ""  # nowhere to pre-upload; uploaded on first use
+    send = bot.send_voice if media_type == "voice" else bot.send_video
+    try:
+        msg = await send(admins[0], FSInputFile(value), caption=f"prewarm: {key}", disable_notification=True)
+    except Exception as e:
+        return str(e)
+    remember_upload(value, cache_key, msg)
+    try:
+        await bot.delete_message(admins[0], msg.message_id)
+    except Exception:
+        pass
+    return ""
+
+@dp.startup()
+async def prewarm_media():
+    started = time.monotonic()
+    MEDIA.update(load_media_store())  # pick up edits made while the bot was down
+    BAD_MEDIA.clear()
+    kinds = media_types()
+    keys = list(kinds)
+    results = await asyncio.gather(*(check_media(k, kinds[k]) for k in keys))
+    lines = []
+    for key, error in zip(keys, results):
+        if error and MEDIA.get(key):
+            BAD_MEDIA.add(key)
+            logger.warning("Media %s is broken, text fallback will be used: %s", key, error)
+        lines.append(f"{key}: {'❌ ' + error if error else '✅'}")
+    logger.info("Media check took %.2fs; startup took %.2fs", time.monotonic() - started, time.monotonic() - STARTED_AT)
+    if SHARD == 0:  # one report per deployment, not per worker
+        notifier.submit(
+            getattr(config, "ADMINS", []),
+            Report(text="🔧 Bot ishga tushdi. Media:\n" + "\n".join(lines), parse_mode=None),
+        )
+
 # ---- Admin helpers: /setmedia, /getmedia ----
-@dp.message(Command("setmedia"))
+@admin.message(Command("setmedia"))
 async def cmd_setmedia(message: Message):
     # Usage: /setmedia start_video
     user_id = message.from_user.id
-    if user_id not in config.ADMINS:
-        return await message.answer("⛔ Faqat adminlar uchun.")
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
         return await message.answer("Foydalanish: /setmedia <key>\nKey-lar: start_video, q9_voice_prompt, q11_video_prompt")
@@ -170,13 +586,11 @@ async def cmd_setmedia(message: Message):
     if key not in ("start_video", "q9_voice_prompt", "q11_video_prompt"):
         return await message.answer("Noto'g'ri key. Ruxsat etilgan: start_video, q9_voice_prompt, q11_video_prompt")
     PENDING_SET_MEDIA[user_id] = key
+    state_store.mark_dirty(("pending_set_media", str(user_id)))
     await message.answer(f"Yaxshi — endi {key} uchun media yuboring (video yoki voice). Bot file_id-ni saqlaydi.")
 
-@dp.message(Command("getmedia"))
+@admin.message(Command("getmedia"))
 async def cmd_getmedia(message: Message):
-    user_id = message.from_user.id
-    if user_id not in config.ADMINS:
-        return await message.answer("⛔ Faqat adminlar uchun.")
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
         return await message.answer("Foydalanish: /getmedia <key>")
@@ -186,102 +600,191 @@ async def cmd_getmedia(message: Message):
         return await message.answer(f"{key} hozircha o'rnatilmagan.")
     await message.answer(f"{key} => `{value}`", parse_mode="Markdown")
 
-# When admin sends any media while pending, save file_id
-@dp.message(F.voice | F.video | F.video_note | F.document)
-async def handle_media_saving(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    if user_id in PENDING_SET_MEDIA:
-        key = PENDING_SET_MEDIA.pop(user_id)
-        file_id = None
-        # prefer voice -> video -> document
-        if message.voice:
-            file_id = message.voice.file_id
-        elif message.video:
-            file_id = message.video.file_id
-        elif message.video_note:
-            file_id = message.video_note.file_id
-        elif message.document:
-            file_id = message.document.file_id
-        if file_id:
-            MEDIA[key] = file_id
-            save_media_store(MEDIA)
-            await message.answer(f"✅ Saved `{key}` as file_id:\n`{file_id}`", parse_mode="Markdown")
-        else:
-            await message.answer("⚠️ Файл принят, но не удалось получить file_id.")
-        return
-    # else: not setting media — normal flow will continue (other handlers)
-    # do nothing here (other handlers will respond according to FSM)
+# Admin media while a /setmedia is pending: save its file_id. Without a pending key the
+# filter fails and the message goes on to the candidate router (admins can fill the form).
+@admin.message(F.voice | F.video | F.video_note | F.document, lambda m: m.from_user.id in PENDING_SET_MEDIA)
+async def handle_media_saving(message: Message):
+    key = PENDING_SET_MEDIA.pop(message.from_user.id)
+    state_store.mark_dirty(("pending_set_media", str(message.from_user.id)))
+    # prefer voice -> video -> document
+    media = message.voice or message.video or message.video_note or message.document
+    file_id = media.file_id if media else None
+    if file_id:
+        MEDIA[key] = file_id
+        BAD_MEDIA.discard(key)
+        save_media_store((key,))
+        await message.answer(f"✅ Saved `{key}` as file_id:\n`{file_id}`", parse_mode="Markdown")
+    else:
+        await message.answer("⚠️ Файл принят, но не удалось получить file_id.")
 
-# ---- Misc admin commands ----
-@dp.message(Command("id"))
+# ---- Misc admin commands (/id is for everybody) ----
+@candidate.message(Command("id"))
 async def cmd_id(message: Message):
     await message.answer(f"Sizning ID: <code>{message.from_user.id}</code>", parse_mode="HTML")
 
-@dp.message(Command("list_admins"))
+@admin.message(Command("list_admins"))
 async def cmd_list_admins(message: Message):
-    if message.from_user.id not in config.ADMINS:
-        return await message.answer("⛔ Bu buyruq faqat adminlar uchun.")
     await message.answer("Adminlar:\n" + "\n".join(str(x) for x in config.ADMINS))
 
-@dp.message(Command("add_admin"))
+@admin.message(Command("add_admin"))
 async def cmd_add_admin(message: Message):
-    if message.from_user.id not in config.ADMINS:
-        return await message.answer("⛔ Bu buyruq faqat bosh admin uchun.")
     parts = message.text.split()
     if len(parts) < 2 or not parts[1].isdigit():
         return await message.answer("Foydalanish: /add_admin 123456789")
     new_id = int(parts[1])
-    if new_id in config.ADMINS:
+    if new_id in ADMIN_IDS:
         return await message.answer("Bu ID allaqachon admin.")
     config.ADMINS.append(new_id)
+    ADMIN_IDS.add(new_id)
+    state_store.mark_dirty(("admins", new_id))
     await message.answer(f"✅ Admin qo'shildi: {new_id}")
 
-@dp.message(Command("remove_admin"))
+@admin.message(Command("remove_admin"))
 async def cmd_remove_admin(message: Message):
-    if message.from_user.id not in config.ADMINS:
-        return await message.answer("⛔ Bu buyruq faqat bosh admin uchun.")
     parts = message.text.split()
     if len(parts) < 2 or not parts[1].isdigit():
         return await message.answer("Foydalanish: /remove_admin 123456789")
     rem = int(parts[1])
-    if rem not in config.ADMINS:
+    if rem not in ADMIN_IDS:
         return await message.answer("Bu ID adminlar ro'yxatida yo'q.")
     if rem == config.ADMINS[0]:
         return await message.answer("Asosiy adminni olib tashlab bo'lmaydi.")
     config.ADMINS.remove(rem)
+    ADMIN_IDS.discard(rem)
+    state_store.mark_dirty(("admins", rem))
     await message.answer(f"✅ Admin o'chirildi: {rem}")
 
+@admin.message(Command("find"))
+async def cmd_find(message: Message):
+    # /find +998901234567 (phone) or /find 123456789 (Telegram ID)
+    arg = message.text.partition(" ")[2].strip()
+    phone = normalize_phone(arg, config.PHONE_COUNTRY_CODE) if arg.startswith("+") else None
+    if not phone and not arg.isdigit():
+        return await message.answer("Foydalanish: /find +998901234567 yoki /find 123456789")
+    rows = await archive.find(user_id=None if phone else int(arg), phone=phone)
+    if not rows:
+        return await message.answer("Hech narsa topilmadi.")
+    lines = [
+        f"№{app_id} {datetime.fromtimestamp(at):%d.%m.%Y} {job or '-'} — {name or '-'} ({uid}, {ph or '-'})"
+        for app_id, uid, ph, job, at, name in rows
+    ]
+    await message.answer("\n".join(lines))
+
+def export_fields() -> list:
+    # answer keys of all questionnaires, in question order: the spreadsheet columns
+    fields = ["Ish turi"]
+    for q in QUESTIONNAIRES.values():
+        fields += [s.key for s in q.steps if s.key not in fields]
+    return fields
+
+@admin.message(Command("export"))
+async def cmd_export(message: Message):
+    # /export [job] [from] [to] [csv] — dates as 01.01.2025, `to` inclusive; xlsx by default
+    job, dates, fmt = None, [], "xlsx"
+    for arg in message.text.split()[1:]:
+        if arg.lower() in ("csv", "xlsx"):
+            fmt = arg.lower()
+        elif validate_date(arg):
+            dates.append(datetime.strptime(arg, "%d.%m.%Y"))
+        else:
+            job = arg
+    start = int(dates[0].timestamp()) if dates else None
+    end = int(dates[1].timestamp()) + 86400 if len(dates) > 1 else None
+
+    path = Path(tempfile.gettempdir()) / f"anketalar_{message.from_user.id}_{int(time.time())}.{fmt}"
+    try:
+        count = await asyncio.to_thread(
+            export.export, str(path), fmt, archive.path, export_fields(), job, start, end,
+        )
+        if not count:
+            return await message.answer("Hech narsa topilmadi.")
+        if path.stat().st_size > 50 * 1024 ** 2:  # Bot API upload limit
+            return await message.answer("Fayl juda katta (50 MB dan ortiq). Sanalar oralig'ini qisqartiring.")
+        await message.answer_document(FSInputFile(path, filename=f"anketalar.{fmt}"), caption=f"{count} ta anketa")
+    finally:
+        path.unlink(missing_ok=True)
+
+@admin.message(Command("sessions"))
+async def cmd_sessions(message: Message):
+    if not isinstance(storage, CachedStorage):
+        return await message.answer("Bu FSM storage sessiyalarni hisoblamaydi.")
+    st = storage.session_stats()
+    await message.answer(
+        f"Faol anketalar: {st['live']}\nMuddati tugagan: {st['expired']}\nLimit tufayli o'chirilgan: {st['evicted']}"
+    )
+
+def fmt_seconds(sec) -> str:
+    if sec is None:
+        return "-"
+    if sec == float("inf"):
+        return ">2.5d"
+    if sec < 60:
+        return f"{sec:.0f}s"
+    return f"{sec / 60:.0f}m" if sec < 3600 else f"{sec / 3600:.1f}h"
+
+@admin.message(Command("stats"))
+async def cmd_stats(message: Message):
+    # /stats [job] — per-question funnel from the in-memory aggregates (no archive scan)
+    job = message.text.partition(" ")[2].strip() or ALL_JOBS
+    steps = []
+    for q in QUESTIONNAIRES.values():
+        steps += [s.key for s in q.steps if s.key not in steps]
+    # other workers' counters as of their last flush
+    peers = [read_data(shard_path(config.FUNNEL_PATH, i, SHARDS)) for i in range(SHARDS) if i != SHARD]
+    rows = funnel.report(steps, job, peers)
+    if not rows:
+        return await message.answer(f"Statistika yo'q. Ish turlari: {', '.join(funnel.jobs(peers)) or '-'}")
+    lines = [f"📊 Voronka: {'hammasi' if job == ALL_JOBS else job}", "savol: kirdi → javob (yo'qotish), median / p95"]
+    for i, (key, entered, answered, p50, p95) in enumerate(rows, 1):
+        lost = (entered - answered) / entered * 100 if entered else 0
+        lines.append(f"{i}. {key}: {entered} → {answered} (−{lost:.0f}%), {fmt_seconds(p50)} / {fmt_seconds(p95)}")
+    await message.answer("\n".join(lines))
+
+@admin.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    # /broadcast [job] as a reply to the message to send: copied to every past candidate
+    # (of that job) and to the other admins
+    src = message.reply_to_message
+    job = message.text.partition(" ")[2].strip() or None
+    jobs = config.JOB_TYPES
+    if src is None or (job and job not in jobs):
+        return await message.answer(
+            "Foydalanish: yuboriladigan xabarga javob (reply) qilib /broadcast yoki /broadcast <ish turi>\n"
+            f"Ish turlari: {', '.join(jobs)}"
+        )
+    b = await broadcaster.start(message.from_user.id, src.chat.id, src.message_id, job)
+    if b is None:
+        return await message.answer("Boshqa xabar yuborilmoqda. To'xtatish: /broadcast_stop")
+
+@admin.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: Message):
+    bid = await broadcaster.cancel()
+    await message.answer(f"⛔ №{bid} to'xtatildi." if bid else "Hozir hech narsa yuborilmayapti.")
+
+@dp.startup()
+async def resume_broadcasts():
+    # the worker that serves the admin's chat continues the job
+    await broadcaster.resume(lambda admin_id: shard_of(admin_id, SHARDS) == SHARD)
+
+# ---- Candidate router ----
+@candidate.message(Command(*ADMIN_COMMANDS))
+async def cmd_admin_only(message: Message):
+    await message.answer("⛔ Bu buyruq faqat adminlar uchun.")
+
 # ---- START handler: send start_video (file_id or local file) + buttons ----
-@dp.message(CommandStart())
+@candidate.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     caption = "Assalomu alaykum! 👋 Ish turini tanlang va qisqa anketani to‘ldiring."
-    start_vid = MEDIA.get("start_video") or ""
-
-    sent = False
-    if start_vid:
-        # if saved as file_id (short strange string) -> send directly
-        if not file_exists(start_vid):
-            try:
-                await message.answer_video(start_vid, caption=caption)
-                sent = True
-            except Exception:
-                sent = False
-        else:
-            try:
-                with open(start_vid, "rb") as f:
-                    await message.answer_video(video=f, caption=caption)
-                    sent = True
-            except Exception:
-                sent = False
-    if not sent:
+    if not await send_media_prompt(message, "start_video", "video", caption):
         await message.answer(caption)
 
     kb_msg = await message.answer("👇 Ish turini tanlang:", reply_markup=job_types_kb())
     await state.set_state(FormState.waiting_job)
-    await state.update_data(menu_msg_id=kb_msg.message_id, answers={})
+    # new form: drop answers of a previous (unfinished) run
+    await state.set_data({"menu_msg_id": kb_msg.message_id})
 
 # ---- Callback: job selection (no state kw arg — check inside) ----
-@dp.callback_query(F.data.startswith("job|"))
+@candidate.callback_query(F.data.startswith("job|"))
 async def cb_job_choice(callback: CallbackQuery, state: FSMContext):
     # check that user is in waiting_job
     if await state.get_state() != FormState.waiting_job.state:
@@ -289,10 +792,7 @@ async def cb_job_choice(callback: CallbackQuery, state: FSMContext):
         return
 
     job = callback.data.split("|", 1)[1]
-    data = await state.get_data()
-    answers = data.get("answers", {})
-    answers["Ish turi"] = job
-    await state.update_data(answers=answers)
+    await set_answer(state, "Ish turi", job)
 
     # remove only buttons message (keep video)
     try:
@@ -301,349 +801,107 @@ async def cb_job_choice(callback: CallbackQuery, state: FSMContext):
         pass
 
     await callback.answer("Tanlandi ✅")
-    await callback.message.answer(QUESTIONS[0])  # Q1
-    await state.set_state(FormState.q1)
-
-# ---- Q1..Q4 (text with phone contact and date validation) ----
-@dp.message(FormState.q1)
-async def q1_name(message: Message, state: FSMContext):
-    answers = (await state.get_data()).get("answers", {})
-    answers["Ism-familya"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-    await message.answer(QUESTIONS[1], reply_markup=contact_kb())
-    await state.set_state(FormState.q2)
-
-@dp.message(FormState.q2)
-async def q2_phone(message: Message, state: FSMContext):
-    phone = None
-    if message.contact and message.contact.phone_number:
-        phone = message.contact.phone_number
-    elif message.text:
-        t = message.text.strip()
-        if validate_phone(t):
-            phone = t
-        else:
-            return await message.answer("📞 Telefon raqamini to‘g‘ri formatda yozing. Misol: +998909998877", reply_markup=contact_kb())
-
-    answers = (await state.get_data()).get("answers", {})
-    answers["Telefon"] = phone
-    await state.update_data(answers=answers)
-    await message.answer(QUESTIONS[2], reply_markup=ReplyKeyboardRemove())
-    await state.set_state(FormState.q3)
-
-@dp.message(FormState.q3)
-async def q3_address(message: Message, state: FSMContext):
-    answers = (await state.get_data()).get("answers", {})
-    answers["Manzil (propiska)"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-    await message.answer(QUESTIONS[3])
-    await state.set_state(FormState.q4)
-
-@dp.message(FormState.q4)
-async def q4_dob(message: Message, state: FSMContext):
-    txt = (message.text or "").strip()
-    if not validate_date(txt):
-        return await message.answer("Tug'ilgan kuningizni 01.01.2000 formatda yozing.")
-    answers = (await state.get_data()).get("answers", {})
-    answers["Tug'ilgan sana"] = txt
-    await state.update_data(answers=answers)
-    await message.answer(QUESTIONS[4], reply_markup=education_kb())
-    await state.set_state(FormState.q5)
-
-# ---- Q5: education (btn or text) ----
-@dp.callback_query(F.data.startswith("edu|"))
-async def cb_q5(callback: CallbackQuery, state: FSMContext):
-    if await state.get_state() != FormState.q5.state:
-        await callback.answer("⚠️ Hozir bu tugmani bosish mumkin emas.", show_alert=True)
-        return
-    edu = callback.data.split("|", 1)[1]
-    answers = (await state.get_data()).get("answers", {})
-    answers["Ma'lumoti"] = edu
-    await state.update_data(answers=answers)
-    await callback.answer("Tanlandi ✅")
-    await callback.message.answer(QUESTIONS[5], reply_markup=ReplyKeyboardRemove())
-    await state.set_state(FormState.q6)
-
-@dp.message(FormState.q5)
-async def q5_text(message: Message, state: FSMContext):
-    answers = (await state.get_data()).get("answers", {})
-    answers["Ma'lumoti"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-    await message.answer(QUESTIONS[5], reply_markup=ReplyKeyboardRemove())
-    await state.set_state(FormState.q6)
-
-# ---- Q6 experience -> Q7 marital ----
-@dp.message(FormState.q6)
-async def q6_experience(message: Message, state: FSMContext):
-    answers = (await state.get_data()).get("answers", {})
-    answers["Ish tajribasi"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-    await message.answer(QUESTIONS[6], reply_markup=marital_kb())
-    await state.set_state(FormState.q7)
-
-# ---- Q7: marital -> then bot sends your voice (q9_voice_prompt) and sets state q9 (strict voice expected) ----
-@dp.callback_query(F.data.startswith("marital|"))
-async def cb_q7(callback: CallbackQuery, state: FSMContext):
-    if await state.get_state() != FormState.q7.state:
-        await callback.answer("⚠️ Hozir bu tugmani bosish mumkin emas.", show_alert=True)
-        return
-    marital = callback.data.split("|", 1)[1]
-    answers = (await state.get_data()).get("answers", {})
-    answers["Oilaviy holat"] = marital
-    await state.update_data(answers=answers)
-    await callback.answer("Tanlandi ✅")
-
-    # send your prepared voice prompt (q9_voice_prompt)
-    vfile = MEDIA.get("q9_voice_prompt", "")
-    sent = False
-    if vfile:
-        if not file_exists(vfile):
-            try:
-                await callback.message.answer_voice(vfile, caption=QUESTIONS[8])
-                sent = True
-            except Exception:
-                sent = False
-        else:
-            try:
-                with open(vfile, "rb") as f:
-                    await callback.message.answer_voice(voice=f, caption=QUESTIONS[8])
-                    sent = True
-            except Exception:
-                sent = False
-    if not sent:
-        await callback.message.answer(QUESTIONS[8])
-
-    await state.set_state(FormState.q9)
+    await ask_step(callback.message, state, questionnaire_for(job), 0)
 
-@dp.message(FormState.q7)
-async def q7_text(message: Message, state: FSMContext):
-    answers = (await state.get_data()).get("answers", {})
-    answers["Oilaviy holat"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-
-    vfile = MEDIA.get("q9_voice_prompt", "")
-    sent = False
-    if vfile:
-        if not file_exists(vfile):
-            try:
-                await message.answer_voice(vfile, caption=QUESTIONS[8])
-                sent = True
-            except Exception:
-                sent = False
-        else:
-            try:
-                with open(vfile, "rb") as f:
-                    await message.answer_voice(voice=f, caption=QUESTIONS[8])
-                    sent = True
-            except Exception:
-                sent = False
-    if not sent:
-        await message.answer(QUESTIONS[8])
-
-    await state.set_state(FormState.q9)
-
-# ---- Q9: strictly voice from user ----
-@dp.message(FormState.q9)
-async def q9_voice(message: Message, state: FSMContext):
-    if not message.voice:
-        return await message.answer("📢 Iltimos, ovozli xabar yuboring (voice).")
-    answers = (await state.get_data()).get("answers", {})
-    answers["Voice file_id"] = message.voice.file_id
-    await state.update_data(answers=answers)
-
-    # ask rus level (10/22)
-    await message.answer(QUESTIONS[9], reply_markup=rus_level_kb())
-    await state.set_state(FormState.q10)
-
-# ---- Q10: rus level -> then bot sends your prepared video prompt for Q11 ----
-@dp.callback_query(F.data.startswith("rus|"))
-async def cb_q10(callback: CallbackQuery, state: FSMContext):
-    if await state.get_state() != FormState.q10.state:
+# ---- Questionnaire: one handler for messages, one for buttons ----
+@candidate.callback_query(F.data.startswith("ans|"), InForm())
+async def cb_answer(callback: CallbackQuery, state: FSMContext, form: Questionnaire, step_idx: int, step: Step):
+    choice = parse_choice(callback.data)
+    if choice is None or choice[0] != step_idx or step.kind != CHOICE or choice[1] >= len(step.options):
         await callback.answer("⚠️ Hozir bu tugmani bosish mumkin emas.", show_alert=True)
         return
-    val = callback.data.split("|", 1)[1]
-    answers = (await state.get_data()).get("answers", {})
-    answers["Rus tili"] = val
-    await state.update_data(answers=answers)
+    await set_answer(state, step.key, step.options[choice[1]])
+    await step_answered(state, step)
     await callback.answer("Tanlandi ✅")
-
-    # send prepared video prompt (q11_video_prompt)
-    vfile = MEDIA.get("q11_video_prompt", "")
-    sent = False
-    if vfile:
-        if not file_exists(vfile):
-            try:
-                await callback.message.answer_video(vfile, caption=QUESTIONS[10])
-                sent = True
-            except Exception:
-                sent = False
-        else:
-            try:
-                with open(vfile, "rb") as f:
-                    await callback.message.answer_video(video=f, caption=QUESTIONS[10])
-                    sent = True
-            except Exception:
-                sent = False
-    if not sent:
-        await callback.message.answer(QUESTIONS[10])
-
-    await state.set_state(FormState.q11)
-
-@dp.message(FormState.q10)
-async def q10_text(message: Message, state: FSMContext):
-    answers = (await state.get_data()).get("answers", {})
-    answers["Rus tili"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-
-    vfile = MEDIA.get("q11_video_prompt", "")
-    sent = False
-    if vfile:
-        if not file_exists(vfile):
-            try:
-                await message.answer_video(vfile, caption=QUESTIONS[10])
-                sent = True
-            except Exception:
-                sent = False
-        else:
-            try:
-                with open(vfile, "rb") as f:
-                    await message.answer_video(video=f, caption=QUESTIONS[10])
-                    sent = True
-            except Exception:
-                sent = False
-    if not sent:
-        await message.answer(QUESTIONS[10])
-
-    await state.set_state(FormState.q11)
-
-# ---- Q11: strictly video from user ----
-@dp.message(FormState.q11)
-async def q11_video(message: Message, state: FSMContext):
-    if not (message.video or message.video_note):
-        return await message.answer("🎥 Iltimos, qisqa video yuboring (kamera orqali).")
-    answers = (await state.get_data()).get("answers", {})
-    vf = message.video.file_id if message.video else message.video_note.file_id
-    answers["Video file_id"] = vf
-    await state.update_data(answers=answers)
-
-    await message.answer(QUESTIONS[11], reply_markup=yesno_kb())
-    await state.set_state(FormState.q12)
-
-# ---- Q12: consent (ha/yo'q) ----
-@dp.callback_query(F.data.startswith("consent|"))
-async def cb_q12(callback: CallbackQuery, state: FSMContext):
-    if await state.get_state() != FormState.q12.state:
-        # allow anyway if user wasn't in exact state
-        pass
-    val = callback.data.split("|", 1)[1]
-    answers = (await state.get_data()).get("answers", {})
-    answers["Rozilik (surishtirish)"] = val
-    await state.update_data(answers=answers)
-    await callback.answer("Qabul qilindi ✅")
-    await callback.message.answer(QUESTIONS[12], reply_markup=ReplyKeyboardRemove())
-    await state.set_state(FormState.q13)
-
-# ---- Q13..Q22: text answers ----
-async def save_text_and_next(message: Message, state: FSMContext, key: str, next_state: State | None, next_question_index: int | None):
-    answers = (await state.get_data()).get("answers", {})
-    answers[key] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-    if next_state:
-        # ask next question
-        if next_question_index is not None:
-            await message.answer(QUESTIONS[next_question_index])
-        await state.set_state(next_state)
-    else:
-        await finish_and_send(message, state)
-
-@dp.message(FormState.q13)
-async def q13(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Tavsiya beruvchi", FormState.q14, 13)
-
-@dp.message(FormState.q14)
-async def q14(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Bizda qancha muddat ishlamoqchi", FormState.q15, 14)
-
-@dp.message(FormState.q15)
-async def q15(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Ishdan keyin qolish rozilik", FormState.q16, 15)
-
-@dp.message(FormState.q16)
-async def q16(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Sog'liq holati", FormState.q17, 16)
-
-@dp.message(FormState.q17)
-async def q17(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Nega kech kelishadi", FormState.q18, 17)
-
-@dp.message(FormState.q18)
-async def q18(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Nega o'g'rilik qilishadi", FormState.q19, 18)
-
-@dp.message(FormState.q19)
-async def q19(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Ish sifati sababi", FormState.q20, 19)
-
-@dp.message(FormState.q20)
-async def q20(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Oldingi maosh", FormState.q21, 20)
-
-@dp.message(FormState.q21)
-async def q21(message: Message, state: FSMContext):
-    await save_text_and_next(message, state, "Istalgan maosh", FormState.q22, 21)
-
-@dp.message(FormState.q22)
-async def q22(message: Message, state: FSMContext):
-    # final answer for 22
-    answers = (await state.get_data()).get("answers", {})
-    answers["Kurslar"] = (message.text or "").strip()
-    await state.update_data(answers=answers)
-    await finish_and_send(message, state)
+    await next_step(callback.message, state, form, step_idx, callback.from_user)
+
+@candidate.callback_query(F.data.startswith("ans|"))
+async def cb_answer_stale(callback: CallbackQuery):
+    await callback.answer("⚠️ Hozir bu tugmani bosish mumkin emas.", show_alert=True)
+
+@candidate.callback_query(F.data == "resume", InForm())
+async def cb_resume(callback: CallbackQuery, state: FSMContext, form: Questionnaire, step_idx: int, step: Step):
+    await callback.answer()
+    await ask_step(callback.message, state, form, step_idx)
+
+@candidate.callback_query(F.data == "resume")
+async def cb_resume_expired(callback: CallbackQuery):
+    await callback.answer("⌛ Anketa muddati tugagan. Qaytadan boshlash uchun /start bosing.", show_alert=True)
+
+@candidate.message(InForm())
+async def form_answer(message: Message, state: FSMContext, form: Questionnaire, step_idx: int, step: Step):
+    value = extract_answer(step, message)
+    if value is None:
+        markup = choice_kb(step_idx, step) if step.kind == CHOICE else (step.keyboard() if step.keyboard else None)
+        return await message.answer(step.error or step.prompt, reply_markup=markup)
+    await set_answer(state, step.key, value)
+    if media_archiver and step.kind in (VOICE, VIDEO):
+        media_archiver.submit(message.voice or message.video or message.video_note, step.kind, message.from_user.id)
+    await step_answered(state, step)
+    await next_step(message, state, form, step_idx, message.from_user)
 
 # ---- Final: build report and send to admins ----
-async def finish_and_send(message: Message, state: FSMContext):
-    data = await state.get_data()
-    answers = data.get("answers", {})
-    user = message.from_user
-
+def make_report(user: types.User, answers: dict, app_id, previous) -> Report:
     lines = [
-        "📝 *Yangi anketa*",
+        f"📝 *Yangi anketa* №{app_id}" if app_id else "📝 *Yangi anketa*",
         f"👤 Nomzod: {user.full_name} (@{user.username or '-'})",
         f"🆔 ID: `{user.id}`",
         f"💼 Ish turi: {answers.get('Ish turi','-')}",
-        ""
     ]
-    for k, v in answers.items():
+    if previous:
+        last = datetime.fromtimestamp(previous.last_at).strftime("%d.%m.%Y")
+        lines.append(f"⚠️ *Takroriy nomzod:* avval {previous.count} marta topshirgan (oxirgi: {last}, {previous.last_job or '-'})")
+    lines.append("")
+    # question order: the storage may return the answer fields in any order (Redis HGETALL)
+    order = ["Ish turi"] + [s.key for s in questionnaire_for(answers.get("Ish turi", "")).steps]
+    for k in [k for k in order if k in answers] + sorted(k for k in answers if k not in order):
         if k in ("Voice file_id", "Video file_id"):
             continue
-        lines.append(f"*{k}:* {v}")
-    text = "\n".join(lines)
+        lines.append(f"*{k}:* {answers[k]}")
+    return Report(text="\n".join(lines), voice=answers.get("Voice file_id"), video=answers.get("Video file_id"))
+
+async def finish_and_send(message: Message, state: FSMContext, user: types.User):
+    answers = await get_answers(state)  # the only full read of the record
+    admins = list(getattr(config, "ADMINS", []))
+
+    # archive first: the admin report says whether this person applied before. The
+    # application and its report are keyed on the update: replayed after a crash (state
+    # not cleared yet), it archives and reports nothing a second time
+    phone = normalize_phone(str(answers.get("Telefon", "")), config.PHONE_COUNTRY_CODE)
+    app_id, previous, replayed = None, None, False
+    try:
+        added = await archive.add(
+            user.id, phone, answers.get("Ish turi", ""), user.full_name, user.username or "", answers,
+            update_id=current_update_id(), admins=admins,
+            report=lambda app_id, previous: asdict(make_report(user, answers, app_id, previous)),
+        )
+        if added is None:
+            replayed = True
+            logger.info("Application of %s was archived before the restart, not reported again", user.id)
+        else:
+            app_id, previous = added
+    except Exception:
+        logger.exception("Can't archive application of %s", user.id)  # reported anyway, not in the outbox
 
-    for admin_id in getattr(config, "ADMINS", []):
-        try:
-            await bot.send_message(admin_id, text, parse_mode="Markdown")
-            # resend voice/video if exist
-            if "Voice file_id" in answers:
-                try:
-                    await bot.send_voice(admin_id, answers["Voice file_id"], caption="📢 Nomzod ovozli javobi (9/22)")
-                except Exception:
-                    logger.exception("cant send voice")
-            if "Video file_id" in answers:
-                try:
-                    await bot.send_video(admin_id, answers["Video file_id"], caption="🎥 Nomzod video javobi (11/22)")
-                except Exception:
-                    logger.exception("cant send video")
-        except Exception:
-            logger.exception("Failed to send to admin %s", admin_id)
+    # admins are notified by a background job: the candidate gets the confirmation right away
+    if not replayed:
+        notifier.submit(admins, make_report(user, answers, app_id, previous), report_id=app_id)
 
     await message.answer("✅ Ma'lumotlaringiz qabul qilindi. Tez orada xabarini beramiz!", reply_markup=ReplyKeyboardRemove())
     await state.clear()
 
-# ---- Start polling ----
+# ---- Start: polling or webhook (config.BOT_MODE / env BOT_MODE) ----
 async def main():
-    logger.info("Bot started")
-    # skip_updates=True чтобы бот не обрабатывал старые апдейты при перезапуске
-    await dp.start_polling(bot, skip_updates=True)
+    logger.info("Bot started (%s mode)", config.BOT_MODE)
+    if config.BOT_MODE == "webhook":
+        import webhook
+        await webhook.run_webhook(dp, bot, ledger)
+        return
+    # delete_webhook снимает webhook, если бот до этого работал в webhook-режиме.
+    # BACKLOG_MODE=skip: старые апдейты выбрасываются; иначе ledger разбирает их в темпе BACKLOG_RATE
+    await bot.delete_webhook(drop_pending_updates=config.BACKLOG_MODE == "skip")
+    # handle_as_tasks=False: the scheduler creates the tasks (and applies backpressure)
+    await dp.start_polling(bot, handle_as_tasks=False)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,188 @@
+# broadcast.py
+# /broadcast: one admin message copied to everyone who ever applied, plus the other admins.
+#
+# The audience and the progress live in the archive (recipients / broadcasts tables), so
+# a job started before a restart or crash picks up where it stopped: every chat is marked
+# right after its send and skipped afterwards. Sends go out with background priority, so
+# the outbound scheduler serves questionnaire replies first and the broadcast takes only
+# what is left of the per-bot rate. A 403 marks the chat blocked for future broadcasts.
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from archive import Archive
+from metrics import detach
+from outbound import PRIORITY_ADMIN, PRIORITY_BACKGROUND, TokenBucket, priority
+
+logger = logging.getLogger(__name__)
+
+
+def progress_text(b: Dict[str, Any]) -> str:
+    done = b["sent"] + b["blocked"] + b["failed"]
+    head = {"running": "📣 Xabar yuborilmoqda", "done": "✅ Xabar yuborildi", "cancelled": "⛔ Yuborish to'xtatildi"}
+    return (
+        f"{head.get(b['state'], b['state'])} (№{b['id']}, {b['job'] or 'hammasi'})\n"
+        f"{done}/{b['total']}: yetkazildi {b['sent']}, bloklagan {b['blocked']}, xato {b['failed']}"
+    )
+
+
+class Broadcaster:
+    def __init__(self, bot: Bot, archive: Archive, admins: Callable[[], list], rate: float = 0,
+                 concurrency: int = 8, report_every: float = 10.0, page: int = 200):
+        self.bot = bot
+        self.archive = archive
+        self.admins = admins          # current admin ids (they change at runtime)
+        self.rate = rate              # own cap below the outbound limit; 0 = only the outbound limit
+        self.concurrency = concurrency
+        self.report_every = report_every
+        self.page = page
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+
+    async def start(self, admin_id: int, from_chat: int, message_id: int, job: Optional[str] = None):
+        # -> the broadcast row, or None while another broadcast is running
+        b = await self.archive.start_broadcast(admin_id, from_chat, message_id, job)
+        if b is not None:
+            self._spawn(b)
+        return b
+
+    async def resume(self, owns: Callable[[int], bool] = lambda admin_id: True):
+        # startup: continue running jobs (with shards, in the worker that serves their admin)
+        for b in await self.archive.running_broadcasts():
+            if owns(b["admin_id"]) and b["id"] not in self._tasks:
+                logger.info("Resuming broadcast %s: %s/%s done", b["id"], b["sent"] + b["blocked"] + b["failed"], b["total"])
+                self._spawn(b)
+
+    async def cancel(self, broadcast_id: Optional[int] = None) -> Optional[int]:
+        # -> id of the stopped broadcast; it may run in another worker, so the row decides
+        running = await self.archive.running_broadcasts()
+        if broadcast_id is not None:
+            running = [b for b in running if b["id"] == broadcast_id]
+        if not running:
+            return None
+        b = running[0]
+        self._cancelled.add(b["id"])
+        await self.archive.update_broadcast(b["id"], state="cancelled")
+        return b["id"]
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": len(self._tasks)}
+
+    def _spawn(self, b: Dict[str, Any]):
+        task = asyncio.create_task(self._run(b))
+        self._tasks[b["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(b["id"], None))
+
+    async def _still_running(self, bid: int) -> bool:
+        if bid in self._cancelled:
+            return False
+        b = await self.archive.get_broadcast(bid)
+        return b is not None and b["state"] == "running"
+
+    async def _run(self, b: Dict[str, Any]):
+        detach()
+        bid = b["id"]
+        try:
+            await self._report(b)
+            if not b["admins_done"]:
+                # admins are not in the registry; a crash here can only repeat these few
+                for admin_id in self.admins():
+                    if admin_id != b["admin_id"]:
+                        await self._send(b, admin_id)
+                await self.archive.update_broadcast(bid, admins_done=1)
+            await self._fan_out(b)
+            if await self._still_running(bid):
+                await self.archive.update_broadcast(bid, state="done")
+        except asyncio.CancelledError:
+            raise  # shutdown: the row stays "running" and the next start resumes it
+        except Exception:
+            logger.exception("Broadcast %s failed, it resumes on the next start", bid)
+            return
+        finally:
+            self._cancelled.discard(bid)
+        b = await self.archive.get_broadcast(bid)
+        await self._report(b)
+        logger.info("Broadcast %s %s: %s", bid, b["state"], {k: b[k] for k in ("total", "sent", "blocked", "failed")})
+
+    async def _fan_out(self, b: Dict[str, Any]):
+        bid = b["id"]
+        bucket = TokenBucket(self.rate, 1) if self.rate else None
+        sem = asyncio.Semaphore(self.concurrency)
+        inflight: Set[asyncio.Task] = set()
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + self.report_every
+        after = 0
+        try:
+            while True:
+                chats = await self.archive.broadcast_page(bid, b["job"], after, self.page)
+                if not chats or not await self._still_running(bid):
+                    break
+                for chat_id in chats:
+                    if bid in self._cancelled:
+                        break
+                    await sem.acquire()
+                    if bucket:
+                        await bucket.acquire()
+                    task = asyncio.create_task(self._deliver(b, chat_id))
+                    inflight.add(task)
+                    task.add_done_callback(inflight.discard)
+                    task.add_done_callback(lambda _: sem.release())
+                    if loop.time() >= next_report:
+                        next_report = loop.time() + self.report_every
+                        await self._report(await self.archive.get_broadcast(bid))
+                after = chats[-1]
+            if inflight:
+                await asyncio.gather(*inflight)
+        finally:
+            # shutdown: stop the sends in flight too; the unmarked ones go out again on resume
+            for task in inflight:
+                task.cancel()
+
+    async def _deliver(self, b: Dict[str, Any], chat_id: int):
+        outcome = await self._send(b, chat_id)
+        try:
+            await self.archive.broadcast_done(b["id"], chat_id, outcome)
+        except Exception:
+            logger.exception("Can't record broadcast %s to %s", b["id"], chat_id)
+
+    async def _send(self, b: Dict[str, Any], chat_id: int) -> str:
+        try:
+            with priority(PRIORITY_BACKGROUND):
+                await self.bot.copy_message(chat_id, b["from_chat"], b["message_id"])
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"  # blocked the bot / deactivated
+        except TelegramBadRequest as e:
+            if "chat not found" in e.message.lower():
+                return "blocked"
+            logger.warning("Broadcast %s to %s: %s", b["id"], chat_id, e.message)
+            return "failed"
+        except Exception as e:
+            logger.warning("Broadcast %s to %s: %r", b["id"], chat_id, e)
+            return "failed"
+
+    async def _report(self, b: Dict[str, Any]):
+        # one status message per job, edited in place
+        text = progress_text(b)
+        try:
+            with priority(PRIORITY_ADMIN):
+                if b["status_msg_id"]:
+                    await self.bot.edit_message_text(text, chat_id=b["admin_id"], message_id=b["status_msg_id"])
+                    return
+                msg = await self.bot.send_message(b["admin_id"], text)
+            b["status_msg_id"] = msg.message_id
+            await self.archive.update_broadcast(b["id"], status_msg_id=msg.message_id)
+        except TelegramBadRequest as e:
+            if "not modified" not in e.message:
+                logger.warning("Broadcast %s progress: %s", b["id"], e.message)
+        except Exception:
+            logger.exception("Broadcast %s progress report failed", b["id"])
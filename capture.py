@@ -0,0 +1,200 @@
+# capture.py
+# Traffic capture: every incoming update as one JSON line, in rotating gzip files.
+#
+#   {"t": 1760000000.123, "update": {...Bot API update...}}
+#
+# UpdateCapture is the first of our outer update middlewares, so updates dropped later by
+# the anti-flood or the queue are recorded too (the capture is what Telegram sent). Lines
+# are buffered and written by a thread every `flush_every` seconds; each write appends
+# one gzip member, so a file cut by a crash still reads up to the last flush. A file is
+# rotated after max_bytes of (uncompressed) JSON; only the newest `keep` files are kept.
+#
+# With anonymize on, names / usernames are replaced by stable pseudonyms and phone
+# numbers (contacts and typed text) get fake digits of the same length: replays still
+# pass the phone validation and one user stays one user. Numeric ids are kept.
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import re
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+PATTERN = "updates-*.jsonl.gz"
+NAME_FIELDS = {"first_name", "last_name", "username"}
+_PHONE_RE = re.compile(r"\+?\d[\d\s\-()]{7,}\d")
+KEEP_DIGITS = 5  # country + operator code stay real: "99890..."
+
+
+class Anonymizer:
+    def __init__(self, salt: str = ""):
+        self.salt = salt
+
+    def _hash(self, value: str) -> str:
+        return hashlib.blake2b((self.salt + value).encode(), digest_size=8).hexdigest()
+
+    def name(self, value: str) -> str:
+        return "u" + self._hash(value)[:8]
+
+    def phone(self, value: str) -> str:
+        digits = re.sub(r"\D", "", value)
+        fake = str(int(self._hash(digits), 16)).rjust(len(digits), "0")
+        out = digits[:KEEP_DIGITS] + fake[:max(len(digits) - KEEP_DIGITS, 0)]
+        return ("+" if value.lstrip().startswith("+") else "") + out
+
+    def scrub(self, obj: Any) -> Any:
+        if isinstance(obj, dict):
+            out = {}
+            for k, v in obj.items():
+                if k in NAME_FIELDS and isinstance(v, str):
+                    out[k] = self.name(v)
+                elif k == "phone_number" and isinstance(v, str):
+                    out[k] = self.phone(v)
+                elif k in ("text", "caption") and isinstance(v, str):
+                    out[k] = _PHONE_RE.sub(lambda m: self.phone(m.group()), v)
+                else:
+                    out[k] = self.scrub(v)
+            return out
+        if isinstance(obj, list):
+            return [self.scrub(v) for v in obj]
+        return obj
+
+
+class UpdateCapture(BaseMiddleware):
+    def __init__(
+        self,
+        directory,
+        max_bytes: int = 64 * 1024 ** 2,
+        keep: int = 20,
+        anonymize: bool = True,
+        salt: str = "",
+        flush_every: float = 1.0,
+    ):
+        self.dir = Path(directory)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.anonymizer = Anonymizer(salt) if anonymize else None
+        self.flush_every = flush_every
+        self._buf: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self._file: Optional[Path] = None
+        self._file_bytes = 0
+        self.captured = 0
+        self.written = 0
+        self.errors = 0
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def install(self, dp: Dispatcher):
+        # before the anti-flood and the scheduler if they are installed later
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+        dp.shutdown.register(self.close)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            self.record(event)
+        return await handler(event, data)
+
+    def record(self, update: Update):
+        raw = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+        if self.anonymizer:
+            raw = self.anonymizer.scrub(raw)
+        self._buf.append(json.dumps({"t": round(time.time(), 3), "update": raw}, ensure_ascii=False))
+        self.captured += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            await asyncio.sleep(self.flush_every)
+        finally:
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._buf:
+            return
+        lines, self._buf = self._buf, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.written += len(lines)
+        except Exception:
+            self.errors += 1
+            logger.exception("Capture write failed, %d updates lost", len(lines))
+
+    def _write(self, lines: List[str]):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        if self._file is None or self._file_bytes >= self.max_bytes:
+            self._rotate()
+        with gzip.open(self._file, "ab", compresslevel=6) as f:
+            f.write(data)
+        self._file_bytes += len(data)
+
+    def _rotate(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        n = 0
+        while True:
+            path = self.dir / f"updates-{stamp}-{n}.jsonl.gz"
+            if not path.exists():
+                break
+            n += 1
+        self._file, self._file_bytes = path, 0
+        if self.keep:  # 0 = keep everything
+            old = capture_files([self.dir])
+            for stale in old[:max(len(old) - (self.keep - 1), 0)]:
+                stale.unlink(missing_ok=True)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"captured": self.captured, "written": self.written, "errors": self.errors}
+
+
+# ---- reading captures back ----
+def capture_files(paths: Iterable) -> List[Path]:
+    # files and directories -> capture files, oldest first (names sort by time)
+    files: List[Path] = []
+    for p in map(Path, paths):
+        files += sorted(p.glob(PATTERN)) if p.is_dir() else [p]
+    return files
+
+
+def iter_capture(paths: Iterable) -> Iterator[Tuple[float, dict]]:
+    # (receive time, raw update) in capture order; a truncated tail (crash) ends the file
+    seen: Set[int] = set()
+    for path in capture_files(paths):
+        opener = gzip.open if path.suffix == ".gz" else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        logger.warning("Skipping a damaged line in %s", path)
+                        continue
+                    uid = rec["update"].get("update_id")
+                    if uid in seen:
+                        continue
+                    seen.add(uid)
+                    yield rec["t"], rec["update"]
+        except (EOFError, gzip.BadGzipFile):
+            logger.warning("%s is truncated, read up to the damage", path)
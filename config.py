@@ -3,6 +3,8 @@
 # Ты добавила токен/айди — проверь, что это твои данные.
 # Не давай токен посторонним!
 
+import os
+
 BOT_TOKEN = "8489619211:AAGgfyqNz_AE0DvfLTVZ_dv-3usaIspoUKI"
 ADMINS = [6106674802]  # твой Telegram ID — главный админ
 
@@ -19,3 +21,140 @@ MEDIA = {
     "q9_voice_prompt": "",
     "q11_video_prompt": ""
 }
+
+# ---- Режим получения апдейтов ----
+# BOT_MODE: "polling" (по умолчанию) или "webhook". Можно переопределить через env.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# webhook: локальный адрес aiohttp-сервера (за балансировщиком) и публичный URL,
+# который регистрируется через setWebhook. Если WEBHOOK_URL пустой — setWebhook не вызывается.
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # например https://bot.example.com
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")    # X-Telegram-Bot-Api-Secret-Token
+
+# адрес Bot API; пусто = api.telegram.org. Для бенчмарков указывает на локальный fake Telegram.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# ---- HTTP-соединения с Bot API: отдельный пул на каждый вид трафика ----
+# poll - getUpdates; api - короткие JSON-запросы (ответы, callback, правки); media - загрузка и скачивание файлов
+HTTP_POOLED = os.getenv("HTTP_POOLED", "1") == "1"                  # 0 = один пул aiohttp по умолчанию
+HTTP_API_CONNECTIONS = int(os.getenv("HTTP_API_CONNECTIONS", "100"))
+HTTP_MEDIA_CONNECTIONS = int(os.getenv("HTTP_MEDIA_CONNECTIONS", "4"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))           # сек. держать простаивающее соединение (aiohttp: 15)
+HTTP_API_TIMEOUT = float(os.getenv("HTTP_API_TIMEOUT", "15"))
+HTTP_MEDIA_TIMEOUT = float(os.getenv("HTTP_MEDIA_TIMEOUT", "120"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))                # кэш DNS, сек. (aiohttp: 10)
+# свои таймауты для отдельных методов (сек.); остальные - по пулу
+HTTP_METHOD_TIMEOUTS = {
+    "answerCallbackQuery": 5,   # после ~15 с Telegram уже не покажет ответ
+    "getFile": 10,
+    "getWebhookInfo": 10,
+}
+
+# ---- FSM storage (незаконченные анкеты переживают перезапуск) ----
+# FSM_STORAGE: "sqlite" (по умолчанию, WAL), "redis" или "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # записей в in-process кэше
+# брошенные анкеты: срок жизни без ответов, лимит активных (старые вытесняются), напоминание
+FSM_SESSION_TTL = float(os.getenv("FSM_SESSION_TTL", str(3 * 24 * 3600)))   # сек, 0 = без срока
+FSM_MAX_SESSIONS = int(os.getenv("FSM_MAX_SESSIONS", "50000"))              # 0 = без лимита
+FSM_REMIND_AFTER = float(os.getenv("FSM_REMIND_AFTER", str(24 * 3600)))     # сек, 0 = не напоминать
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", "60"))           # как часто проверять
+
+# анкета для каждого типа работы (имя из QUESTIONNAIRES в bot.py); не указан — "default"
+# например: JOB_QUESTIONNAIRES = {"Omborchi": "omborchi"}
+JOB_QUESTIONNAIRES = {}
+
+# ---- Обработка апдейтов: общий лимит, очередь, порядок внутри чата ----
+SCHED_MAX_CONCURRENT = int(os.getenv("SCHED_MAX_CONCURRENT", "64"))   # одновременно работающих хендлеров
+SCHED_MAX_QUEUE = int(os.getenv("SCHED_MAX_QUEUE", "1000"))           # апдейтов, ждущих своей очереди
+SCHED_OVERFLOW = os.getenv("SCHED_OVERFLOW", "backpressure")          # "backpressure" или "shed"
+
+# ---- Анти-флуд: лимит апдейтов от одного пользователя ----
+# тип -> (апдейтов в секунду, всплеск); лишние апдейты отбрасываются до хендлеров. Админы без лимита.
+THROTTLE_LIMITS = {
+    "command": (0.2, 3),    # /start и др.: 3 подряд, дальше одна в 5 сек
+    "callback": (2, 6),     # нажатия inline-кнопок
+    "media": (0.5, 4),      # voice / video / документы
+    "message": (1, 5),      # текстовые ответы
+}
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "100000"))   # размер таблицы бакетов (LRU)
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1") == "1"          # 0 = без анти-флуда (нагрузочные тесты)
+
+# ---- Исходящие запросы: лимиты Telegram ----
+OUT_GLOBAL_RATE = float(os.getenv("OUT_GLOBAL_RATE", "30"))   # сообщений/сек на бота
+OUT_GLOBAL_BURST = float(os.getenv("OUT_GLOBAL_BURST", "1"))
+OUT_CHAT_RATE = float(os.getenv("OUT_CHAT_RATE", "1"))        # сообщений/сек в один чат
+OUT_CHAT_BURST = float(os.getenv("OUT_CHAT_BURST", "3"))      # короткий всплеск в один чат
+OUT_MAX_RETRIES = int(os.getenv("OUT_MAX_RETRIES", "3"))      # повторов при 429 / сетевых ошибках
+
+# ---- Уведомления админам (фоновая задача) ----
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "5"))   # админов одновременно
+NOTIFY_RETRIES = int(os.getenv("NOTIFY_RETRIES", "3"))           # повторов для каждого админа
+
+# ---- Архив анкет (SQLite, поиск и проверка повторных кандидатов) ----
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "applications.sqlite3")
+PHONE_COUNTRY_CODE = os.getenv("PHONE_COUNTRY_CODE", "998")   # для номеров без кода страны
+
+# ---- Копии голосовых и видео-ответов кандидатов на диске (фоновая загрузка) ----
+# файлы: MEDIA_ARCHIVE_DIR/<user id>/voice-<id>.ogg, video-<id>.mp4
+MEDIA_ARCHIVE_DIR = os.getenv("MEDIA_ARCHIVE_DIR", "candidate_media")   # пусто = не сохранять
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))                    # загрузок одновременно
+MEDIA_QUEUE = int(os.getenv("MEDIA_QUEUE", "1000"))                     # очередь; при переполнении файл пропускается
+MEDIA_MAX_FILE_MB = float(os.getenv("MEDIA_MAX_FILE_MB", "20"))         # больше 20 МБ Bot API не отдаёт
+MEDIA_QUOTA_MB = float(os.getenv("MEDIA_QUOTA_MB", "10240"))            # всего на все копии; 0 = без лимита
+MEDIA_MIN_FREE_MB = float(os.getenv("MEDIA_MIN_FREE_MB", "1024"))       # не занимать диск меньше этого остатка
+MEDIA_DOWNLOAD_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT", "120"))
+
+# ---- Рассылка (/broadcast): всем, кто когда-либо отправил анкету ----
+# идёт с низшим приоритетом: ответы кандидатам всегда уходят первыми
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "0"))              # своя планка, сообщ./сек; 0 = общий лимит OUT_GLOBAL_RATE
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))  # отправок одновременно
+BROADCAST_REPORT_SEC = float(os.getenv("BROADCAST_REPORT_SEC", "10")) # как часто обновлять прогресс у админа
+
+# ---- Метрики (Prometheus /metrics на локальном порту) ----
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))        # 0 = выключено
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "1000"))  # апдейты дольше — в лог с разбивкой; 0 = выкл
+
+# ---- Логи: JSON-строки, запись в отдельном потоке (event loop не ждёт диска) ----
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                  # "json" или "text" (для консоли)
+LOG_FILE = os.getenv("LOG_FILE", "")                          # пусто = только stderr
+LOG_FILE_MB = float(os.getenv("LOG_FILE_MB", "50"))           # размер файла до ротации
+LOG_FILE_KEEP = int(os.getenv("LOG_FILE_KEEP", "5"))          # сколько старых файлов хранить
+LOG_QUEUE = int(os.getenv("LOG_QUEUE", "10000"))              # записей в очереди; при переполнении - выбрасываются
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))    # одинаковых ошибок за окно в лог; 0 = все
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "60"))  # окно, сек
+
+# ---- Воронка анкеты (/stats): агрегаты по шагам, сбрасываются на диск периодически ----
+FUNNEL_PATH = os.getenv("FUNNEL_PATH", "funnel.json")
+FUNNEL_FLUSH_SEC = float(os.getenv("FUNNEL_FLUSH_SEC", "30"))
+
+# ---- Запись трафика (для воспроизведения: python -m bench.replay_capture) ----
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "")                          # пусто = не записывать
+CAPTURE_MAX_MB = float(os.getenv("CAPTURE_MAX_MB", "64"))           # размер файла до ротации (без сжатия)
+CAPTURE_KEEP = int(os.getenv("CAPTURE_KEEP", "20"))                 # сколько файлов хранить; 0 = все
+CAPTURE_ANONYMIZE = os.getenv("CAPTURE_ANONYMIZE", "1") == "1"      # имена и телефоны -> псевдонимы
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")                        # соль для псевдонимов
+
+# ---- Перезапуск без потери апдейтов ----
+# апдейты, пришедшие пока бот был выключен (деплой, падение), обрабатываются, а не выбрасываются;
+# повторно доставленные апдейты отсеиваются по update_id
+UPDATE_LEDGER_PATH = os.getenv("UPDATE_LEDGER_PATH", "update_ledger.json")
+UPDATE_DEDUPE_WINDOW = int(os.getenv("UPDATE_DEDUPE_WINDOW", "10000"))   # последних update_id в памяти
+BACKLOG_MODE = os.getenv("BACKLOG_MODE", "drain")     # "drain" - обработать накопившиеся, "skip" - выбросить
+BACKLOG_RATE = float(os.getenv("BACKLOG_RATE", "20"))  # апдейтов/сек при разборе накопившихся; 0 = без лимита
+
+# ---- Несколько процессов (python -m shard): ingress + BOT_WORKERS воркеров ----
+# апдейты делятся между воркерами по chat id; FSM_STORAGE должен быть sqlite или redis (общий)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "2"))
+SHARD_SOCKET = os.getenv("SHARD_SOCKET", "bot-shard.sock")          # Unix-сокет ingress <-> воркеры
+SHARD_MAX_INFLIGHT = int(os.getenv("SHARD_MAX_INFLIGHT", "1000"))    # апдейтов у воркеров одновременно
+# задаются ingress'ом для каждого воркера; 0 / 1 = обычный одиночный процесс
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
@@ -0,0 +1,120 @@
+# export.py
+# Streaming CSV / XLSX export of archived applications (/export).
+#
+# Rows go from the archive cursor straight into the file, a chunk at a time, so memory
+# stays flat whatever the row count. XLSX is written by hand (zip + sheet XML with
+# inline strings): no extra dependency and no in-memory workbook.
+import csv
+import re
+import zipfile
+from datetime import datetime
+from typing import Iterable, List, Optional
+from xml.sax.saxutils import escape
+
+from archive import iter_applications
+
+META_COLUMNS = ["№", "Sana", "Telegram ID", "Username"]
+
+# characters XML 1.0 does not allow (Excel refuses the file otherwise)
+_XML_BAD = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Anketalar" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def rows(archive_path: str, fields: List[str], job: Optional[str] = None,
+         start: Optional[int] = None, end: Optional[int] = None) -> Iterable[list]:
+    # header first, then one list per application; answers are picked by field name
+    yield META_COLUMNS + fields
+    for app_id, created_at, user_id, username, _, answers in iter_applications(archive_path, job, start, end):
+        meta = [app_id, datetime.fromtimestamp(created_at).strftime("%d.%m.%Y %H:%M"), user_id, username or ""]
+        yield meta + [answers.get(f, "") for f in fields]
+
+
+def _csv_safe(value) -> str:
+    # a cell starting with = @ (or +/- not followed by a number) is a formula in Excel
+    s = str(value)
+    if s[:1] in ("=", "@") or (s[:1] in ("+", "-") and not re.sub(r"[\s\-()]", "", s[1:]).isdigit()):
+        return "'" + s
+    return s
+
+
+def write_csv(path: str, table: Iterable[list]) -> int:
+    count = -1  # header is not a row
+    # utf-8-sig: Excel opens Cyrillic / Uzbek text correctly
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        for row in table:
+            writer.writerow([_csv_safe(v) for v in row])
+            count += 1
+    return count
+
+
+def _cell(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_BAD.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(path: str, table: Iterable[list]) -> int:
+    count = -1
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, body in XLSX_STATIC.items():
+            zf.writestr(name, body)
+        with zf.open("xl/worksheets/sheet1.xml", "w") as raw:
+            buf = []
+            buf.append(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for row in table:
+                buf.append("<row>" + "".join(_cell(v) for v in row) + "</row>")
+                count += 1
+                if len(buf) >= 500:
+                    raw.write("".join(buf).encode("utf-8"))
+                    buf.clear()
+            buf.append("</sheetData></worksheet>")
+            raw.write("".join(buf).encode("utf-8"))
+    return count
+
+
+def export(path: str, fmt: str, archive_path: str, fields: List[str], job: Optional[str] = None,
+           start: Optional[int] = None, end: Optional[int] = None) -> int:
+    # blocking: run it in a thread. Returns the number of exported applications.
+    writer = write_xlsx if fmt == "xlsx" else write_csv
+    return writer(path, rows(archive_path, fields, job, start, end))
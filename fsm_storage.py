@@ -0,0 +1,548 @@
+# fsm_storage.py
+# Disk-backed FSM storages (SQLite WAL / Redis protocol) with an in-process read cache.
+#
+# Handlers usually do update_data() + set_state() for one update. Both writes only touch
+# the cache entry; CoalescingMiddleware collects the touched keys and writes each of
+# them once after the handler returns. Outside the middleware writes go straight through.
+# Data is stored per field, so update_data()/set_fields() write only the changed fields.
+#
+# Keys with a state (forms in progress) are also tracked as sessions, ordered by last
+# write: a session idle for `ttl` seconds is dropped by the sweeper, and past
+# `max_sessions` the least recently used one is dropped at once (its owner is told by
+# the sweeper's next round, not by the update that pushed it out).
+import asyncio
+import contextvars
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# key -> entry, collected while one update is processed
+_pending: contextvars.ContextVar[Optional[Dict[str, list]]] = contextvars.ContextVar("fsm_pending", default=None)
+
+
+def key_str(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def parse_key(k: str) -> StorageKey:
+    bot_id, chat_id, user_id, thread_id, destiny = k.split(":", 4)
+    return StorageKey(
+        bot_id=int(bot_id), chat_id=int(chat_id), user_id=int(user_id),
+        thread_id=int(thread_id) if thread_id else None, destiny=destiny,
+    )
+
+
+def state_str(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class CachedStorage(BaseStorage):
+    # entry = [state, data, dirty]; the same list object lives in the cache and in _pending.
+    # dirty: None - clean, FULL - data replaced, set - only these data fields changed
+    FULL = object()
+
+    def __init__(self, cache_size: int = 10000, ttl: Optional[float] = None, max_sessions: Optional[int] = None):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, list]" = OrderedDict()
+        self.reads = 0   # backend reads (cache misses)
+        self.writes = 0  # backend write batches
+        # sessions: key -> time of the last write, oldest first
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, float]" = OrderedDict()
+        self._reminded = set()
+        self._evicted: List[Tuple[str, Optional[str]]] = []  # (key, state) dropped by the cap, not told yet
+        self.on_evict: Optional[Callable[[StorageKey, str], Awaitable[Any]]] = None
+        self.expired = 0
+        self.evicted = 0
+        # multi-process (shard.py): keys of chats this process handles; the backend is shared
+        self.owns: Optional[Callable[[str], bool]] = None
+
+    # ---- backend ----
+    async def _load(self, k: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def _store(self, ops: List[Tuple[str, Optional[str], Dict[str, str], bool]]) -> None:
+        # ops: (key, state, {field: value_json}, replace); replace -> drop fields not listed,
+        # replace with no state and no fields -> delete the key completely
+        raise NotImplementedError
+
+    async def _list_sessions(self) -> List[Tuple[str, float]]:
+        # (key, last write time) of keys with a state, oldest first; used after a restart
+        return []
+
+    # ---- cache ----
+    async def _entry(self, k: str) -> list:
+        entry = self._cache.get(k)
+        if entry is not None:
+            self._cache.move_to_end(k)
+            return entry
+        self.reads += 1
+        state, data = await self._load(k)
+        entry = self._cache.get(k)  # could be filled while we were waiting
+        if entry is None:
+            entry = [state, data, None]
+            self._remember(k, entry)
+        return entry
+
+    def _remember(self, k: str, entry: list):
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            old_k, old = next(iter(self._cache.items()))
+            if old[2] is not None:  # not flushed yet - keep it
+                break
+            del self._cache[old_k]
+
+    def _mark(self, entry: list, fields=None):
+        if fields is None:
+            entry[2] = self.FULL
+        elif entry[2] is None:
+            entry[2] = set(fields)
+        elif entry[2] is not self.FULL:
+            entry[2].update(fields)
+
+    async def _touch(self, k: str, entry: list):
+        pending = _pending.get()
+        if pending is not None:
+            pending[k] = entry
+        else:
+            await self.flush({k: entry})
+
+    async def flush(self, entries: Dict[str, list]):
+        if not entries:
+            return
+        ops, taken = [], []
+        for k, entry in entries.items():
+            state, data, dirty = entry
+            entry[2] = None
+            taken.append((entry, dirty))
+            if dirty is self.FULL:
+                fields, replace = data, True
+            else:
+                fields, replace = {f: data[f] for f in (dirty or ()) if f in data}, False
+            ops.append((k, state, {f: json.dumps(v, ensure_ascii=False) for f, v in fields.items()}, replace))
+        self.writes += 1
+        try:
+            await self._store(ops)
+        except Exception:
+            # not written: the marks go back (merged with changes made meanwhile, FULL wins),
+            # so the next write of these keys carries them
+            for entry, dirty in taken:
+                if dirty is self.FULL:
+                    self._mark(entry)
+                elif dirty is not None:
+                    self._mark(entry, dirty)
+            raise
+
+    # ---- sessions: TTL, LRU cap, reminders ----
+    async def _track(self, k: str, entry: list):
+        if entry[0] is None:
+            self._sessions.pop(k, None)
+            self._reminded.discard(k)
+            return
+        self._sessions[k] = time.time()
+        self._sessions.move_to_end(k)
+        self._reminded.discard(k)
+        if self.max_sessions and len(self._sessions) > self.max_sessions:
+            over = len(self._sessions) - self.max_sessions
+            victims = [old_k for old_k, _ in zip(self._sessions, range(over))]
+            if self.on_evict is not None:
+                # their states, for the notice; a victim written to while we read is kept
+                for old_k in victims:
+                    self._sessions.pop(old_k)
+                states = {}
+                for old_k in victims:
+                    cached = self._cache.get(old_k)
+                    states[old_k] = cached[0] if cached is not None else (await self._load(old_k))[0]
+                victims = [old_k for old_k in victims if old_k not in self._sessions]
+                self._evicted += [(old_k, states[old_k]) for old_k in victims]
+            self.evicted += len(victims)
+            await self.drop(victims)
+
+    async def drop(self, keys: List[str]):
+        # delete whole sessions (state and data) in one backend write
+        entries = {}
+        for k in keys:
+            self._sessions.pop(k, None)
+            self._reminded.discard(k)
+            entry = self._cache.pop(k, None) or [None, {}, None]
+            entry[0], entry[1], entry[2] = None, {}, self.FULL
+            entries[k] = entry
+        await self.flush(entries)
+
+    async def load_sessions(self):
+        # merged with the sessions already tracked (the journal replay runs first) and
+        # re-sorted: sweep() relies on the oldest-first order
+        listed = await self._list_sessions()
+        sessions = dict(self._sessions)
+        for k, ts in listed:
+            cached = self._cache.get(k)
+            if cached is not None and cached[0] is None:
+                continue  # finished since the backend was read
+            if self.owns is None or self.owns(k):
+                sessions[k] = max(ts, sessions.get(k, ts))
+        self._sessions = OrderedDict(sorted(sessions.items(), key=lambda item: item[1]))
+
+    async def sweep(self, remind_after: Optional[float] = None, batch: int = 500) -> List[Tuple[str, str]]:
+        # drops expired sessions; returns (key, state) of sessions idle for remind_after
+        # seconds that were not reminded yet
+        now = time.time()
+        to_expire, to_remind = [], []
+        for k, ts in self._sessions.items():  # oldest first: stop at the first fresh one
+            idle = now - ts
+            if self.ttl and idle >= self.ttl:
+                to_expire.append(k)
+            elif remind_after and idle >= remind_after:
+                if k not in self._reminded:
+                    to_remind.append(k)
+            else:
+                break
+        for i in range(0, len(to_expire), batch):
+            await self.drop(to_expire[i:i + batch])
+            self.expired += len(to_expire[i:i + batch])
+            await asyncio.sleep(0)  # let updates run between batches
+        reminders = []
+        for k in to_remind:
+            if k in self._sessions:
+                self._reminded.add(k)
+                reminders.append((k, (await self._entry(k))[0]))
+        return reminders
+
+    async def run_sweeper(
+        self,
+        interval: float = 60,
+        remind_after: Optional[float] = None,
+        on_remind: Optional[Callable[[StorageKey, str], Awaitable[Any]]] = None,
+        on_evict: Optional[Callable[[StorageKey, str], Awaitable[Any]]] = None,
+    ):
+        # on_remind: session idle for remind_after; on_evict: session dropped by the cap
+        self.on_evict = on_evict
+        await self.load_sessions()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted, self._evicted = self._evicted, []
+                for k, state in evicted:
+                    if state is None:
+                        continue
+                    try:
+                        await on_evict(parse_key(k), state)
+                    except Exception:
+                        logger.exception("Eviction notice for %s failed", k)
+                for k, state in await self.sweep(remind_after if on_remind else None):
+                    try:
+                        await on_remind(parse_key(k), state)
+                    except Exception:
+                        logger.exception("Reminder for %s failed", k)
+            except Exception:
+                logger.exception("FSM sweep failed")
+
+    def session_stats(self) -> Dict[str, int]:
+        return {"live": len(self._sessions), "expired": self.expired, "evicted": self.evicted}
+
+    # ---- BaseStorage ----
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = key_str(key)
+        entry = await self._entry(k)
+        entry[0] = state_str(state)
+        if entry[2] is None:
+            entry[2] = set()
+        await self._track(k, entry)
+        await self._touch(k, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key_str(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = key_str(key)
+        entry = await self._entry(k)
+        entry[1] = data.copy()
+        self._mark(entry)
+        await self._track(k, entry)
+        await self._touch(k, entry)
+
+    async def set_fields(self, key: StorageKey, fields: Dict[str, Any]) -> None:
+        # in-place update of a few data fields; only these fields are written to the backend
+        k = key_str(key)
+        entry = await self._entry(k)
+        entry[1].update(fields)
+        self._mark(entry, fields)
+        await self._track(k, entry)
+        await self._touch(k, entry)
+
+    async def get_field(self, key: StorageKey, field: str, default: Any = None) -> Any:
+        return (await self._entry(key_str(key)))[1].get(field, default)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        await self.set_fields(key, data)
+        return (await self._entry(key_str(key)))[1].copy()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key_str(key)))[1].copy()
+
+
+class SQLiteStorage(CachedStorage):
+    def __init__(self, path: str = "fsm.sqlite3", cache_size: int = 10000, **sessions):
+        super().__init__(cache_size=cache_size, **sessions)
+        # one worker thread owns the connection: sqlite calls never block the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, updated_at REAL)")
+        if "updated_at" not in {row[1] for row in self._db.execute("PRAGMA table_info(fsm)")}:
+            self._db.execute("ALTER TABLE fsm ADD COLUMN updated_at REAL")  # databases made before sessions
+        # one row per data field (rowid keeps insertion order)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_data (key TEXT NOT NULL, field TEXT NOT NULL, value TEXT, "
+            "UNIQUE (key, field))"
+        )
+
+    async def _run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _load_sync(self, k: str):
+        row = self._db.execute("SELECT state FROM fsm WHERE key = ?", (k,)).fetchone()
+        data = {
+            field: json.loads(value)
+            for field, value in self._db.execute("SELECT field, value FROM fsm_data WHERE key = ? ORDER BY rowid", (k,))
+        }
+        return (row[0] if row else None), data
+
+    def _store_sync(self, ops):
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN")
+            for k, state, fields, replace in ops:
+                if replace:
+                    self._db.execute("DELETE FROM fsm_data WHERE key = ?", (k,))
+                if replace and state is None and not fields:
+                    self._db.execute("DELETE FROM fsm WHERE key = ?", (k,))
+                    continue
+                self._db.execute(
+                    "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    (k, state, now),
+                )
+                self._db.executemany(
+                    "INSERT INTO fsm_data (key, field, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key, field) DO UPDATE SET value = excluded.value",
+                    [(k, f, v) for f, v in fields.items()],
+                )
+
+    async def _load(self, k: str):
+        return await self._run(self._load_sync, k)
+
+    async def _store(self, ops):
+        await self._run(self._store_sync, ops)
+
+    def _list_sessions_sync(self):
+        return self._db.execute(
+            "SELECT key, COALESCE(updated_at, 0) FROM fsm WHERE state IS NOT NULL ORDER BY updated_at"
+        ).fetchall()
+
+    async def _list_sessions(self):
+        return await self._run(self._list_sessions_sync)
+
+    async def close(self) -> None:
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+
+
+# ---- minimal RESP (Redis protocol) client: no extra dependency ----
+class RespError(Exception):
+    pass
+
+
+class RespClient:
+    def __init__(self, url: str = "redis://127.0.0.1:6379/0"):
+        u = urlparse(url)
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 6379
+        self.db = int((u.path or "/0").lstrip("/") or 0)
+        self.password = u.password
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            if not isinstance(a, bytes):
+                a = str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            body = await self._reader.readexactly(n + 2)
+            return body[:-2]
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [await self._read_reply() for _ in range(n)]
+        raise RespError(f"bad reply: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        init = []
+        if self.password:
+            init.append(("AUTH", self.password))
+        if self.db:
+            init.append(("SELECT", self.db))
+        if init:
+            await self._send(init)
+
+    async def _send(self, commands):
+        self._writer.write(b"".join(self._encode(c) for c in commands))
+        await self._writer.drain()
+        replies = [await self._read_reply() for _ in commands]
+        for r in replies:
+            if isinstance(r, RespError):
+                raise r
+        return replies
+
+    async def pipeline(self, commands):
+        # send all commands in one write, read all replies
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                await self._connect()
+            try:
+                return await self._send(commands)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self._writer = None
+                raise
+
+    async def execute(self, *args):
+        return (await self.pipeline([args]))[0]
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class RedisStorage(CachedStorage):
+    # <prefix>:<key>:state - string, <prefix>:<key>:data - hash field -> json,
+    # <prefix>:sessions - sorted set key -> last write time (keys with a state)
+    def __init__(self, url: str = "redis://127.0.0.1:6379/0", prefix: str = "fsm", cache_size: int = 10000,
+                 **sessions):
+        super().__init__(cache_size=cache_size, **sessions)
+        self.client = RespClient(url)
+        self.prefix = prefix
+
+    async def _load(self, k: str):
+        state, flat = await self.client.pipeline([
+            ("GET", f"{self.prefix}:{k}:state"),
+            ("HGETALL", f"{self.prefix}:{k}:data"),
+        ])
+        data = {flat[i].decode(): json.loads(flat[i + 1]) for i in range(0, len(flat or ()), 2)}
+        return (state.decode() if state else None), data
+
+    async def _store(self, ops):
+        now = time.time()
+        cmds = [("MULTI",)]
+        for k, state, fields, replace in ops:
+            sk, dk = f"{self.prefix}:{k}:state", f"{self.prefix}:{k}:data"
+            cmds.append(("SET", sk, state) if state is not None else ("DEL", sk))
+            if state is not None:
+                cmds.append(("ZADD", f"{self.prefix}:sessions", now, k))
+            else:
+                cmds.append(("ZREM", f"{self.prefix}:sessions", k))
+            if replace:
+                cmds.append(("DEL", dk))
+            if fields:
+                cmds.append(("HSET", dk, *(x for fv in fields.items() for x in fv)))
+        cmds.append(("EXEC",))
+        await self.client.pipeline(cmds)
+
+    async def _list_sessions(self):
+        flat = await self.client.execute("ZRANGE", f"{self.prefix}:sessions", 0, -1, "WITHSCORES")
+        return [(flat[i].decode(), float(flat[i + 1])) for i in range(0, len(flat or ()), 2)]
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class InMemoryStorage(CachedStorage):
+    # no disk: the "backend" is a dict (JSON per field, like the real backends), so only
+    # the session limits bound its size
+    def __init__(self, cache_size: int = 10000, **sessions):
+        super().__init__(cache_size=cache_size, **sessions)
+        self._rows: Dict[str, Tuple[Optional[str], Dict[str, str]]] = {}
+
+    async def _load(self, k: str):
+        state, fields = self._rows.get(k, (None, {}))
+        return state, {f: json.loads(v) for f, v in fields.items()}
+
+    async def _store(self, ops):
+        for k, state, fields, replace in ops:
+            if replace and state is None and not fields:
+                self._rows.pop(k, None)
+                continue
+            old = {} if replace else self._rows.get(k, (None, {}))[1]
+            self._rows[k] = (state, {**old, **fields})
+
+    async def close(self) -> None:
+        pass
+
+
+# ---- one write per update ----
+class CoalescingMiddleware(BaseMiddleware):
+    def __init__(self, storage: CachedStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = _pending.set({})
+        try:
+            return await handler(event, data)
+        finally:
+            pending = _pending.get()
+            _pending.reset(token)
+            if pending:
+                await self.storage.flush(pending)
+
+
+def build_storage() -> BaseStorage:
+    kind = config.FSM_STORAGE
+    sessions = {"ttl": config.FSM_SESSION_TTL or None, "max_sessions": config.FSM_MAX_SESSIONS or None}
+    if kind == "memory":
+        return InMemoryStorage(cache_size=config.FSM_CACHE_SIZE, **sessions)
+    if kind == "redis":
+        return RedisStorage(config.REDIS_URL, cache_size=config.FSM_CACHE_SIZE, **sessions)
+    return SQLiteStorage(config.FSM_SQLITE_PATH, cache_size=config.FSM_CACHE_SIZE, **sessions)
@@ -0,0 +1,94 @@
+# funnel.py
+# Per-question funnel: how many candidates reached each step, how many answered it and
+# how long the answer took (median / p95), per job type.
+#
+# Every event is an O(1) counter update in memory. Time-in-step goes into a fixed
+# log-scale histogram, so quantiles come from a few dozen numbers per step, never from
+# raw applications. A JsonStore writes the aggregates at most every `flush_every`
+# seconds; /stats only reads the in-memory table.
+import json
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from persist import JsonStore
+
+# upper bounds in seconds: 1 s .. ~2.5 days, each bucket x1.19 (quantiles within ~19%);
+# one more for anything longer
+BUCKETS = tuple(round(2 ** (i / 4), 2) for i in range(72))
+
+ALL_JOBS = "*"
+
+
+def quantile(hist: List[int], q: float) -> Optional[float]:
+    # upper bound of the bucket holding the q-quantile (None without data)
+    total = sum(hist)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(hist):
+        seen += n
+        if seen >= rank:
+            return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+    return float("inf")
+
+
+class Funnel:
+    def __init__(self, path: str = "funnel.json", flush_every: float = 30):
+        # job -> step key -> [entries, completions, *time histogram]
+        self.data: Dict[str, Dict[str, List[int]]] = {}
+        self.store = JsonStore(path, lambda: self.data, delay=flush_every)
+
+    def load(self):
+        self.data.update(self.store.load({}))
+
+    def _row(self, job: str, step: str) -> List[int]:
+        steps = self.data.setdefault(job or "-", {})
+        row = steps.get(step)
+        if row is None:
+            row = steps[step] = [0] * (2 + len(BUCKETS) + 1)
+        return row
+
+    def enter(self, job: str, step: str):
+        self._row(job, step)[0] += 1
+        self.store.mark_dirty()
+
+    def complete(self, job: str, step: str, seconds: Optional[float]):
+        row = self._row(job, step)
+        row[1] += 1
+        if seconds is not None and seconds >= 0:
+            row[2 + bisect_left(BUCKETS, seconds)] += 1
+        self.store.mark_dirty()
+
+    def jobs(self, peers: Iterable[dict] = ()) -> List[str]:
+        return sorted(set(self.data).union(*peers))
+
+    def report(
+        self, steps: Iterable[str], job: str = ALL_JOBS, peers: Iterable[dict] = (),
+    ) -> List[Tuple[str, int, int, Optional[float], Optional[float]]]:
+        # (step, entries, completions, median s, p95 s) in the given step order; peers:
+        # other processes' tables (read_data), merged in
+        tables = []
+        for data in (self.data, *peers):
+            tables += list(data.values()) if job == ALL_JOBS else [data.get(job, {})]
+        out = []
+        for step in steps:
+            rows = [t[step] for t in tables if step in t]
+            if not rows:
+                continue
+            merged = [sum(col) for col in zip(*rows)]
+            hist = merged[2:]
+            out.append((step, merged[0], merged[1], quantile(hist, 0.5), quantile(hist, 0.95)))
+        return out
+
+    async def close(self):
+        await self.store.close()
+
+
+def read_data(path) -> dict:
+    # another process's funnel file, read-only (as of its last flush)
+    try:
+        return json.loads(Path(path).read_text("utf-8"))
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,158 @@
+# http_pool.py
+# Bot API HTTP session with one connection pool per traffic class.
+#
+# aiogram's default session sends everything through one aiohttp connector: the long
+# poll, every small JSON reply and multi-megabyte uploads / downloads share its limit,
+# its 15s keep-alive and one timeout. Here each class has its own pool:
+#   poll  - getUpdates, held open for the long-poll timeout
+#   api   - small JSON methods (replies, callback answers, edits, notifications); long
+#           keep-alive, so the first replies after a quiet minute skip the TCP / TLS setup
+#   media - uploads (InputFile) and file downloads: few connections, long timeouts, a
+#           slow video never takes the connection a reply is waiting for
+# Timeouts are per method (config.HTTP_METHOD_TIMEOUTS), falling back to the pool's.
+# Every pool caches DNS answers for dns_ttl. aiohttp trace hooks count new vs reused
+# connections, waits for a free connection and DNS cache hits per pool for /metrics.
+import asyncio
+import contextvars
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram import Bot, __version__
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+from aiohttp import ClientSession, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+from metrics import InstrumentedSession
+
+POLL, API, MEDIA = "poll", "api", "media"
+
+# pool of the request being made (AiohttpSession.make_request asks create_session() for it)
+_pool: contextvars.ContextVar[str] = contextvars.ContextVar("http_pool", default=API)
+
+
+@dataclass
+class Pool:
+    limit: int        # connections; 0 = no limit
+    keepalive: float  # seconds an idle connection stays open
+    timeout: float    # request timeout unless the method has its own
+
+
+def has_upload(method: TelegramMethod) -> bool:
+    for name in method.model_fields:
+        value = getattr(method, name, None)
+        if isinstance(value, InputFile):
+            return True
+        if isinstance(value, list) and any(isinstance(getattr(v, "media", None), InputFile) for v in value):
+            return True  # sendMediaGroup
+    return False
+
+
+class PooledSession(InstrumentedSession):
+    def __init__(self, pools: Dict[str, Pool], method_timeouts: Optional[Dict[str, float]] = None,
+                 dns_ttl: int = 300, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.pools = pools
+        self.method_timeouts = method_timeouts or {}
+        self.dns_ttl = dns_ttl
+        self._sessions: Dict[str, ClientSession] = {}
+        self.counters: Dict[str, Dict[str, float]] = {name: defaultdict(int) for name in pools}
+
+    def traffic_class(self, method: TelegramMethod) -> str:
+        if isinstance(method, GetUpdates):
+            return POLL
+        return MEDIA if has_upload(method) else API
+
+    def _trace(self, name: str) -> TraceConfig:
+        c = self.counters[name]
+        loop = asyncio.get_running_loop()
+        trace = TraceConfig()
+
+        async def connect_start(session, ctx, params):
+            ctx.connect_at = loop.time()
+
+        async def connect_end(session, ctx, params):
+            c["new"] += 1
+            c["connect_seconds"] += loop.time() - ctx.connect_at
+
+        async def reused(session, ctx, params):
+            c["reused"] += 1
+
+        async def queued_start(session, ctx, params):
+            ctx.queued_at = loop.time()
+
+        async def queued_end(session, ctx, params):
+            c["queued"] += 1
+            c["queued_seconds"] += loop.time() - ctx.queued_at
+
+        async def dns_hit(session, ctx, params):
+            c["dns_hit"] += 1
+
+        async def dns_miss(session, ctx, params):
+            c["dns_miss"] += 1
+
+        trace.on_connection_create_start.append(connect_start)
+        trace.on_connection_create_end.append(connect_end)
+        trace.on_connection_reuseconn.append(reused)
+        trace.on_connection_queued_start.append(queued_start)
+        trace.on_connection_queued_end.append(queued_end)
+        trace.on_dns_cache_hit.append(dns_hit)
+        trace.on_dns_cache_miss.append(dns_miss)
+        return trace
+
+    async def create_session(self) -> ClientSession:
+        if self._should_reset_connector:  # proxy changed
+            await self.close()
+            self._should_reset_connector = False
+        name = _pool.get()
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            pool = self.pools[name]
+            connector = self._connector_type(
+                **self._connector_init,
+                limit=pool.limit,
+                keepalive_timeout=pool.keepalive,
+                ttl_dns_cache=self.dns_ttl,
+                enable_cleanup_closed=True,
+            )
+            session = self._sessions[name] = ClientSession(
+                connector=connector,
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{__version__}"},
+                trace_configs=[self._trace(name)],
+            )
+        return session
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None):
+        name = self.traffic_class(method)
+        if timeout is None:  # getUpdates brings its own: long-poll timeout + margin
+            timeout = self.method_timeouts.get(method.__api_method__, self.pools[name].timeout)
+        token = _pool.set(name)
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        finally:
+            _pool.reset(token)
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        # file downloads (bot.download_file) always go through the media pool
+        token = _pool.set(MEDIA)
+        try:
+            session = await self.create_session()
+        finally:
+            _pool.reset(token)
+        async with session.get(url, timeout=timeout, headers=headers or {}, raise_for_status=raise_for_status) as resp:
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def close(self):
+        sessions = [s for s in self._sessions.values() if not s.closed]
+        self._sessions = {}
+        if sessions:
+            await asyncio.gather(*(s.close() for s in sessions))
+            await asyncio.sleep(0.25)  # let the SSL connections close (as AiohttpSession does)
+
+    def stats(self) -> Dict[str, float]:
+        return {f"{pool}_{k}": round(v, 6) for pool, c in self.counters.items() for k, v in c.items()}
@@ -0,0 +1,280 @@
+# ledger.py
+# Restart without losing or repeating updates (replaces skip_updates).
+#
+# Telegram keeps unconfirmed updates for 24 h; polling confirms everything below the
+# offset of the next getUpdates. UpdateLedger makes a restart (deploy, crash) safe:
+#   - every admitted update is journaled as raw JSON until its handler has finished, and
+#     the journal is on disk before the next getUpdates (polling) or the webhook response
+#     confirms the update to Telegram;
+#   - finished update_ids are kept in a bounded window: a redelivered update (webhook
+#     retry, the same batch fetched again after a crash) is dropped, not answered twice;
+#   - for a chat in the middle of a form, the last update_id is also stored in its FSM
+#     data, in the same storage write as the handler's own changes, so an answer is
+#     never applied twice even if the window lost its last marks in a crash;
+#   - the journal is a log (persist.AppendLog): an update costs one "update" and one
+#     "done" line, a poll batch one "offset" line; the file is rewritten from the current
+#     state only once the log has grown a few times past it;
+#   - on start, journaled updates that never finished are fed again, then polling goes
+#     on from the saved offset; the backlog Telegram collected while the bot was down
+#     (getWebhookInfo.pending_update_count) goes through the normal handlers at
+#     drain_rate updates/s instead of being thrown away.
+# Messages a handler already sent before a crash may be sent again: only state changes
+# are tied to the update. Side effects outside the FSM key themselves on
+# current_update_id() (the archive: one application and one admin report per update).
+import asyncio
+import contextvars
+import inspect
+import logging
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.dispatcher.dispatcher import DEFAULT_BACKOFF_CONFIG
+from aiogram.methods import GetUpdates
+from aiogram.types import TelegramObject, Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from answers import get_field, set_field
+from persist import AppendLog
+
+logger = logging.getLogger(__name__)
+
+LAST_UPDATE = "_update_id"  # FSM data field: last update applied to this chat's form
+
+# update whose handler is running (set by UpdateLedger.done)
+_current: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("ledger_update", default=None)
+
+
+def current_update_id() -> Optional[int]:
+    return _current.get()
+
+
+class JournaledDispatcher(Dispatcher):
+    # polling reads updates through the installed ledger's listen(); aiogram's own reader
+    # (a private hook, checked by UpdateLedger.install) is used only without a ledger
+    ledger: Optional["UpdateLedger"] = None
+
+    def _listen_updates(self, bot: Bot, **kwargs: Any) -> AsyncGenerator[Update, None]:
+        if self.ledger is None:
+            return super()._listen_updates(bot, **kwargs)
+        return self.ledger.listen(bot, **kwargs)
+
+
+# Dispatcher._polling calls self._listen_updates(bot, polling_timeout=, backoff_config=,
+# allowed_updates=) in aiogram 3.4; listen() takes exactly these
+LISTEN_PARAMS = ("cls", "bot", "polling_timeout", "backoff_config", "allowed_updates")
+
+
+class UpdateLedger(BaseMiddleware):
+    def __init__(self, path: str = "update_ledger.json", window: int = 10000, drain_rate: float = 20, delay: float = 0.2):
+        self.window = window
+        self.drain_rate = drain_rate
+        self.offset: Optional[int] = None  # next getUpdates offset
+        self._done: Deque[int] = deque()
+        self._done_set: Set[int] = set()
+        self._active: Set[int] = set()      # admitted in this process, not finished yet
+        self.pending: Dict[int, dict] = {}  # journal: update_id -> raw update
+        self.store = AppendLog(path, self._snapshot, delay=delay)
+        self.on_finish: Optional[Callable[[int], None]] = None  # e.g. a shard worker's ack to the ingress
+        self.duplicates = 0
+        self.replayed = 0
+        self.drained = 0
+
+    # ---- state ----
+    def _snapshot(self) -> List[dict]:
+        # records of a compacted log
+        return [
+            {"offset": self.offset},
+            {"done": list(self._done)},
+            *({"update": raw} for raw in self.pending.values()),
+        ]
+
+    def load(self):
+        for record in self.store.load():
+            if "offset" in record:
+                self.offset = record["offset"]
+            if "update" in record:
+                raw = record["update"]
+                self.pending[raw["update_id"]] = raw
+            done = record.get("done", [])
+            for uid in done if isinstance(done, list) else [done]:
+                self.pending.pop(uid, None)
+                self._remember(uid)
+            for k, raw in record.get("pending", {}).items():  # a ledger file from before the log
+                self.pending[int(k)] = raw
+        if self.pending:
+            logger.info("Update journal: %d unfinished updates from the last run", len(self.pending))
+
+    def _remember(self, uid: int):
+        if uid in self._done_set:
+            return
+        if len(self._done) >= self.window:
+            self._done_set.discard(self._done.popleft())
+        self._done.append(uid)
+        self._done_set.add(uid)
+
+    def seen(self, uid: int) -> bool:
+        return uid in self._done_set or uid in self._active
+
+    def finish(self, uid: int):
+        self._active.discard(uid)
+        self.pending.pop(uid, None)
+        self._remember(uid)
+        self.store.append({"done": uid})
+        if self.on_finish:
+            self.on_finish(uid)
+
+    def admit(self, update: Update) -> Optional[dict]:
+        # raw update, journaled; None for a duplicate
+        uid = update.update_id
+        if self.seen(uid):
+            self.duplicates += 1
+            logger.info("Update id=%s dropped: already processed", uid)
+            if self.on_finish and uid in self._done_set:
+                self.on_finish(uid)  # the sender lost our first answer: repeat it
+            return None
+        self._active.add(uid)
+        raw = self.pending.get(uid)
+        if raw is None:
+            raw = self.pending[uid] = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+            self.store.append({"update": raw})
+        return raw
+
+    async def sync(self):
+        # journal on disk now (webhook: before the response confirms the update)
+        await self.store.flush()
+
+    # ---- middlewares ----
+    def install(self, dp: Dispatcher):
+        # fails loudly where polling would silently bypass the journal (plain Dispatcher,
+        # an aiogram whose update reader is not the one listen() replaces)
+        if not isinstance(dp, JournaledDispatcher):
+            raise TypeError("UpdateLedger needs a JournaledDispatcher")
+        reader = getattr(Dispatcher, "_listen_updates", None)
+        if reader is None or tuple(inspect.signature(reader.__func__).parameters) != LISTEN_PARAMS:
+            raise RuntimeError("aiogram's Dispatcher._listen_updates changed: UpdateLedger.listen no longer replaces it")
+        # first of our outer middlewares: a duplicate costs one set lookup
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+        dp.ledger = self
+        dp.startup.register(self._replay_journal)
+        dp.shutdown.register(self.store.close)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.admit(event) is None:
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            if not data.get("queued"):  # handled inline or dropped (anti-flood / shed)
+                self.finish(event.update_id)
+
+    async def done(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # innermost outer middleware (inside FSMContextMiddleware and the write coalescing):
+        # per-chat guard and the "finished" mark for updates the scheduler ran
+        uid = event.update_id
+        state = data.get("state")
+        token = _current.set(uid)
+        try:
+            if state is not None and data.get("raw_state"):
+                last = await get_field(state, LAST_UPDATE)
+                if last is not None and uid <= last:
+                    self.duplicates += 1
+                    logger.info("Update id=%s dropped: already applied to the form", uid)
+                    return None
+            result = await handler(event, data)
+            if state is not None and await state.get_state() is not None:
+                await set_field(state, LAST_UPDATE, uid)
+            return result
+        finally:
+            _current.reset(token)
+            if data.get("queued"):
+                self.finish(uid)
+
+    # ---- restart ----
+    async def _replay_journal(self, bot: Bot, dispatcher: Dispatcher, **kwargs: Any):
+        # updates admitted by the last run that never finished; the scheduler only queues
+        # them here, before polling can fetch any of them again
+        for uid in sorted(self.pending):
+            self.replayed += 1
+            await dispatcher.feed_raw_update(bot, self.pending[uid])
+        if self.replayed:
+            logger.info("Replayed %d journaled updates", self.replayed)
+
+    async def _backlog(self, bot: Bot) -> int:
+        try:
+            return (await bot.get_webhook_info()).pending_update_count
+        except Exception as e:
+            logger.warning("Can't read the pending update count: %s", e)
+            return 0
+
+    async def listen(
+        self,
+        bot: Bot,
+        polling_timeout: int = 30,
+        backoff_config: BackoffConfig = DEFAULT_BACKOFF_CONFIG,
+        allowed_updates: Optional[List[str]] = None,
+    ) -> AsyncGenerator[Update, None]:
+        # aiogram's update reader plus: offset from the ledger, journal on disk before an
+        # offset confirms updates, paced backlog
+        backoff = Backoff(config=backoff_config)
+        get_updates = GetUpdates(timeout=polling_timeout, allowed_updates=allowed_updates)
+        kwargs = {}
+        if bot.session.timeout:
+            kwargs["request_timeout"] = int(bot.session.timeout + polling_timeout)
+        backlog = await self._backlog(bot)
+        if backlog:
+            logger.info("Draining %d pending updates at %s/s", backlog, self.drain_rate or "max")
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        failed = False
+        while True:
+            await self.sync()  # journal of the last batch before its offset goes out
+            get_updates.offset = self.offset
+            try:
+                updates = await bot(get_updates, **kwargs)
+            except Exception as e:
+                failed = True
+                logger.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+                logger.warning("Sleep for %f seconds and try again... (tryings = %d)", backoff.next_delay, backoff.counter)
+                await backoff.asleep()
+                continue
+            if failed:
+                logger.info("Connection established (tryings = %d)", backoff.counter)
+                backoff.reset()
+                failed = False
+
+            for update in updates:
+                if backlog > 0:
+                    backlog -= 1
+                    self.drained += 1
+                    if self.drain_rate:
+                        delay = next_at - loop.time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        next_at = max(next_at, loop.time()) + 1 / self.drain_rate
+                    if not backlog:
+                        logger.info("Backlog drained")
+                yield update
+                self.offset = update.update_id + 1
+            if updates:
+                self.store.append({"offset": self.offset})
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "duplicates": self.duplicates,
+            "replayed": self.replayed,
+            "drained": self.drained,
+            "journal": len(self.pending),
+        }
@@ -0,0 +1,192 @@
+# logs.py
+# Logging off the event loop: QueueHandler on the loop, formatting and I/O in a thread.
+#
+# A logger call on the loop only copies the update context onto the record and puts it
+# on a bounded queue (full queue: the record is dropped and counted, the loop never
+# waits). A QueueListener thread formats the records (JSON lines, tracebacks included:
+# that reads source files) and writes them to stderr / LOG_FILE. Records made while an
+# update is handled carry update_id, user_id, the FSM state the update arrived in and
+# the ms since its handling started. Warnings and errors from one call site with the
+# same exception type are sampled: `burst` per `window` seconds, then only counted; the
+# next record let through says how many were suppressed.
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# update_id / user_id / state / started (perf_counter) of the update being handled
+_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("log_context", default=None)
+
+CONTEXT_FIELDS = ("update_id", "user_id", "state", "elapsed_ms", "suppressed")
+
+
+class LogContextMiddleware(BaseMiddleware):
+    # outer update middleware after the FSM one: raw_state is known; background jobs
+    # started by the handler (admin notifications) inherit the context
+    def install(self, dp: Dispatcher):
+        dp.update.outer_middleware(self)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        token = _context.set({
+            "update_id": getattr(event, "update_id", None),
+            "user_id": user.id if user else None,
+            "state": data.get("raw_state"),
+            "started": time.perf_counter(),
+        })
+        try:
+            return await handler(event, data)
+        finally:
+            _context.reset(token)
+
+
+class RepeatSampler(logging.Filter):
+    # let `burst` records of one (call site, level, exception type) through per window
+    def __init__(self, burst: int = 5, window: float = 60.0, min_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.min_level = min_level
+        self._keys: Dict[Tuple, list] = {}  # key -> [window start, passed, suppressed]
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level or not self.burst:
+            return True
+        exc = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        key = (record.name, record.levelno, record.pathname, record.lineno, exc)
+        now = record.created
+        slot = self._keys.get(key)
+        if slot is None or now - slot[0] >= self.window:
+            carried = slot[2] if slot else 0
+            slot = self._keys[key] = [now, 0, 0]
+            if carried:
+                record.suppressed = carried
+        if slot[1] >= self.burst:
+            slot[2] += 1
+            self.suppressed += 1
+            return False
+        slot[1] += 1
+        return True
+
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0  # records lost to a full queue
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # no formatting here: only what is gone once the call returns (the update context,
+        # mutable args); the traceback is rendered by the listener
+        ctx = _context.get()
+        if ctx is not None:
+            record.update_id = ctx["update_id"]
+            record.user_id = ctx["user_id"]
+            record.state = ctx["state"]
+            record.elapsed_ms = round((time.perf_counter() - ctx["started"]) * 1000, 1)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, static: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.static = static or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **self.static,
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                out[name] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    # console while developing: the usual line plus the context fields that are set
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = " ".join(f"{n}={getattr(record, n)}" for n in CONTEXT_FIELDS if getattr(record, n, None) is not None)
+        if not extra:
+            return line
+        head, sep, tail = line.partition("\n")  # keep a traceback below the first line
+        return f"{head} [{extra}]{sep}{tail}"
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", path: str = "", file_mb: float = 50, file_keep: int = 5,
+                  queue_size: int = 10000, burst: int = 5, window: float = 60.0,
+                  static: Optional[Dict[str, Any]] = None) -> LoopQueueHandler:
+    # replaces logging.basicConfig; the first call wins (bot.py and shard.py both call it)
+    global _listener
+    with _lock:
+        root = logging.getLogger()
+        for h in root.handlers:
+            if isinstance(h, LoopQueueHandler):
+                return h
+        formatter = JsonFormatter(static) if fmt == "json" else TextFormatter("%(levelname)s:%(name)s:%(message)s")
+        outputs = [logging.StreamHandler(sys.stderr)]
+        if path:
+            outputs.append(logging.handlers.RotatingFileHandler(
+                path, maxBytes=int(file_mb * 1024 ** 2), backupCount=file_keep, encoding="utf-8",
+            ))
+        for h in outputs:
+            h.setFormatter(formatter)
+        handler = LoopQueueHandler(queue.Queue(queue_size))
+        handler.addFilter(RepeatSampler(burst, window))
+        root.handlers = [handler]
+        root.setLevel(level)
+        _listener = logging.handlers.QueueListener(handler.queue, *outputs)
+        _listener.start()
+        atexit.register(stop_logging)
+        return handler
+
+
+def stop_logging():
+    # writes out what is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, int]:
+    for h in logging.getLogger().handlers:
+        if isinstance(h, LoopQueueHandler):
+            sampled = sum(f.suppressed for f in h.filters if isinstance(f, RepeatSampler))
+            return {"queued": h.queue.qsize(), "dropped": h.dropped, "suppressed": sampled}
+    return {}
@@ -0,0 +1,201 @@
+# media_archive.py
+# Background copies of candidates' voice / video answers on local disk.
+#
+# The form handler only puts the file on a bounded queue (no I/O, never waits). A few
+# worker tasks take it from there: claim the file in the archive by file_unique_id (the
+# same file sent twice, or seen by another worker process, is downloaded once), check
+# the size and disk quotas, then getFile + bot.download_file, which streams the body to
+# a .part file in chunks through aiofiles. Files land in <dir>/<user id>/<kind>-<file
+# unique id>.<ext>, so a recruiter can go through one folder per candidate. A claimed
+# file that was not finished (restart, crash) is downloaded again on the next start.
+import asyncio
+import logging
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+
+import aiofiles.os
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramServerError
+
+from archive import Archive
+from metrics import detach
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"voice": ".ogg", "video": ".mp4"}
+
+
+@dataclass
+class MediaJob:
+    file_id: str
+    file_unique_id: str
+    user_id: int
+    kind: str                    # questionnaire step kind: voice / video
+    size: Optional[int] = None   # as reported in the message, if any
+    claimed: bool = False        # already in the archive as pending (resumed after a restart)
+
+
+class MediaArchiver:
+    def __init__(self, bot: Bot, archive: Archive, directory: str, workers: int = 2, queue_size: int = 1000,
+                 max_file_bytes: int = 20 * 1024 ** 2, max_total_bytes: int = 0, min_free_bytes: int = 0,
+                 timeout: float = 120, chunk_size: int = 256 * 1024, retries: int = 3):
+        self.bot = bot
+        self.archive = archive
+        self.directory = Path(directory)
+        self.workers = workers
+        self.max_file_bytes = max_file_bytes    # Bot API getFile serves up to 20 MB
+        self.max_total_bytes = max_total_bytes  # all stored copies; 0 = no limit
+        self.min_free_bytes = min_free_bytes    # keep this much free on the disk
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._queued: Set[str] = set()  # file_unique_ids on the queue or in progress
+        self._tasks = []
+        self._used = 0       # bytes of finished copies
+        self._reserved = 0   # bytes of downloads in progress
+        # counters
+        self.saved = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def submit(self, media: Any, kind: str, user_id: int) -> bool:
+        # from the handler: Voice / Video / VideoNote of the answer; O(1), never waits
+        unique = media.file_unique_id
+        if unique in self._queued:
+            self.duplicates += 1
+            return False
+        try:
+            self.queue.put_nowait(MediaJob(media.file_id, unique, user_id, kind, getattr(media, "file_size", None)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Media queue full, %s of %s not archived", kind, user_id)
+            return False
+        self._queued.add(unique)
+        return True
+
+    async def start(self, owns: Callable[[int], bool] = lambda user_id: True):
+        await aiofiles.os.makedirs(self.directory, exist_ok=True)
+        self._used = await self.archive.media_bytes()
+        # claimed before a restart but never finished: these are already ours, no new claim
+        for unique, file_id, user_id, kind in await self.archive.pending_media():
+            if owns(user_id) and unique not in self._queued and not self.queue.full():
+                self._queued.add(unique)
+                self.queue.put_nowait(MediaJob(file_id, unique, user_id, kind, claimed=True))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # jobs still waiting: claim them now, the next start picks them up as pending
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            self._queued.discard(job.file_unique_id)
+            self.queue.task_done()
+            if not job.claimed:
+                await self.archive.claim_media(job.file_unique_id, job.file_id, job.user_id, job.kind)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "saved": self.saved,
+            "bytes": self.bytes,
+            "duplicates": self.duplicates,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+        }
+
+    async def _worker(self):
+        detach()
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._archive(job)
+            except asyncio.CancelledError:
+                raise  # the claim stays "pending": downloaded again on the next start
+            except Exception:
+                self.failed += 1
+                logger.exception("Archiving %s of %s failed", job.kind, job.user_id)
+            finally:
+                self._queued.discard(job.file_unique_id)
+                self.queue.task_done()
+
+    def _over_quota(self, size: int) -> Optional[str]:
+        if size > self.max_file_bytes:
+            return f"file too big ({size} bytes)"
+        if self.max_total_bytes and self._used + self._reserved + size > self.max_total_bytes:
+            return "media quota full"
+        if self.min_free_bytes and shutil.disk_usage(self.directory).free - size < self.min_free_bytes:
+            return "disk almost full"
+        return None
+
+    async def _archive(self, job: MediaJob):
+        if not job.claimed and not await self.archive.claim_media(
+                job.file_unique_id, job.file_id, job.user_id, job.kind):
+            self.duplicates += 1
+            return
+        reason = self._over_quota(job.size or 0)
+        if reason:
+            return await self._skip(job, reason)
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._download(job)
+            except TelegramBadRequest as e:  # unknown / expired file_id, too big for getFile
+                self.failed += 1
+                return await self.archive.media_finished(job.file_unique_id, "failed", error=e.message)
+            except (TelegramNetworkError, TelegramServerError, aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                gone = isinstance(e, aiohttp.ClientResponseError) and e.status < 500
+                if gone or attempt >= self.retries:
+                    self.failed += 1
+                    return await self.archive.media_finished(job.file_unique_id, "failed", error=repr(e))
+                logger.warning("Download of %s failed (%r), retry %d", job.file_unique_id, e, attempt + 1)
+                await asyncio.sleep(2 ** attempt)
+
+    async def _skip(self, job: MediaJob, reason: str):
+        self.skipped += 1
+        logger.warning("%s of %s not archived: %s", job.kind, job.user_id, reason)
+        await self.archive.media_finished(job.file_unique_id, "skipped", size=job.size, error=reason)
+
+    async def _download(self, job: MediaJob):
+        file = await self.bot.get_file(job.file_id)
+        size = file.file_size or job.size or 0
+        reason = self._over_quota(size) if file.file_size and file.file_size != job.size else None
+        if reason:
+            return await self._skip(job, reason)
+        if not file.file_path:
+            self.failed += 1
+            return await self.archive.media_finished(job.file_unique_id, "failed", error="no file_path")
+        folder = self.directory / str(job.user_id)
+        ext = Path(file.file_path).suffix or EXTENSIONS.get(job.kind, "")
+        dest = folder / f"{job.kind}-{job.file_unique_id}{ext}"
+        part = dest.with_name(dest.name + ".part")
+        await aiofiles.os.makedirs(folder, exist_ok=True)
+        self._reserved += size or self.max_file_bytes
+        try:
+            await self.bot.download_file(file.file_path, part, timeout=self.timeout, chunk_size=self.chunk_size)
+            written = (await aiofiles.os.stat(part)).st_size
+            await aiofiles.os.replace(part, dest)
+        except BaseException:
+            await asyncio.shield(_unlink(part))
+            raise
+        finally:
+            self._reserved -= size or self.max_file_bytes
+        self._used += written
+        self.saved += 1
+        self.bytes += written
+        await self.archive.media_finished(job.file_unique_id, "done", size=written, path=str(dest))
+
+
+async def _unlink(path: Path):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,260 @@
+# metrics.py
+# Latency metrics in Prometheus text format, served on a local aiohttp endpoint.
+#
+#   bot_update_seconds{type}            whole update, after the scheduler queue
+#   bot_update_stage_seconds{stage}     queue / storage_load / storage_store / api / handler
+#   bot_handler_seconds{handler,state}  handler time per FSM state
+#   bot_api_seconds{method,status}      every Bot API call (InstrumentedSession)
+#
+# Stage times of the update being processed are collected in a ContextVar, so storage
+# and API calls made deep inside a handler are attributed to it. With slow_ms set, an
+# update slower than that is logged with its per-stage breakdown.
+import contextvars
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# stage -> seconds for the update being processed
+_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("update_stages", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in self._series.items():
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            sep = "," if base else ""
+            total = 0
+            for le, n in zip(self.buckets + ("+Inf",), series):
+                total += n
+                out.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {total}')
+            out.append(f"{self.name}_sum{{{base}}} {series[-1]:.6f}")
+            out.append(f"{self.name}_count{{{base}}} {total}")
+        return out
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: List[Histogram] = []
+        # name -> (help, fn returning a number or {label value: number}, label name)
+        self.gauges: Dict[str, Tuple[str, Callable[[], Any], str]] = {}
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        h = Histogram(name, help, labels)
+        self.histograms.append(h)
+        return h
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any], label: str = "key"):
+        # read at scrape time: fn() -> number, or dict label value -> number
+        self.gauges[name] = (help, fn, label)
+
+    def render(self) -> str:
+        out = []
+        for h in self.histograms:
+            out += h.render()
+        for name, (help, fn, label) in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                logger.exception("Gauge %s failed", name)
+                continue
+            out += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            if isinstance(value, dict):
+                out += [f'{name}{{{label}="{_escape(k)}"}} {v}' for k, v in value.items()
+                        if isinstance(v, (int, float))]
+            else:
+                out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+update_seconds = registry.histogram("bot_update_seconds", "Update processing time", ("type",))
+stage_seconds = registry.histogram("bot_update_stage_seconds", "Time per stage of an update", ("stage",))
+handler_seconds = registry.histogram("bot_handler_seconds", "Handler time per FSM state", ("handler", "state"))
+api_seconds = registry.histogram("bot_api_seconds", "Bot API call time", ("method", "status"))
+
+
+def add_stage(stage: str, seconds: float):
+    stages = _stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def detach():
+    # background jobs started from a handler (admin notifications) inherit its context:
+    # their API time must not count as the update's
+    _stages.set(None)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - t0)
+
+
+def instrument_storage(storage):
+    # time backend reads / writes of a CachedStorage (instance attributes shadow the methods)
+    load, store = storage._load, storage._store
+
+    async def _load(k):
+        with stage("storage_load"):
+            return await load(k)
+
+    async def _store(ops):
+        with stage("storage_store"):
+            return await store(ops)
+
+    storage._load, storage._store = _load, _store
+
+
+class InstrumentedSession(AiohttpSession):
+    # times every API call as it goes over the wire (after the outbound scheduler's waits)
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None):
+        name = method.__api_method__
+        status = "ok"
+        t0 = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            if not isinstance(method, GetUpdates):  # long polling: its time means nothing
+                api_seconds.observe(elapsed, name, status)
+                add_stage("api", elapsed)
+                add_stage(f"api:{name}", elapsed)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # outer update middleware right after the scheduler: runs when the update's turn comes
+    def __init__(self, slow_ms: float = 0):
+        self.slow_ms = slow_ms
+        self.slow = 0
+
+    def install(self, dp: Dispatcher):
+        # before FSMContextMiddleware, so its state read is counted as storage time
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stages: Dict[str, float] = {}
+        if "queue_wait" in data:
+            stages["queue"] = data["queue_wait"]
+        token = _stages.set(stages)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _stages.reset(token)
+            kind = event.event_type if isinstance(event, Update) else type(event).__name__
+            update_seconds.observe(elapsed, kind)
+            for name, seconds in list(stages.items()):
+                if ":" not in name:  # per-method API time is in bot_api_seconds already
+                    stage_seconds.observe(seconds, name)
+            total = elapsed + stages.get("queue", 0.0)  # what the user waited
+            if self.slow_ms and total * 1000 >= self.slow_ms:
+                self.slow += 1
+                logger.warning(
+                    "Slow update id=%s %s: %.0f ms (%s)",
+                    getattr(event, "update_id", None), kind, total * 1000,
+                    ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in sorted(stages.items(), key=lambda kv: -kv[1])),
+                )
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # inner middleware (message / callback_query observers): handler name and FSM state
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - t0
+            h = data.get("handler")
+            name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+            handler_seconds.observe(elapsed, name, data.get("raw_state") or "none")
+            add_stage("handler", elapsed)
+
+
+class MetricsServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100):
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+def per_key(stats: Callable[[], Dict[str, Any]]) -> Callable[[], Dict[str, Any]]:
+    # stats() dicts may hold nested dicts (e.g. throttle drops per kind): flatten them
+    def fn():
+        flat: Dict[str, Any] = defaultdict(int)
+        for k, v in stats().items():
+            if isinstance(v, dict):
+                for sub, n in v.items():
+                    flat[f"{k}_{sub}"] = n
+            else:
+                flat[k] = v
+        return flat
+    return fn
@@ -0,0 +1,103 @@
+# notify.py
+# Background delivery of finished questionnaires to admins.
+#
+# finish_and_send only queues the report and answers the candidate right away. The job
+# sends to all admins concurrently (bounded), with admin priority in the outbound
+# scheduler. The report text rides as the voice caption when it fits, so an admin
+# gets 2 calls instead of 3 (Telegram cannot put voice and video in one media group).
+# Every admin is retried separately, and only the parts that failed are repeated.
+# A report with a report_id (the archive's outbox row) is acknowledged per admin through
+# on_delivered once that admin got it or retries ran out; what is not acknowledged is
+# sent again after a restart.
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Optional, Set
+
+from aiogram import Bot
+
+from metrics import detach
+from outbound import PRIORITY_ADMIN, priority
+
+logger = logging.getLogger(__name__)
+
+CAPTION_LIMIT = 1024
+VOICE_CAPTION = "📢 Nomzod ovozli javobi (9/22)"
+VIDEO_CAPTION = "🎥 Nomzod video javobi (11/22)"
+
+
+@dataclass
+class Report:
+    text: str
+    voice: Optional[str] = None   # file_id
+    video: Optional[str] = None   # file_id
+    parse_mode: Optional[str] = "Markdown"
+
+
+class AdminNotifier:
+    def __init__(self, bot: Bot, concurrency: int = 5, retries: int = 3, retry_delay: float = 2.0,
+                 on_delivered: Optional[Callable[[int, int], Awaitable]] = None):
+        self.bot = bot
+        self.on_delivered = on_delivered  # (report_id, admin_id)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._sem = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self.delivered = 0
+        self.failed = 0
+
+    def submit(self, admin_ids: Iterable[int], report: Report, report_id: Optional[int] = None) -> asyncio.Task:
+        task = asyncio.create_task(self._deliver(list(admin_ids), report, report_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _deliver(self, admin_ids: List[int], report: Report, report_id: Optional[int]):
+        detach()
+        with priority(PRIORITY_ADMIN):
+            await asyncio.gather(*(self._send_admin(a, report, report_id) for a in admin_ids))
+
+    def _parts(self, report: Report):
+        parts = []
+        merged = f"{report.text}\n\n{VOICE_CAPTION}"
+        if report.voice and len(merged) <= CAPTION_LIMIT:
+            parts.append(("voice", lambda a: self.bot.send_voice(a, report.voice, caption=merged, parse_mode=report.parse_mode)))
+        else:
+            parts.append(("text", lambda a: self.bot.send_message(a, report.text, parse_mode=report.parse_mode)))
+            if report.voice:
+                parts.append(("voice", lambda a: self.bot.send_voice(a, report.voice, caption=VOICE_CAPTION)))
+        if report.video:
+            parts.append(("video", lambda a: self.bot.send_video(a, report.video, caption=VIDEO_CAPTION)))
+        return parts
+
+    async def _send_admin(self, admin_id: int, report: Report, report_id: Optional[int] = None):
+        await self._send_parts(admin_id, report)
+        if report_id is not None and self.on_delivered:
+            try:
+                await self.on_delivered(report_id, admin_id)
+            except Exception:
+                logger.exception("Can't mark report %s delivered to admin %s", report_id, admin_id)
+
+    async def _send_parts(self, admin_id: int, report: Report):
+        pending = self._parts(report)
+        for attempt in range(self.retries + 1):
+            failed = []
+            async with self._sem:
+                for name, send in pending:
+                    try:
+                        await send(admin_id)
+                    except Exception:
+                        logger.exception("Failed to send %s to admin %s (attempt %d)", name, admin_id, attempt + 1)
+                        failed.append((name, send))
+            if not failed:
+                self.delivered += 1
+                return
+            pending = failed
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        self.failed += 1
+        logger.error("Admin %s did not get the report: %s", admin_id, ", ".join(n for n, _ in pending))
+
+    async def wait_closed(self, timeout: Optional[float] = 30):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
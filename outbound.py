@@ -0,0 +1,224 @@
+# outbound.py
+# Rate-limit-aware outbound scheduler for Bot API calls (aiogram request middleware).
+#
+# Send methods pass two token buckets before they go out: a global one (Telegram allows
+# ~30 messages/s per bot) and one per chat (~1 message/s). When the global bucket is
+# short, waiting requests are served by priority: candidate-facing replies first, admin
+# notifications after them (see priority()). TelegramRetryAfter pauses the chat for
+# retry_after and repeats the call; network and 5xx errors are retried with backoff.
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramEntityTooLarge, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CANDIDATE = 0
+PRIORITY_ADMIN = 10
+PRIORITY_BACKGROUND = 20  # reminders and other sends nobody is waiting for
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("send_priority", default=PRIORITY_CANDIDATE)
+
+
+@contextmanager
+def priority(value: int):
+    # sends made inside this block get the given priority
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_send(method: TelegramMethod) -> bool:
+    name = method.__api_method__
+    return name.startswith("send") or name in ("copyMessage", "copyMessages", "forwardMessage", "forwardMessages")
+
+
+class TokenBucket:
+    # FIFO bucket: a caller reserves a token (tokens may go negative) and sleeps its share
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = 0.0
+        self.blocked_until = 0.0
+        self.last_sent = 0.0
+
+    def _refill(self, now: float):
+        if self.ts:
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._refill(now)
+        self.tokens -= 1
+        delay = max(-self.tokens / self.rate if self.tokens < 0 else 0.0, self.blocked_until - now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def space(self):
+        # the global queue may have bunched this chat's sends together again
+        if self.burst > 1:
+            return
+        now = asyncio.get_running_loop().time()
+        at = max(now, self.last_sent + 1 / self.rate)
+        self.last_sent = at
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class PriorityBucket:
+    # global bucket: when tokens are short, waiters are released lowest priority value first
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = 0.0
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float):
+        if self.ts:
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    @property
+    def waiting(self) -> int:
+        return len(self._heap)
+
+    async def acquire(self, prio: int):
+        loop = asyncio.get_running_loop()
+        self._refill(loop.time())
+        if not self._heap and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        fut = loop.create_future()
+        heapq.heappush(self._heap, (prio, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await fut
+
+    async def _run_pump(self):
+        loop = asyncio.get_running_loop()
+        while self._heap:
+            self._refill(loop.time())
+            if self.tokens >= 1:
+                _, _, fut = heapq.heappop(self._heap)
+                if not fut.done():
+                    self.tokens -= 1
+                    fut.set_result(None)
+            else:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float = 30,
+        global_burst: float = 1,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        # any 1s window sees at most burst + rate sends, so keep the global burst small
+        self.global_bucket = PriorityBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: Dict[Any, TokenBucket] = {}
+        # counters
+        self.sent = 0
+        self.retry_after = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # forget idle chats (their bucket is full again) to keep memory bounded
+                now = asyncio.get_running_loop().time()
+                for k in [k for k, b in self._chats.items() if b.idle(now)]:
+                    del self._chats[k]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)  # polling has its own backoff
+
+        send = is_send(method)
+        chat_id = getattr(method, "chat_id", None)
+        prio = _priority.get()
+        attempt = 0
+        while True:
+            if send:
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                if bucket:
+                    await bucket.acquire()
+                await self.global_bucket.acquire(prio)
+                if bucket:
+                    await bucket.space()
+            try:
+                response = await make_request(bot, method)
+                if send:
+                    self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                logger.warning("%s to chat %s: retry after %ss", method.__api_method__, chat_id, e.retry_after)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).blocked_until = asyncio.get_running_loop().time() + e.retry_after
+                if not send or chat_id is None:
+                    # only a send waits in the chat bucket before its next try
+                    await asyncio.sleep(e.retry_after)
+            except TelegramEntityTooLarge:
+                self.failed += 1
+                raise
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                logger.warning("%s failed (%s), retry %d", method.__api_method__, e, attempt + 1)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            attempt += 1
+            self.retried += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "retried": self.retried,
+            "failed": self.failed,
+            "global_waiting": self.global_bucket.waiting,
+            "chats": len(self._chats),
+        }
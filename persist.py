@@ -0,0 +1,356 @@
+# persist.py
+# Small JSON persistence for runtime state (media file_ids, admin list, /setmedia waits,
+# the update journal).
+#
+# Writes are atomic (temp file + fsync + rename, so a crash leaves the old or the new
+# file, never half of one) and run in a thread, off the event loop. mark_dirty() only
+# schedules a write: a burst of changes within `delay` seconds becomes one write.
+#
+# Several worker processes (shard.py) share one file, so a write is per key: the
+# caller names what it changed (mark_dirty(("admins", 42)), mark_dirty(("q9",)));
+# the write locks the file, reads it, applies only those keys and writes it back. Keys
+# other workers changed in the meantime stay. merged() is the file with this process'
+# not yet written keys on top: what a reload after another worker's write must use.
+import asyncio
+import copy
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process anyway
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()  # the key is gone (deleted / not in the list)
+
+
+def write_atomic(path: Path, text: str):
+    fd, tmp = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        _unlink_quiet(tmp)
+        raise
+    # make the rename itself durable
+    try:
+        dir_fd = os.open(path.parent or ".", os.O_RDONLY)
+    except OSError:
+        return  # e.g. Windows: directories cannot be opened
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _unlink_quiet(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+# A key path walks dicts by key; its last element may also be a list item (admin ids):
+# then the value is the item itself, or MISSING when the list does not contain it.
+def get_path(obj: Any, path: Tuple) -> Any:
+    for key in path[:-1]:
+        obj = obj.get(key, MISSING) if isinstance(obj, dict) else MISSING
+    if isinstance(obj, list):
+        return path[-1] if path[-1] in obj else MISSING
+    return obj.get(path[-1], MISSING) if isinstance(obj, dict) else MISSING
+
+
+def set_path(obj: Dict, path: Tuple, value: Any, is_list: bool = False):
+    # is_list: create the missing parent of the last element as a list
+    *parents, last = path
+    for i, key in enumerate(parents):
+        obj = obj.setdefault(key, [] if is_list and i == len(parents) - 1 else {})
+    if isinstance(obj, list):
+        if value is MISSING:
+            if last in obj:
+                obj.remove(last)
+        elif last not in obj:
+            obj.append(last)
+    elif value is MISSING:
+        obj.pop(last, None)
+    else:
+        obj[last] = value
+
+
+def _copy(value: Any) -> Any:
+    return value if value is MISSING else copy.deepcopy(value)
+
+
+@contextmanager
+def file_lock(path: Path):
+    # the data file itself is replaced on every write: lock a sidecar file
+    if fcntl is None:
+        yield
+        return
+    with open(path.with_name(path.name + ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class JsonStore:
+    # snapshot(): returns the object to save; read on the loop right before a write.
+    # shared=True: a dict several processes write, per key (see the top of the file)
+    def __init__(self, path, snapshot: Callable[[], Any], delay: float = 1.0, shared: bool = False):
+        self.path = Path(path)
+        self.snapshot = snapshot
+        self.delay = delay
+        self.shared = shared
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._paths = set()     # shared: changed keys not written yet
+        self._writing = None    # what the write in progress writes
+        self._lock = asyncio.Lock()  # one write at a time: an older snapshot never lands last
+        self.on_written: Optional[Callable[[], None]] = None  # after each successful write
+        self.writes = 0
+
+    def load(self, default=None):
+        if not self.path.exists():
+            return default
+        try:
+            return json.loads(self.path.read_text("utf-8"))
+        except Exception:
+            # keep the broken file for inspection instead of overwriting it on next save
+            broken = self.path.with_name(self.path.name + ".broken")
+            logger.exception("Can't read %s, moved to %s", self.path, broken)
+            _unlink_quiet(str(broken))
+            os.replace(self.path, broken)
+            return default
+
+    def merged(self, default=None):
+        # shared: the file plus this process' changes that are not in it yet
+        data = self.load(default)
+        changes = {**(self._writing or {}), **self._changes()}
+        if changes and not isinstance(data, dict):
+            data = {}
+        for path, (value, is_list) in changes.items():
+            set_path(data, path, value, is_list)
+        return data
+
+    def mark_dirty(self, *paths: Tuple):
+        # shared store without paths: every top-level key of the snapshot
+        self._dirty = True
+        if self.shared:
+            self._paths.update(paths or [(k,) for k in self.snapshot()])
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            payload = self._take()
+            try:
+                self._write(payload)  # no loop (import time, scripts): write now
+            except Exception:
+                self._restore(payload)
+            return
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        # changes made during a write start another round
+        while self._dirty:
+            await asyncio.sleep(self.delay)
+            if not await self.flush():
+                return
+
+    async def flush(self) -> bool:
+        async with self._lock:
+            if not self._dirty:
+                return True
+            payload = self._writing = self._take()
+            try:
+                await asyncio.to_thread(self._write, payload)
+            except Exception:
+                self._restore(payload)  # try again with the next change or on shutdown
+                return False
+            finally:
+                self._writing = None
+            if self.on_written:
+                self.on_written()
+            return True
+
+    def _take(self):
+        # whole store: the JSON text; shared: {key path: (value, parent is a list)}
+        self._dirty = False
+        if not self.shared:
+            return self._dump()
+        changes = self._changes()
+        self._paths = set()
+        return changes
+
+    def _restore(self, payload):
+        self._dirty = True
+        if self.shared:
+            self._paths.update(payload)
+
+    def _changes(self) -> Dict[Tuple, Any]:
+        # copies: the write runs in a thread while handlers change the live objects
+        snap = self.snapshot()
+        return {
+            p: (_copy(get_path(snap, p)), len(p) > 1 and isinstance(get_path(snap, p[:-1]), list))
+            for p in self._paths
+        }
+
+    def _dump(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def _write(self, payload):
+        try:
+            if self.shared:
+                self._merge_write(payload)
+            else:
+                write_atomic(self.path, payload)
+            self.writes += 1
+        except Exception:
+            logger.exception("Can't write %s", self.path)
+            raise
+
+    def _merge_write(self, changes: Dict[Tuple, Any]):
+        # under the file lock: read what the other processes wrote, apply our keys, write
+        with file_lock(self.path):
+            data = self.load({})
+            if not isinstance(data, dict):
+                data = {}
+            for path, (value, is_list) in changes.items():
+                set_path(data, path, value, is_list)
+            write_atomic(self.path, json.dumps(data, ensure_ascii=False, indent=2))
+
+    async def close(self):
+        # shutdown: skip the debounce wait and write what is pending
+        task = self._task
+        if task and not task.done():
+            if self._writing is not None:
+                await asyncio.wait([task])  # a cancelled thread would still write, later than us
+            else:
+                task.cancel()
+        await self.flush()
+
+
+class AppendLog:
+    # JSON-lines journal for state that changes a little on every update (the update
+    # ledger). append() only serializes the record; a write appends the new lines and
+    # fsyncs, in a thread, so its cost follows the change, not the size of the state.
+    # Once the appended bytes outgrow `compact_factor` x the last compacted file (and
+    # min_compact_bytes), the file is rewritten atomically from snapshot(): the records
+    # that rebuild the current state. A line torn by a crash is cut off on load.
+    def __init__(self, path, snapshot: Callable[[], Iterable[Any]], delay: float = 0.2,
+                 compact_factor: float = 4, min_compact_bytes: int = 1024 ** 2):
+        self.path = Path(path)
+        self.snapshot = snapshot
+        self.delay = delay
+        self.compact_factor = compact_factor
+        self.min_compact_bytes = min_compact_bytes
+        self._buffer: List[str] = []  # serialized records not written yet
+        self._task: Optional[asyncio.Task] = None
+        self._writing = False
+        self._lock = asyncio.Lock()
+        self._base = 0      # file size after the last compaction
+        self._size = 0      # file size now
+        self._rewrite = False  # next write compacts (file not in log form)
+        self.writes = 0
+        self.compactions = 0
+
+    def load(self) -> List[Any]:
+        if not self.path.exists():
+            return []
+        text = self.path.read_text("utf-8")
+        self._base = self._size = len(text.encode("utf-8"))
+        try:
+            whole = json.loads(text)  # one record, or a file from before the log (one JSON object)
+            self._rewrite = not text.endswith("\n") or "\n" in text[:-1]
+            return [whole] if isinstance(whole, dict) else []
+        except ValueError:
+            pass
+        if not text.endswith("\n"):
+            # torn last line: drop it, or the next append would glue a record to it
+            keep = text[:text.rfind("\n") + 1]
+            logger.warning("%s: cut a torn last line (%d bytes)", self.path, len(text) - len(keep))
+            with open(self.path, "r+", encoding="utf-8") as f:
+                f.truncate(len(keep.encode("utf-8")))
+            text = keep
+            self._size = len(text.encode("utf-8"))
+        records = []
+        for n, line in enumerate(text.splitlines(), 1):
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning("%s: line %d unreadable, skipped", self.path, n)
+        return records
+
+    def append(self, record: Any):
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop (scripts): written by the next flush()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._buffer:
+            await asyncio.sleep(self.delay)
+            if not await self.flush():
+                return
+
+    async def flush(self) -> bool:
+        async with self._lock:
+            if not self._buffer:
+                return True
+            lines, self._buffer = self._buffer, []
+            appended = sum(len(line.encode("utf-8")) + 1 for line in lines)
+            compact = (self._rewrite or not self.path.exists()
+                       or self._size + appended - self._base > max(self.compact_factor * self._base,
+                                                                   self.min_compact_bytes))
+            if compact:
+                # the snapshot already holds everything the buffered records say
+                text = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+                               for r in self.snapshot())
+            self._writing = True
+            try:
+                if compact:
+                    await asyncio.to_thread(write_atomic, self.path, text)
+                    self._base = self._size = len(text.encode("utf-8"))
+                    self._rewrite = False
+                    self.compactions += 1
+                else:
+                    await asyncio.to_thread(self._append, lines)
+                    self._size += appended
+            except Exception:
+                logger.exception("Can't write %s", self.path)
+                self._buffer = lines + self._buffer  # try again with the next change or on shutdown
+                return False
+            finally:
+                self._writing = False
+            self.writes += 1
+            return True
+
+    def _append(self, lines: List[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def close(self):
+        task = self._task
+        if task and not task.done():
+            if self._writing:
+                await asyncio.wait([task])
+            else:
+                task.cancel()
+        await self.flush()
@@ -0,0 +1,103 @@
+# questionnaire.py
+# Declarative questionnaires: a table of steps run by one message and one callback handler.
+#
+# The current position is kept in the FSM state string itself ("form:<name>:<index>"),
+# so the handler finds its step from raw_state in O(1), without a storage read and
+# without one registered handler per question.
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram.filters import Filter
+from aiogram.types import (
+    CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message, ReplyKeyboardMarkup,
+)
+
+STATE_PREFIX = "form"
+
+# input kinds
+TEXT, PHONE, DATE, VOICE, VIDEO, CHOICE = "text", "phone", "date", "voice", "video", "choice"
+
+
+@dataclass(frozen=True)
+class Step:
+    key: str                                   # answer key in the admin report
+    prompt: str
+    kind: str = TEXT
+    validator: Optional[Callable[[str], bool]] = None
+    error: str = ""                            # reply when the input is rejected
+    options: Tuple[str, ...] = ()              # CHOICE: inline buttons
+    columns: int = 1                           # CHOICE: buttons per row
+    free_text: bool = True                     # CHOICE: typed answer is accepted too
+    keyboard: Optional[Callable[[], ReplyKeyboardMarkup]] = None  # reply keyboard sent with the prompt
+    media: str = ""                            # MEDIA key sent together with the prompt
+    media_type: str = ""                       # "voice" / "video"
+
+
+@dataclass
+class Questionnaire:
+    name: str
+    steps: List[Step]
+
+    def state(self, idx: int) -> str:
+        return f"{STATE_PREFIX}:{self.name}:{idx}"
+
+
+QUESTIONNAIRES: Dict[str, Questionnaire] = {}
+
+
+def register(q: Questionnaire) -> Questionnaire:
+    QUESTIONNAIRES[q.name] = q
+    return q
+
+
+def parse_state(raw_state: Optional[str]) -> Optional[Tuple[Questionnaire, int]]:
+    if not raw_state or not raw_state.startswith(STATE_PREFIX + ":"):
+        return None
+    _, name, idx = raw_state.split(":", 2)
+    q = QUESTIONNAIRES.get(name)
+    if q is None or not idx.isdigit() or int(idx) >= len(q.steps):
+        return None
+    return q, int(idx)
+
+
+def choice_kb(idx: int, step: Step) -> InlineKeyboardMarkup:
+    # callback_data carries the step index: a button from an older prompt is rejected
+    buttons = [InlineKeyboardButton(text=o, callback_data=f"ans|{idx}|{i}") for i, o in enumerate(step.options)]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + step.columns] for i in range(0, len(buttons), step.columns)])
+
+
+def parse_choice(data: str) -> Optional[Tuple[int, int]]:
+    parts = data.split("|")
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+        return None
+    return int(parts[1]), int(parts[2])
+
+
+def extract_answer(step: Step, message: Message) -> Union[Any, None]:
+    # value to store for this step, or None when the input does not fit the step
+    if step.kind == VOICE:
+        return message.voice.file_id if message.voice else None
+    if step.kind == VIDEO:
+        if message.video:
+            return message.video.file_id
+        return message.video_note.file_id if message.video_note else None
+    if step.kind == PHONE and message.contact and message.contact.phone_number:
+        return message.contact.phone_number
+    if step.kind == CHOICE and not step.free_text:
+        return None
+    if step.kind in (PHONE, DATE) and not message.text:
+        return None
+    text = (message.text or "").strip()
+    if step.validator and not step.validator(text):
+        return None
+    return text
+
+
+class InForm(Filter):
+    # passes when the user is inside a questionnaire; injects form, step_idx, step
+    async def __call__(self, event: Union[Message, CallbackQuery], raw_state: Optional[str] = None) -> Union[bool, Dict[str, Any]]:
+        pos = parse_state(raw_state)
+        if pos is None:
+            return False
+        q, idx = pos
+        return {"form": q, "step_idx": idx, "step": q.steps[idx]}
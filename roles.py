@@ -0,0 +1,23 @@
+# roles.py
+# Admin / candidate split of the handlers.
+#
+# Admin handlers live on their own Router with IsAdmin as a router-level filter: for a
+# candidate update it is one set lookup, after which the whole router is skipped.
+from typing import Optional, Set
+
+from aiogram.filters import Filter
+from aiogram.types import TelegramObject, User
+
+# commands served by the admin router; candidates get a short refusal instead
+ADMIN_COMMANDS = (
+    "setmedia", "getmedia", "list_admins", "add_admin", "remove_admin",
+    "find", "export", "sessions", "stats", "broadcast", "broadcast_stop",
+)
+
+
+class IsAdmin(Filter):
+    def __init__(self, ids: Set[int]):
+        self.ids = ids  # live set, kept in sync with config.ADMINS
+
+    async def __call__(self, event: TelegramObject, event_from_user: Optional[User] = None) -> bool:
+        return event_from_user is not None and event_from_user.id in self.ids
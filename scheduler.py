@@ -0,0 +1,125 @@
+# scheduler.py
+# Bounded, per-chat-ordered update execution.
+#
+# UpdateScheduler is an outer update middleware that sits before the FSM middleware:
+# an admitted update is queued behind earlier updates of the same chat and later run in
+# a per-chat drain task, so one candidate's messages never race on the FSM data while
+# different chats run in parallel (at most max_concurrent handlers at a time).
+#
+# The queue holds at most max_queue admitted-but-not-started updates. When it is full:
+#   "backpressure" - admission waits; polling / webhook feed updates without their own
+#                    tasks, so this holds getUpdates / the webhook response
+#   "shed"         - the update is dropped and counted
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateScheduler(BaseMiddleware):
+    def __init__(self, max_concurrent: int = 64, max_queue: int = 1000, overflow: str = "backpressure"):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self._slots = asyncio.Semaphore(max_queue)     # free places in the queue
+        self._workers = asyncio.Semaphore(max_concurrent)
+        self._chats: Dict[Any, Deque[tuple]] = {}       # chat -> updates waiting for its drain task
+        self._tasks: Set[asyncio.Task] = set()
+        # counters
+        self.queued = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.shed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def install(self, dp: Dispatcher):
+        # must run before FSMContextMiddleware: the state is read only when the update's turn comes
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+        # first shutdown handler: finish queued updates before the FSM storage is closed
+        dp.shutdown.handlers.insert(0, HandlerObject(callback=self.wait_closed))
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._slots.locked() and self.overflow == "shed":
+            self.shed += 1
+            logger.warning("Update id=%s shed: queue full (%d)", getattr(event, "update_id", None), self.queued)
+            return None
+        await self._slots.acquire()
+        self.queued += 1
+
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat else (user.id if user else None)
+        item = (handler, event, data, asyncio.get_running_loop().time())
+        data["queued"] = True  # outer middlewares before us: the handler runs later, in our task
+        if key is None:
+            self._spawn(self._run(item))
+        elif key in self._chats:
+            self._chats[key].append(item)
+        else:
+            self._chats[key] = deque([item])
+            self._spawn(self._drain(key))
+        return None
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key):
+        q = self._chats[key]
+        try:
+            while q:
+                await self._run(q.popleft())
+        finally:
+            del self._chats[key]
+
+    async def _run(self, item: tuple):
+        handler, event, data, enqueued = item
+        async with self._workers:
+            self.queued -= 1
+            self._slots.release()
+            wait = asyncio.get_running_loop().time() - enqueued
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            data["queue_wait"] = wait
+            self.running += 1
+            try:
+                await handler(event, data)
+            except Exception:
+                self.failed += 1
+                logger.exception("Cause exception while process update id=%s", getattr(event, "update_id", None))
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "active_chats": len(self._chats),
+            "processed": self.processed,
+            "failed": self.failed,
+            "shed": self.shed,
+            "wait_avg_ms": round(self.wait_total / self.processed * 1000, 2) if self.processed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+    async def wait_closed(self, timeout: Optional[float] = 30):
+        # let already admitted updates finish (graceful shutdown / deploy)
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
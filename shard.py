@@ -0,0 +1,319 @@
+# shard.py
+# Multi-process deployment: one ingress process and N bot workers, sharded by chat id.
+#
+#   python -m shard [--workers 4]        (polling, or webhook with BOT_MODE=webhook)
+#
+# The ingress receives updates (polling through the UpdateLedger: offset, journal, paced
+# backlog; or the webhook) and sends each one to worker `chat_id % N` over a Unix socket.
+# A chat always lands on the same worker, so its FSM cache, per-chat order and anti-flood
+# buckets stay local to one process. A worker is bot.py with its own event loop; it acks
+# every finished update and the ingress keeps unacked ones: when a worker dies, its
+# replacement gets them again (the worker's ledger drops the ones already applied).
+#
+# Shared between workers: the FSM storage (sqlite / redis; "memory" works as chats never
+# move, but is lost on restart) and the archive. Media file_ids and the admin list live
+# in the shared JSON files, written per changed key under a file lock (persist.py): the
+# worker that changed them tells the ingress after the write and the others reload them,
+# keeping their own changes that are not written yet.
+# Per worker: update ledger, funnel (/stats merges the other workers' files), metrics
+# port (METRICS_PORT + index) and 1/N of the global outbound rate.
+#
+# Wire format, one JSON object per line:
+#   worker -> ingress   {"hello": index} | {"done": update_id} | {"reload": true}
+#   ingress -> worker   {"update": {...}} | {"reload": true}
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+from aiohttp import web
+
+import config
+from ledger import UpdateLedger
+from logs import setup_logging
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ["message", "callback_query"]  # what bot.py handles
+REPO = Path(__file__).resolve().parent
+
+
+def shard_of(chat_id: int, count: int) -> int:
+    return chat_id % count
+
+
+def shard_key(update: Update) -> int:
+    # the chat the scheduler orders by (the user for chat-less updates)
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user else 0
+
+
+def shard_path(path: str, index: int, count: int) -> str:
+    # per-worker file: funnel.json -> funnel.w2.json (unchanged for a single process)
+    if count <= 1:
+        return path
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}.w{index}{p.suffix}"))
+
+
+def _line(msg: dict) -> bytes:
+    return (json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+# ---- ingress ----
+class Ingress:
+    def __init__(self, bot: Bot, ledger: UpdateLedger, workers: int, socket_path: str, max_inflight: int = 1000):
+        self.bot = bot
+        self.ledger = ledger
+        self.n = workers
+        self.socket_path = socket_path
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+        self._connected = {i: asyncio.Event() for i in range(workers)}
+        self._inflight: Dict[int, Dict[int, dict]] = {i: {} for i in range(workers)}  # shard -> uid -> raw
+        self._procs: Dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = False
+        self._conns = set()
+        self.forwarded = 0
+        self.restarts = 0
+
+    # ---- workers ----
+    async def _spawn(self, i: int):
+        # same working directory (relative data paths), modules from the repo
+        path = os.pathsep.join(filter(None, [str(REPO), os.environ.get("PYTHONPATH")]))
+        env = {
+            **os.environ, "PYTHONPATH": path,
+            "SHARD_INDEX": str(i), "SHARD_COUNT": str(self.n), "SHARD_SOCKET": self.socket_path,
+        }
+        self._procs[i] = await asyncio.create_subprocess_exec(sys.executable, "-m", "shard", "--worker", env=env)
+
+    async def _supervise(self, i: int):
+        while not self._stopping:
+            code = await self._procs[i].wait()
+            if self._stopping:
+                return
+            self.restarts += 1
+            logger.error("Worker %d exited with %s, restarting", i, code)
+            await asyncio.sleep(1)
+            await self._spawn(i)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._conns.add(task)
+        task.add_done_callback(self._conns.discard)
+        try:
+            i = json.loads(await reader.readline())["hello"]
+        except Exception:
+            writer.close()
+            return
+        self._writers[i] = writer
+        # what the previous process of this shard did not finish
+        for raw in list(self._inflight[i].values()):
+            writer.write(_line({"update": raw}))
+        self._connected[i].set()
+        logger.info("Worker %d connected (%d updates re-sent)", i, len(self._inflight[i]))
+        try:
+            async for line in reader:
+                msg = json.loads(line)
+                if "done" in msg:
+                    self._done(i, msg["done"])
+                elif "reload" in msg:
+                    for j, w in self._writers.items():
+                        if j != i:
+                            w.write(_line({"reload": True}))
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Worker %d connection: %s", i, e)
+        finally:
+            if self._writers.get(i) is writer:
+                del self._writers[i]
+                self._connected[i].clear()
+            writer.close()
+
+    def _done(self, i: int, uid: int):
+        if self._inflight[i].pop(uid, None) is not None:
+            self._slots.release()
+        self.ledger.finish(uid)
+
+    # ---- updates ----
+    async def forward(self, update: Update):
+        raw = self.ledger.admit(update)
+        if raw is None:
+            return
+        i = shard_of(shard_key(update), self.n)
+        await self._slots.acquire()  # backpressure: polling / the webhook response waits
+        self._inflight[i][update.update_id] = raw
+        await self._connected[i].wait()
+        writer = self._writers.get(i)
+        if writer is not None:  # else: re-sent on reconnect
+            writer.write(_line({"update": raw}))
+            await writer.drain()
+        self.forwarded += 1
+
+    async def _poll(self):
+        for uid in sorted(self.ledger.pending):  # journal of the last run
+            await self.forward(Update.model_validate(self.ledger.pending[uid], context={"bot": self.bot}))
+        async for update in self.ledger.listen(self.bot, allowed_updates=ALLOWED_UPDATES):
+            await self.forward(update)
+
+    async def _webhook(self) -> web.AppRunner:
+        async def handle(request: web.Request) -> web.Response:
+            if config.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != config.WEBHOOK_SECRET:
+                return web.Response(status=401)
+            await self.forward(Update.model_validate(await request.json(), context={"bot": self.bot}))
+            await self.ledger.sync()  # journaled on disk before the 200 confirms it to Telegram
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+        for uid in sorted(self.ledger.pending):
+            await self.forward(Update.model_validate(self.ledger.pending[uid], context={"bot": self.bot}))
+        if config.WEBHOOK_URL:
+            await self.bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET or None,
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=config.BACKLOG_MODE == "skip",
+            )
+        return runner
+
+    async def run(self):
+        with suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._on_connect, path=self.socket_path)
+        for i in range(self.n):
+            await self._spawn(i)
+        supervisors = [asyncio.create_task(self._supervise(i)) for i in range(self.n)]
+        await asyncio.gather(*(e.wait() for e in self._connected.values()))
+        logger.info("Ingress: %d workers ready (%s mode)", self.n, config.BOT_MODE)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop.set)
+        runner = None
+        if config.BOT_MODE == "webhook":
+            runner = await self._webhook()
+            source = None
+        else:
+            await self.bot.delete_webhook(drop_pending_updates=config.BACKLOG_MODE == "skip")
+            source = asyncio.create_task(self._poll())
+        stopped = asyncio.create_task(stop.wait())
+        await asyncio.wait([t for t in (source, stopped) if t], return_when=asyncio.FIRST_COMPLETED)
+        try:
+            if source and source.done():
+                source.result()  # polling crashed: raise it after the cleanup below
+        finally:
+            await self.shutdown(source, runner, server, supervisors)
+
+    async def shutdown(self, source: Optional[asyncio.Task], runner: Optional[web.AppRunner], server, supervisors):
+        self._stopping = True
+        if source:
+            source.cancel()
+            with suppress(asyncio.CancelledError):
+                await source
+        if runner:
+            await runner.cleanup()
+        # workers finish what they have (their shutdown waits for the scheduler), then exit
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                proc.send_signal(signal.SIGTERM)
+        await asyncio.gather(*(p.wait() for p in self._procs.values()))
+        for t in supervisors:
+            t.cancel()
+        if self._conns:  # the last acks, until each worker's connection closes
+            await asyncio.wait(set(self._conns), timeout=5)
+        server.close()
+        await self.ledger.store.close()
+        await self.bot.session.close()
+        with suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+        logger.info("Ingress stopped: %d updates forwarded, %d worker restarts", self.forwarded, self.restarts)
+
+
+async def run_ingress(workers: int):
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL)) if config.TELEGRAM_API_URL else None
+    bot = Bot(token=config.BOT_TOKEN, session=session)
+    ledger = UpdateLedger(config.UPDATE_LEDGER_PATH, window=config.UPDATE_DEDUPE_WINDOW, drain_rate=config.BACKLOG_RATE)
+    ledger.load()
+    await Ingress(bot, ledger, workers, config.SHARD_SOCKET, max_inflight=config.SHARD_MAX_INFLIGHT).run()
+
+
+# ---- worker ----
+async def run_worker():
+    import bot as B  # SHARD_INDEX / SHARD_COUNT are in the environment: bot.py configures itself
+
+    index = config.SHARD_INDEX
+    reader, writer = await asyncio.open_unix_connection(config.SHARD_SOCKET)
+
+    def send(msg: Dict[str, Any]):
+        if not writer.is_closing():
+            writer.write(_line(msg))
+
+    send({"hello": index})  # first line; acks of the startup journal replay follow it
+    B.ledger.on_finish = lambda uid: send({"done": uid})
+    B.media_store.on_written = B.state_store.on_written = lambda: send({"reload": True})
+    workflow = {"dispatcher": B.dp, "bots": [B.bot], **B.dp.workflow_data}
+    await B.dp.emit_startup(bot=B.bot, **workflow)
+
+    async def read():
+        async for line in reader:
+            msg = json.loads(line)
+            if "update" in msg:
+                await B.dp.feed_raw_update(B.bot, msg["update"])
+            elif "reload" in msg:
+                B.reload_shared_state()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    reading = asyncio.create_task(read())  # ends when the ingress goes away
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait([reading, stopped], return_when=asyncio.FIRST_COMPLETED)
+    reading.cancel()
+    stopped.cancel()
+    try:
+        await B.dp.emit_shutdown(bot=B.bot, **workflow)  # waits for queued updates, acks them
+        await writer.drain()
+    finally:
+        writer.close()
+        await B.bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ingress + N bot workers, sharded by chat id")
+    parser.add_argument("--workers", type=int, default=config.BOT_WORKERS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # one log file per process: RotatingFileHandler must not rotate a file another process writes
+    log_file = config.LOG_FILE and shard_path(config.LOG_FILE, config.SHARD_INDEX, config.SHARD_COUNT)
+    setup_logging(config.LOG_LEVEL, config.LOG_FORMAT, log_file, config.LOG_FILE_MB, config.LOG_FILE_KEEP,
+                  config.LOG_QUEUE, config.LOG_SAMPLE_BURST, config.LOG_SAMPLE_WINDOW,
+                  static={"shard": config.SHARD_INDEX} if args.worker else {"shard": "ingress"})
+    if args.worker:
+        asyncio.run(run_worker())
+    else:
+        asyncio.run(run_ingress(args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# tests/test_candidate_flow.py
+# End-to-end: a full candidate questionnaire (voice and video included) and the admin
+# /setmedia capture against the fake Bot API, in-process. Also checks the archive and
+# the funnel counters the form feeds.
+#
+#   python -m pytest tests/test_candidate_flow.py
+#
+# The inputs are built from the questionnaire's step table, so the test follows the form
+# when questions change (e.g. fails if a handler swallows the candidate's voice/video).
+import asyncio
+import importlib
+import os
+import socket
+import sys
+from pathlib import Path
+
+import pytest
+from aiogram.types import User
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.replay_flow import VIDEO_ID, VOICE_ID, setup_env, step_input  # noqa: E402
+
+CANDIDATE = 424242
+JOB = "HR"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def flow_env(tmp_path, monkeypatch):
+    # bot.py reads config on import: one configured import per test process
+    monkeypatch.chdir(tmp_path)  # undone after the test; setup_env moves into tmp_path too
+    saved = os.environ.copy()
+    port = free_port()
+    setup_env(str(tmp_path), port)
+    os.environ["METRICS_PORT"] = "0"
+    if "config" in sys.modules:  # imported by an earlier test module with other settings
+        importlib.reload(sys.modules["config"])
+    yield port
+    os.environ.clear()
+    os.environ.update(saved)
+
+
+async def replay(port: int):
+    import bench.fake_telegram as fake_mod
+    import questionnaire as kinds
+    import bot as B
+    from archive import iter_applications
+
+    B.throttle.limits = {}  # the replay answers faster than any human
+    fake = fake_mod.FakeTelegram()
+    await fake.start(port=port)
+    admin_id = B.config.ADMINS[0]
+    ids = iter(range(1, 10_000))
+
+    async def feed(update):
+        await B.dp.feed_raw_update(B.bot, update)
+
+    try:
+        if B.media_archiver:
+            await B.media_archiver.start()  # no dp startup here; the copies need their workers
+        # candidate: full form
+        form = B.questionnaire_for(JOB)
+        await feed(fake_mod.make_message_update(next(ids), CANDIDATE, "/start"))
+        await feed(fake_mod.make_callback_update(next(ids), CANDIDATE, f"job|{JOB}"))
+        for idx, step in enumerate(form.steps):
+            await feed(step_input(fake_mod, next(ids), CANDIDATE, idx, step, kinds))
+        # candidate cannot use admin commands; admin media capture still works
+        await feed(fake_mod.make_message_update(next(ids), CANDIDATE, "/setmedia q9_voice_prompt"))
+        await feed(fake_mod.make_message_update(next(ids), admin_id, "/setmedia q9_voice_prompt"))
+        await feed(fake_mod.make_message_update(
+            next(ids), admin_id, voice={"file_id": "ADMIN-VOICE", "file_unique_id": "ua", "duration": 1},
+        ))
+        await B.scheduler.wait_closed(60)
+        await B.notifier.wait_closed(60)
+        if B.media_archiver:
+            await asyncio.wait_for(B.media_archiver.queue.join(), 60)
+
+        key = B.dp.fsm.get_context(B.bot, CANDIDATE, CANDIDATE).key
+        assert await B.storage.get_state(key) is None, "candidate state not cleared"
+        apps = [a for a in iter_applications(B.archive.path) if a[2] == CANDIDATE]
+        assert len(apps) == 1
+        answers = apps[0][5]
+        assert [s.key for s in form.steps if s.key not in answers] == []
+        assert answers.get("Voice file_id") == VOICE_ID
+        assert answers.get("Video file_id") == VIDEO_ID
+        if B.media_archiver:
+            copies = dict(B.archive._db.execute("SELECT file_id, state FROM media WHERE user_id = ?", (CANDIDATE,)))
+            assert copies == {VOICE_ID: "done", VIDEO_ID: "done"}
+        to_admin = [m for chat, m, _ in fake.sent_log if chat == admin_id]
+        assert "sendVoice" in to_admin and "sendVideo" in to_admin, "admin report without the candidate's media"
+        assert B.MEDIA.get("q9_voice_prompt") == "ADMIN-VOICE", "admin /setmedia voice was not saved"
+        funnel = {key: (entered, answered) for key, entered, answered, _, _ in
+                  B.funnel.report([s.key for s in form.steps], JOB)}
+        assert [s.key for s in form.steps if funnel.get(s.key) != (1, 1)] == [], "funnel counters wrong"
+        assert B.scheduler.failed == 0, "updates failed in handlers"
+        # report lines in question order whatever order the storage returned the answers in
+        user = User(id=CANDIDATE, is_bot=False, first_name="Nomzod")
+        text = B.make_report(user, dict(reversed(list(answers.items()))), 1, None).text
+        reported = [line[1:line.index(":*")] for line in text.split("\n") if line.startswith("*") and ":*" in line]
+        assert reported == ["Ish turi"] + [s.key for s in form.steps if s.kind not in (kinds.VOICE, kinds.VIDEO)]
+    finally:
+        if B.media_archiver:
+            await B.media_archiver.close()
+        await B.bot.session.close()
+        await fake.stop()
+
+
+def test_candidate_flow(flow_env):
+    asyncio.run(replay(flow_env))
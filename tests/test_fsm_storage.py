@@ -0,0 +1,75 @@
+# tests/test_fsm_storage.py
+# CachedStorage write-back: a failed backend write must not lose the changed fields.
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+from fsm_storage import InMemoryStorage, key_str  # noqa: E402
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+def flaky(storage: InMemoryStorage, failures: int):
+    # the next `failures` backend writes raise, like a dropped Redis connection
+    store, left = storage._store, [failures]
+
+    async def _store(ops):
+        if left[0]:
+            left[0] -= 1
+            raise ConnectionError("redis connection closed")
+        await store(ops)
+    storage._store = _store
+
+
+async def backend_view(storage: InMemoryStorage):
+    storage._cache.clear()  # what a restart or a cache eviction reads
+    return await storage.get_state(KEY), await storage.get_data(KEY)
+
+
+def test_failed_field_write_is_retried():
+    async def run():
+        storage = InMemoryStorage()
+        await storage.set_state(KEY, "Form:q1")
+        flaky(storage, 1)
+        with pytest.raises(ConnectionError):
+            await storage.set_fields(KEY, {"answer:Telefon": "+998901234567"})
+        await storage.set_fields(KEY, {"answer:Ism": "Ali"})  # the form goes on
+        return await backend_view(storage)
+
+    state, data = asyncio.run(run())
+    assert state == "Form:q1"
+    assert data == {"answer:Telefon": "+998901234567", "answer:Ism": "Ali"}
+
+
+def test_failed_replace_wins_over_later_fields():
+    async def run():
+        storage = InMemoryStorage()
+        await storage.set_data(KEY, {"old": 1})
+        flaky(storage, 1)
+        with pytest.raises(ConnectionError):
+            await storage.set_data(KEY, {"new": 2})
+        await storage.set_fields(KEY, {"more": 3})
+        return await backend_view(storage)
+
+    _, data = asyncio.run(run())
+    assert data == {"new": 2, "more": 3}
+
+
+def test_failed_state_write_is_retried():
+    async def run():
+        storage = InMemoryStorage()
+        await storage.set_state(KEY, "Form:q1")
+        flaky(storage, 1)
+        with pytest.raises(ConnectionError):
+            await storage.set_state(KEY, "Form:q2")
+        await storage.flush({key_str(KEY): storage._cache[key_str(KEY)]})
+        return await backend_view(storage)
+
+    state, _ = asyncio.run(run())
+    assert state == "Form:q2"
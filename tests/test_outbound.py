@@ -0,0 +1,46 @@
+# tests/test_outbound.py
+# OutboundScheduler: TelegramRetryAfter is honoured before every retry, sends and edits alike.
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import DeleteMessage, EditMessageText, SendMessage  # noqa: E402
+
+from outbound import OutboundScheduler  # noqa: E402
+
+RETRY_AFTER = 0.2
+
+
+def gaps_between_tries(method, failures: int = 2):
+    # a Bot API that answers `failures` times with 429 retry_after, then succeeds
+    async def run():
+        scheduler = OutboundScheduler(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000)
+        loop = asyncio.get_running_loop()
+        tries = []
+
+        async def make_request(bot, m):
+            tries.append(loop.time())
+            if len(tries) <= failures:
+                raise TelegramRetryAfter(m, "Too Many Requests", RETRY_AFTER)
+            return True
+
+        assert await scheduler(make_request, None, method) is True
+        return [b - a for a, b in zip(tries, tries[1:])]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("method", [
+    SendMessage(chat_id=1, text="hi"),
+    DeleteMessage(chat_id=1, message_id=5),
+    EditMessageText(chat_id=1, message_id=5, text="50%"),
+])
+def test_retry_after_is_waited(method):
+    gaps = gaps_between_tries(method)
+    assert len(gaps) == 2
+    assert all(gap >= RETRY_AFTER * 0.9 for gap in gaps), gaps
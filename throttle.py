@@ -0,0 +1,135 @@
+# throttle.py
+# Per-user anti-flood: token bucket per (user, update kind), checked before anything else.
+#
+# ThrottlingMiddleware is an outer update middleware placed before the scheduler and the
+# FSM middleware, so an excess update costs a dict lookup: no queue slot, no storage
+# read, no handler. Only the first dropped update of a streak gets a short "slow down"
+# answer; every other dropped callback still gets an empty answerCallbackQuery, or the
+# client keeps its spinner until Telegram's timeout. Other dropped updates cost no API call.
+# Buckets live in an LRU table of at most max_users entries.
+import asyncio
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Container, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+WARNING = "⏳ Juda tez! Iltimos, biroz kuting."
+
+# kind -> (tokens per second, burst)
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "command": (0.2, 3),    # /start & co: 3 at once, then one per 5 s
+    "callback": (2, 6),
+    "media": (0.5, 4),
+    "message": (1, 5),      # text answers
+}
+
+
+def update_kind(update: Update) -> Optional[str]:
+    if update.callback_query:
+        return "callback"
+    msg = update.message
+    if msg is None:
+        return None
+    if msg.text and msg.text.startswith("/"):
+        return "command"
+    if msg.voice or msg.video or msg.video_note or msg.document or msg.photo or msg.audio:
+        return "media"
+    return "message"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_users: int = 100_000,
+        exempt: Container[int] = (),
+    ):
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self.max_users = max_users
+        self.exempt = exempt  # e.g. config.ADMINS (a live list)
+        # (user_id, kind) -> [tokens, last refill, warned]
+        self._buckets: "OrderedDict[Tuple[int, str], list]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.passed = 0
+        self.dropped: Dict[str, int] = defaultdict(int)
+
+    def install(self, dp: Dispatcher):
+        # before FSMContextMiddleware (it reads the state) and before the scheduler if that
+        # is installed later
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+
+    def allow(self, user_id: int, kind: str) -> Optional[list]:
+        # None if the update may pass, else its (empty) bucket
+        rate, burst = self.limits[kind]
+        now = time.monotonic()
+        key = (user_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_users:
+                self._buckets.popitem(last=False)  # least recently seen; idle buckets are full anyway
+            bucket = self._buckets[key] = [burst, now, False]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return None
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        kind = update_kind(event) if isinstance(event, Update) else None
+        if user is None or kind not in self.limits or user.id in self.exempt:
+            self.passed += 1
+            return await handler(event, data)
+        bucket = self.allow(user.id, kind)
+        if bucket is None:
+            self.passed += 1
+            return await handler(event, data)
+
+        self.dropped[kind] += 1
+        if not bucket[2]:
+            bucket[2] = True
+            logger.info("Throttling user %s (%s)", user.id, kind)
+            self._spawn(self._warn(event, data))
+        elif event.callback_query:
+            self._spawn(self._answer(event, data))
+        return None
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _warn(self, update: Update, data: Dict[str, Any]):
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(WARNING).as_(data["bot"])
+            else:
+                await update.message.answer(WARNING).as_(data["bot"])
+        except Exception:
+            logger.exception("Can't send throttling warning")
+
+    async def _answer(self, update: Update, data: Dict[str, Any]):
+        # no text: only stops the button's spinner
+        try:
+            await update.callback_query.answer().as_(data["bot"])
+        except Exception:
+            logger.exception("Can't answer throttled callback")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"passed": self.passed, "dropped": dict(self.dropped), "buckets": len(self._buckets)}
@@ -0,0 +1,75 @@
+# webhook.py
+# Webhook mode: aiohttp server that feeds Telegram updates straight into the Dispatcher.
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import config
+from ledger import UpdateLedger
+
+logger = logging.getLogger(__name__)
+
+
+class JournaledRequestHandler(SimpleRequestHandler):
+    # the 200 confirms the update to Telegram: the ledger's journal of it goes to disk
+    # first (one write for all the requests that arrived meanwhile)
+    def __init__(self, *args, ledger: Optional[UpdateLedger] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ledger = ledger
+
+    async def handle(self, request: web.Request) -> web.Response:
+        response = await super().handle(request)
+        if self.ledger is not None:
+            await self.ledger.sync()
+        return response
+
+
+def build_app(dp: Dispatcher, bot: Bot, ledger: Optional[UpdateLedger] = None) -> web.Application:
+    app = web.Application()
+    # handle_in_background=False: the request returns once the scheduler has queued the
+    # update, so a full queue delays the response and Telegram slows down delivery
+    JournaledRequestHandler(
+        ledger=ledger,
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=config.WEBHOOK_SECRET or None,
+    ).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, ledger: Optional[UpdateLedger] = None):
+    app = build_app(dp, bot, ledger)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_PATH)
+
+    if config.WEBHOOK_URL:
+        url = config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH
+        await bot.set_webhook(
+            url=url,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=config.BACKLOG_MODE == "skip",
+        )
+        logger.info("Webhook set: %s", url)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Webhook server stopping")
+        await runner.cleanup()